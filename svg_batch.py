@@ -0,0 +1,172 @@
+# Renders a batch of displacing ring graphs, described by a manifest, across a
+# pool of processes.
+#
+# The manifest is a JSON list of jobs, such as:
+#   [{"name": "pentagon", "vertices": 5, "coprime": 2,
+#     "options": {"html": true, "compact": true}}]
+# The supported options are html, formats, compact, precision, edge_style,
+# keyframes, optimize, hoist_styles and max_moves.
+#
+# Usage: python svg_batch.py MANIFEST [--output-dir DIR] [--processes N]
+#                            [--cache DIR [--cache-size BYTES]]
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import svg_cache
+import svg_code
+import svg_graph_generator
+
+# Job options that override settings of the graph generator, mapped to the
+# setting's name.
+SETTINGS = {
+  "html": "RENDER_HTML",
+  "formats": "RENDER_FORMATS",
+  "precision": "COORDINATE_PRECISION",
+  "edge_style": "EDGE_STYLE",
+  "keyframes": "KEYFRAMES",
+  "optimize": "OPTIMIZE_PASSES",
+  "hoist_styles": "HOIST_STYLES",
+}
+# Job options that are passed along to the generator and renderer instead.
+ARGUMENTS = frozenset(["compact", "max_moves"])
+
+# The outcome of a single job: either the file it wrote, or the error it hit.
+class JobResult(object):
+
+  def __init__(self, name, seconds, filename=None, error=None, cached=False,
+      evictions=0):
+    self.name = name
+    self.seconds = seconds
+    self.filename = filename
+    self.error = error
+    # Whether the file came from the render cache, and how many entries were
+    # evicted from it to make room for this one.
+    self.cached = cached
+    self.evictions = evictions
+
+  def __str__(self):
+    if self.error is not None:
+      return "{}: FAILED after {:.2f}s\n{}".format(
+        self.name, self.seconds, self.error)
+    return "{}: {:.2f}s -> {}{}".format(self.name, self.seconds, self.filename,
+      " (cached)" if self.cached else "")
+
+def loadManifest(filename):
+  with open(filename) as f:
+    jobs = json.load(f)
+  names = set()
+  for job in jobs:
+    for key in ["name", "vertices", "coprime"]:
+      assert key in job, "Job {} has no {}".format(job, key)
+    assert job["name"] not in names, "Job {} appears more than once" \
+      .format(job["name"])
+    names.add(job["name"])
+    for option in job.get("options", {}):
+      assert option in SETTINGS or option in ARGUMENTS, \
+        "{} is not a valid option of job {}".format(option, job["name"])
+  return jobs
+
+# Renders one job, going through the render cache in cache_dir if there is one.
+# Each worker process only runs one job at a time, so the job's settings can be
+# applied to the generator for its duration. Failures are reported rather than
+# raised, so that they don't take the batch down.
+def renderJob(job, directory="", validate=False, cache_dir=None,
+    cache_size=svg_cache.DEFAULT_MAX_BYTES):
+  start = time.time()
+  options = job.get("options", {})
+  saved = {}
+  saved_validate = svg_code.VALIDATE_PARAMS
+  try:
+    svg_code.VALIDATE_PARAMS = validate
+    for option, setting in SETTINGS.items():
+      if option in options:
+        saved[setting] = getattr(svg_graph_generator, setting)
+        setattr(svg_graph_generator, setting, options[option])
+    if cache_dir is not None:
+      cache = svg_cache.RenderCache(cache_dir, cache_size)
+      filename, cached = svg_cache.renderGraphCached(cache, job["name"],
+        job["vertices"], job["coprime"], options.get("compact", False),
+        options.get("max_moves"), directory)
+      return JobResult(job["name"], time.time() - start, filename=filename,
+        cached=cached, evictions=cache.evictions)
+    graph = svg_graph_generator.generateDisplacingRingGraph(
+      job["name"], job["vertices"], job["coprime"], options.get("max_moves"))
+    filename = graph.render(options.get("compact", False), directory)
+    return JobResult(job["name"], time.time() - start, filename=filename)
+  except Exception:
+    return JobResult(job["name"], time.time() - start,
+      error=traceback.format_exc())
+  finally:
+    svg_code.VALIDATE_PARAMS = saved_validate
+    for setting, value in saved.items():
+      setattr(svg_graph_generator, setting, value)
+
+# Pool workers take a single argument.
+def renderJobArgs(args):
+  return renderJob(*args)
+
+# Renders every job across a pool of processes (one per core, by default),
+# reporting each one as it finishes. Returns the JobResults, in the order the
+# jobs finished.
+def renderBatch(jobs, directory="", processes=None, validate=False,
+    cache_dir=None, cache_size=svg_cache.DEFAULT_MAX_BYTES):
+  if directory and not os.path.isdir(directory):
+    os.makedirs(directory)
+  results = []
+  pool = multiprocessing.Pool(processes)
+  try:
+    for result in pool.imap_unordered(renderJobArgs,
+        [(job, directory, validate, cache_dir, cache_size) for job in jobs]):
+      print(str(result))
+      results.append(result)
+  finally:
+    pool.close()
+    pool.join()
+  if cache_dir is not None:
+    # The workers' statistics are only saved from here, so that they don't
+    # race each other updating the totals.
+    cache = svg_cache.RenderCache(cache_dir, cache_size)
+    for result in results:
+      if result.error is None:
+        cache.hits += 1 if result.cached else 0
+        cache.misses += 0 if result.cached else 1
+      cache.evictions += result.evictions
+    print("Cache: {} hits, {} misses, {} evictions".format(
+      cache.hits, cache.misses, cache.evictions))
+    cache.saveStats()
+  return results
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description="Renders a manifest of graphs in parallel.")
+  parser.add_argument("manifest", help="JSON list of jobs to render.")
+  parser.add_argument("--output-dir", default="",
+    help="Directory to write the rendered graphs to.")
+  parser.add_argument("--processes", type=int, default=None,
+    help="Number of worker processes. Defaults to the number of cores.")
+  parser.add_argument("--validate", action="store_true",
+    help="Check every param against its element's schema (slower).")
+  parser.add_argument("--cache", default=None,
+    help="Directory of a render cache to reuse unchanged graphs from.")
+  parser.add_argument("--cache-size", type=int,
+    default=svg_cache.DEFAULT_MAX_BYTES,
+    help="Size, in bytes, that the render cache is kept within.")
+  args = parser.parse_args(argv)
+
+  start = time.time()
+  jobs = loadManifest(args.manifest)
+  results = renderBatch(jobs, args.output_dir, args.processes, args.validate,
+    args.cache, args.cache_size)
+  failures = [result for result in results if result.error is not None]
+  print("Rendered {} of {} graphs in {:.2f}s".format(
+    len(results) - len(failures), len(jobs), time.time() - start))
+  return 1 if failures else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,266 @@
+# Benchmarks of building and rendering trees of svg_code elements, and of
+# generating displacing ring graphs and the other graph families.
+#
+# Each benchmark is timed building its tree and rendering it (the best of a few
+# repeats), and measured for the size of its output and the peak memory it
+# took. Every benchmark runs in a fresh process, so that peak memory is its own.
+# Results are written as JSON, and can be compared against a baseline saved by
+# an earlier run, failing on any regression.
+#
+# Usage: python svg_benchmark.py [--output FILE] [--baseline FILE]
+#                                [--save-baseline FILE] [--only PATTERN]
+#                                [--repeat N] [--tolerance FRACTION]
+
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import platform
+import sys
+import timeit
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+from svg_code import *
+import svg_graph_generator
+
+# Default number of times each benchmark is run, keeping the best time.
+REPEAT = 3
+# How much worse than the baseline a measurement can get before it counts as a
+# regression, as a fraction of the baseline.
+TOLERANCE = 0.2
+# Smallest differences worth reporting, below which measurements are noise.
+MIN_SECONDS = 0.005
+MIN_PEAK_KB = 1024
+# Sizes of the synthetic trees.
+WIDE_CHILDREN = 20000
+DEEP_LEVELS = 150
+DEEP_TREES = 50
+HEAVY_PATHS = 2000
+HEAVY_SEGMENTS = 50
+# Displacing ring graphs, as (vertices, coprime). The first sweep grows the
+# graph, the second varies the coprime of a graph of fixed size.
+RING_SWEEP = [(5, 2), (8, 3), (13, 5), (21, 8), (34, 13), (55, 21)]
+COPRIME_SWEEP = [(21, 1), (21, 2), (21, 4), (21, 8), (21, 10)]
+# Displacing ring graphs that are also rendered straight from the graph (see
+# Graph.getStreamedSVG), as (vertices, coprime).
+STREAM_SWEEP = [(55, 21)]
+# Displacing grid graphs, as (rows, columns), and random graphs, as (vertices,
+# edges, moves).
+GRID_SWEEP = [(4, 4), (16, 16)]
+RANDOM_SWEEP = [(100, 200, 500), (1000, 2000, 5000)]
+
+# A sink that counts what's written to it, and throws it away.
+class CountingSink(object):
+
+  def __init__(self):
+    self.bytes = 0
+
+  def write(self, data):
+    self.bytes += len(data)
+
+# A single flat group of many small elements.
+def buildWideTree():
+  g = G().param("stroke", "black").param("stroke-width", 1)
+  for i in range(WIDE_CHILDREN):
+    g.child(Circle()
+      .id("c{}".format(i))
+      .center(i % 100 * 1.5, i // 100 * 1.5)
+      .radius(0.5)
+      .param("fill", "red"))
+  return Svg().param("width", 150).param("height", 450).child(g)
+
+# Many chains of nested groups, each ending in a line.
+def buildDeepTree():
+  svg = Svg().param("width", 100).param("height", 100)
+  for i in range(DEEP_TREES):
+    node = Line().start(0, i).end(100, i).param("stroke", "black")
+    for level in range(DEEP_LEVELS):
+      node = G().param("stroke-width", level % 5 + 1).child(node)
+    svg.child(node)
+  return svg
+
+# Paths with every param set and long path data.
+def buildHeavyTree():
+  g = G()
+  for i in range(HEAVY_PATHS):
+    d = PathData().command("M", i * 0.25, 0)
+    for j in range(HEAVY_SEGMENTS):
+      d.command("Q", i * 0.25 + j, j * 1.5, i * 0.25 + j + 0.5, j * 3.25)
+    g.child(Path()
+      .id("p{}".format(i))
+      .param("stroke", "black")
+      .param("stroke-width", 0.5)
+      .param("fill", "none")
+      .param("visibility", "visible")
+      .param("d", d))
+  return Svg().param("width", 600).param("height", 200).precision(2).child(g)
+
+# Builds a ring graph's SVG, generating the graph along the way.
+def buildRing(vertices, coprime):
+  graph = svg_graph_generator.generateDisplacingRingGraph(
+    "ring_{}_{}".format(vertices, coprime), vertices, coprime)
+  return graph.getSVG()
+
+# Generates a ring graph, and an SVG of it that's only built as it's rendered.
+def buildStreamedRing(vertices, coprime):
+  graph = svg_graph_generator.generateDisplacingRingGraph(
+    "ring_{}_{}".format(vertices, coprime), vertices, coprime)
+  return graph.getStreamedSVG()
+
+def buildGrid(rows, columns):
+  graph = svg_graph_generator.generateDisplacingGridGraph(
+    "grid_{}_{}".format(rows, columns), rows, columns)
+  return graph.getSVG()
+
+def buildRandom(vertices, edges, moves):
+  graph = svg_graph_generator.generateRandomGraph(
+    "random_{}_{}_{}".format(vertices, edges, moves), vertices, edges, moves,
+    seed=0)
+  return graph.getSVG()
+
+def getBenchmarks():
+  benchmarks = [
+    ("tree_wide", buildWideTree, ()),
+    ("tree_deep", buildDeepTree, ()),
+    ("tree_attributes", buildHeavyTree, ()),
+  ]
+  for vertices, coprime in RING_SWEEP + COPRIME_SWEEP:
+    name = "ring_{}_{}".format(vertices, coprime)
+    if name not in [benchmark[0] for benchmark in benchmarks]:
+      benchmarks.append((name, buildRing, (vertices, coprime)))
+  for vertices, coprime in STREAM_SWEEP:
+    benchmarks.append(("ring_streamed_{}_{}".format(vertices, coprime),
+      buildStreamedRing, (vertices, coprime)))
+  for rows, columns in GRID_SWEEP:
+    benchmarks.append(("grid_{}_{}".format(rows, columns), buildGrid,
+      (rows, columns)))
+  for vertices, edges, moves in RANDOM_SWEEP:
+    benchmarks.append(("random_{}_{}_{}".format(vertices, edges, moves),
+      buildRandom, (vertices, edges, moves)))
+  return benchmarks
+
+# Returns the peak resident memory of this process so far, in kilobytes, if
+# the platform can tell.
+def getPeakKb():
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports kilobytes, but macOS reports bytes.
+  return peak // 1024 if sys.platform == "darwin" else peak
+
+# Runs one benchmark, returning its name and measurements. Peak memory is that
+# of the first repeat, over what the process already held when it started.
+def runBenchmark(args):
+  name, build, build_args, repeat = args
+  start_kb = getPeakKb()
+  build_seconds = []
+  render_seconds = []
+  for _ in range(repeat):
+    start = timeit.default_timer()
+    svg = build(*build_args)
+    build_seconds.append(timeit.default_timer() - start)
+    sink = CountingSink()
+    start = timeit.default_timer()
+    svg.write(sink)
+    render_seconds.append(timeit.default_timer() - start)
+    if len(build_seconds) == 1:
+      peak_kb = None if start_kb is None else getPeakKb() - start_kb
+    svg = None
+  return name, {
+    "build_seconds": min(build_seconds),
+    "render_seconds": min(render_seconds),
+    "bytes": sink.bytes,
+    "peak_kb": peak_kb,
+  }
+
+# Runs the benchmarks whose names match only, a glob pattern (all of them, by
+# default), each in a process of its own. Returns the results, ready to be
+# dumped as JSON.
+def runBenchmarks(only=None, repeat=REPEAT):
+  benchmarks = [(name, build, build_args, repeat)
+    for name, build, build_args in getBenchmarks()
+    if only is None or fnmatch.fnmatchcase(name, only)]
+  assert benchmarks, "No benchmarks match {}".format(only)
+  results = {}
+  pool = multiprocessing.Pool(1, maxtasksperchild=1)
+  try:
+    for name, result in pool.imap(runBenchmark, benchmarks):
+      print("{}: build {:.3f}s, render {:.3f}s, {} bytes, peak {} KB".format(
+        name, result["build_seconds"], result["render_seconds"],
+        result["bytes"], result["peak_kb"]))
+      results[name] = result
+  finally:
+    pool.close()
+    pool.join()
+  return {
+    "python": platform.python_version(),
+    "machine": platform.machine(),
+    "benchmarks": results,
+  }
+
+# Compares results against a baseline, returning a description of every
+# regression. Timings and memory regress when they get worse by more than
+# the tolerance (and the noise floor), output size whenever it grows.
+def compareResults(results, baseline, tolerance=TOLERANCE):
+  regressions = []
+  for name, result in sorted(results["benchmarks"].items()):
+    base = baseline["benchmarks"].get(name)
+    if base is None:
+      continue
+    for metric, floor in [("build_seconds", MIN_SECONDS),
+        ("render_seconds", MIN_SECONDS), ("peak_kb", MIN_PEAK_KB),
+        ("bytes", 0)]:
+      value = result.get(metric)
+      base_value = base.get(metric)
+      if value is None or base_value is None:
+        continue
+      limit = base_value if metric == "bytes" else \
+        max(base_value * (1 + tolerance), base_value + floor)
+      if value > limit:
+        regressions.append("{}: {} went from {} to {}".format(
+          name, metric, base_value, value))
+  return regressions
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description="Benchmarks building and rendering SVGs.")
+  parser.add_argument("--output", default=None,
+    help="File to write the results to, as JSON.")
+  parser.add_argument("--baseline", default=None,
+    help="Results of an earlier run to check for regressions against.")
+  parser.add_argument("--save-baseline", default=None,
+    help="File to save the results to, as the baseline of later runs.")
+  parser.add_argument("--only", default=None,
+    help="Only run the benchmarks whose names match this exactly, or as a "
+      "glob pattern (e.g. 'ring_*').")
+  parser.add_argument("--repeat", type=int, default=REPEAT,
+    help="Number of times to run each benchmark, keeping the best time.")
+  parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+    help="Fraction by which measurements may get worse than the baseline.")
+  args = parser.parse_args(argv)
+  assert args.repeat > 0, "Benchmarks need to run at least once"
+
+  results = runBenchmarks(args.only, args.repeat)
+  for filename in [args.output, args.save_baseline]:
+    if filename is not None:
+      with atomicOpen(filename) as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+  if args.baseline is None:
+    return 0
+  with open(args.baseline) as f:
+    baseline = json.load(f)
+  regressions = compareResults(results, baseline, args.tolerance)
+  for regression in regressions:
+    print("REGRESSION {}".format(regression))
+  if regressions:
+    print("{} regressions against {}".format(len(regressions), args.baseline))
+    return 1
+  print("No regressions against {}".format(args.baseline))
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
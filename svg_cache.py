@@ -0,0 +1,215 @@
+# A persistent, content-addressed cache of rendered graphs.
+#
+# Entries are keyed by a hash of everything that goes into a rendered graph:
+# the generator's inputs, the settings of svg_graph_generator and svg_code, and
+# the source of the modules that render graphs. A hit skips generating and
+# rendering altogether, and just links (or copies) the cached file into place.
+# The cache is bounded in size, evicting the least recently used entries first.
+
+import hashlib
+import json
+import os
+import shutil
+
+import svg_code
+import svg_graph_generator
+import svg_optimize
+import svg_timeline
+
+# Default bound on the total size of the cache's entries.
+DEFAULT_MAX_BYTES = 1024 ** 3
+# Settings that affect rendered output, by module.
+SETTINGS = [
+  (svg_code, ["MAX_LINE_WIDTH", "PRECISION"]),
+  (svg_graph_generator, ["RENDER_HTML", "RENDER_FORMATS", "CENTER",
+    "SECONDS_PER_MOVE", "COORDINATE_PRECISION", "NODE_RADIUS",
+    "MAX_STROKE_WIDTH", "EDGE_STYLE", "KEYFRAMES", "KEY_TIME_PRECISION",
+    "HOIST_STYLES", "OPTIMIZE_PASSES", "STROKE_WIDTH", "RADIUS"]),
+  (svg_optimize, ["DEF_ID_PREFIX", "CLASS_PREFIX", "TIME_PRECISION"]),
+  # The timeline has no settings, but the optimization passes use it.
+  (svg_timeline, []),
+]
+# Name of the file holding the cache's cumulative statistics.
+STATS_FILE = "stats.json"
+
+# Hashes of the modules' source, which only need computing once per process.
+source_hashes = None
+
+def getSourceHashes():
+  global source_hashes
+  if source_hashes is None:
+    source_hashes = {}
+    for module, _ in SETTINGS:
+      filename = os.path.splitext(module.__file__)[0] + ".py"
+      with open(filename, "rb") as f:
+        source_hashes[module.__name__] = hashlib.sha256(f.read()).hexdigest()
+  return source_hashes
+
+# Settings can hold functions (e.g. optimization passes), which are keyed by
+# their qualified name. Their source is only hashed if their module is in
+# SETTINGS.
+def getSettingKey(value):
+  if callable(value):
+    return "{}.{}".format(value.__module__, value.__name__)
+  raise TypeError("{!r} is not a valid setting".format(value))
+
+# Returns the current value of every setting that affects rendered output.
+def getSettings():
+  settings = {}
+  for module, names in SETTINGS:
+    for name in names:
+      settings["{}.{}".format(module.__name__, name)] = getattr(module, name)
+  return settings
+
+class RenderCache(object):
+
+  def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    # Statistics for this instance. saveStats() adds them to the totals kept
+    # on disk.
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  # Returns the key of a render from the given inputs, under the current
+  # settings and sources.
+  def getKey(self, inputs):
+    description = json.dumps({
+      "inputs": inputs,
+      "settings": getSettings(),
+      "sources": getSourceHashes(),
+    }, sort_keys=True, default=getSettingKey)
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+  def getPath(self, key, extension):
+    return os.path.join(self.directory, "{}.{}".format(key, extension))
+
+  def has(self, key, extension):
+    return os.path.exists(self.getPath(key, extension))
+
+  # Places the cached entry at filename, returning whether there was one.
+  # Callers count hits and misses, since a render can need several entries.
+  def fetch(self, key, extension, filename):
+    path = self.getPath(key, extension)
+    if not os.path.exists(path):
+      return False
+    # Entries are evicted oldest first, so using one makes it new again.
+    os.utime(path, None)
+    # Outputs are always replaced (never written in place), so the cached
+    # file can safely be hard-linked. Link under a temporary name and rename
+    # it into place, so that the output never appears half-written.
+    temp_name = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+      os.link(path, temp_name)
+    except OSError:
+      shutil.copyfile(path, temp_name)
+    os.rename(temp_name, filename)
+    # Renaming over another link to the same file does nothing, leaving the
+    # temporary one behind.
+    if os.path.exists(temp_name):
+      os.remove(temp_name)
+    return True
+
+  # Copies a rendered file into the cache, unless it could never fit.
+  def store(self, key, extension, filename):
+    if os.path.getsize(filename) > self.max_bytes:
+      return
+    with svg_code.atomicOpen(self.getPath(key, extension), "wb") as f:
+      with open(filename, "rb") as source:
+        shutil.copyfileobj(source, f)
+    self.evict()
+
+  def getEntries(self):
+    entries = []
+    for name in os.listdir(self.directory):
+      if name == STATS_FILE or name.startswith("."):
+        continue
+      path = os.path.join(self.directory, name)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue  # Evicted by another process in the meantime.
+      entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+  # Removes the least recently used entries until the cache fits its bound.
+  def evict(self):
+    entries = sorted(self.getEntries())
+    size = sum(entry[1] for entry in entries)
+    for _, entry_size, path in entries:
+      if size <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+        self.evictions += 1
+      except OSError:
+        pass  # Evicted by another process in the meantime.
+      size -= entry_size
+
+  # Adds this instance's statistics to the totals on disk, and resets them.
+  def saveStats(self):
+    stats = self.loadStats()
+    stats["hits"] += self.hits
+    stats["misses"] += self.misses
+    stats["evictions"] += self.evictions
+    with svg_code.atomicOpen(os.path.join(self.directory, STATS_FILE)) as f:
+      json.dump(stats, f)
+    self.hits = self.misses = self.evictions = 0
+
+  def loadStats(self):
+    stats = {"hits": 0, "misses": 0, "evictions": 0}
+    try:
+      with open(os.path.join(self.directory, STATS_FILE)) as f:
+        stats.update(json.load(f))
+    except (IOError, OSError, ValueError):
+      pass
+    return stats
+
+  # Returns the cumulative statistics, including this instance's unsaved ones,
+  # along with the current number and total size of entries.
+  def getStats(self):
+    stats = self.loadStats()
+    stats["hits"] += self.hits
+    stats["misses"] += self.misses
+    stats["evictions"] += self.evictions
+    entries = self.getEntries()
+    stats["entries"] = len(entries)
+    stats["bytes"] = sum(entry[1] for entry in entries)
+    return stats
+
+# Renders a displacing ring graph into the given directory, like
+# generateDisplacingRingGraph(...).render(), unless an identical render is
+# already cached. Every format rendered is an entry of its own, but they're only
+# used if all of them are cached. Returns the name of the first rendered file,
+# and whether it came from the cache.
+def renderGraphCached(cache, name, vertices, coprime, compact=False,
+    max_moves=None, directory=""):
+  # The name isn't part of the output, so graphs that only differ in name
+  # share an entry.
+  key = cache.getKey({
+    "generator": "generateDisplacingRingGraph",
+    "vertices": vertices,
+    "coprime": coprime,
+    "max_moves": max_moves,
+    "compact": compact,
+  })
+  formats = svg_graph_generator.getFormats()
+  filenames = [os.path.join(directory, "{}.{}".format(name, extension))
+    for extension in formats]
+  # Only count a hit if every format can be fetched; otherwise the graph is
+  # rendered anyway. An entry evicted in the meantime still means a render.
+  if all(cache.has(key, extension) for extension in formats) and \
+      all([cache.fetch(key, extension, filename)
+        for extension, filename in zip(formats, filenames)]):
+    cache.hits += 1
+    return filenames[0], True
+  cache.misses += 1
+  graph = svg_graph_generator.generateDisplacingRingGraph(
+    name, vertices, coprime, max_moves)
+  graph.render(compact, directory, formats)
+  for extension, filename in zip(formats, filenames):
+    cache.store(key, extension, filename)
+  return filenames[0], False
@@ -1,33 +1,173 @@
 # Author: Daniel Gierl
 # This is a tool for creating SVG art.
 
+import array
+import contextlib
+import gzip
+import os
+import re
+import sys
+import tempfile
+import timeit
+import weakref
+
 # The tool will attempt (no guarantees) to generate lines that are at most this
 # many characters.
 MAX_LINE_WIDTH = 80
-
+# When streaming into a sink, rendered chunks are batched until there are at
+# least this many characters, so that the sink sees a few large writes rather
+# than one per tag.
+WRITE_BUFFER_SIZE = 64 * 1024
+# The number of decimal places that numeric attributes (coordinates, path data,
+# animation values, ...) are rounded to when rendered, document-wide. None
+# keeps full precision. Individual elements (and so their subtrees) can
+# override it with precision(), and so can a single render call.
+PRECISION = None
+# Whether params are checked against their element's ATTRIBUTES. Batch runs
+# whose code is known to be good can turn this off to skip the checks entirely.
+VALIDATE_PARAMS = True
+# The RenderProfile that renders are being recorded into, if any. Set it with
+# profileRender(); while it's None, renders aren't instrumented at all.
+PROFILE = None
+# Whether any element has cached its renderings (see cacheRender). Until one
+# has, there's nothing for a change to drop, and invalidate() does nothing.
+RENDER_CACHES = False
+
+# A set of params shared by many elements, so that e.g. thousands of animations
+# with the same timing don't each hold their own copy of it. Instances are
+# interned (see internParams), and are immutable.
+class ParamSet(object):
+
+  __slots__ = ("items", "__weakref__")
+
+  def __init__(self, items):
+    self.items = items
+
+# Interned ParamSets, keyed by their items. They're only kept alive by the
+# elements using them.
+INTERNED_PARAMS = weakref.WeakValueDictionary()
+
+# Returns the one ParamSet holding the given (key, value) pairs, in order.
+def internParams(*items):
+  param_set = INTERNED_PARAMS.get(items)
+  if param_set is None:
+    param_set = ParamSet(items)
+    INTERNED_PARAMS[items] = param_set
+  return param_set
+
+# Elements are slotted, since trees can hold millions of them.
 class XmlBase(object):
 
+  __slots__ = ("tag", "params", "shared", "digits", "parent", "render_cache")
+  # The schema of each element class is the set of params it accepts.
+  ATTRIBUTES = frozenset()
+
   def __init__(self, tag):
     self.tag = tag
+    # The element's own params, which take precedence over shared ones.
     self.params = {}
+    self.shared = None
+    self.digits = None
+    self.parent = None
+    # Renderings of the element, by render settings, if it caches them.
+    self.render_cache = None
 
   def param(self, key, value):
-    assert self.isValidParam(key), "{} is not a valid param in class {}" \
-      .format(key, type(self).__name__)
+    if VALIDATE_PARAMS:
+      assert self.isValidParam(key), "{} is not a valid param in class {}" \
+        .format(key, type(self).__name__)
     self.params[key] = value
+    self.invalidate()
     # Return self so that these commands can be chained.
     return self
 
-  def renderParams(self):
-    return ["%s=\"%s\"" % (k, v) for k, v in self.params.items()]
+  # Makes the element keep its rendering, which re-rendering then reuses for as
+  # long as nothing in its subtree changes. Meant for the subtrees of a large
+  # document that get re-rendered often, but rarely change.
+  def cacheRender(self, enabled=True):
+    global RENDER_CACHES
+    if enabled:
+      RENDER_CACHES = True
+    self.render_cache = {} if enabled else None
+    # Enclosing renderings were made without this cache, so they go too. That
+    # way the caches enclosing an empty cache are always empty themselves.
+    if self.parent is not None:
+      self.parent.invalidate()
+    return self
+
+  # Marks the element as changed, dropping the cached renderings of it and of
+  # everything enclosing it.
+  def invalidate(self):
+    if not RENDER_CACHES:
+      return
+    element = self
+    while element is not None:
+      if element.render_cache is not None:
+        if not element.render_cache:
+          # Everything enclosing an empty cache is already empty.
+          break
+        element.render_cache.clear()
+      element = element.parent
+
+  # Gives the element a shared set of params, created with internParams. Its
+  # own params still take precedence.
+  def shareParams(self, param_set):
+    if VALIDATE_PARAMS:
+      for key, _ in param_set.items:
+        assert self.isValidParam(key), "{} is not a valid param in class {}" \
+          .format(key, type(self).__name__)
+    self.shared = param_set
+    self.invalidate()
+    return self
+
+  def getParam(self, key, default=None):
+    if key in self.params:
+      return self.params[key]
+    if self.shared is not None:
+      for k, v in self.shared.items:
+        if k == key:
+          return v
+    return default
+
+  # Iterates over (key, value) pairs, shared params first.
+  def iterParams(self):
+    if self.shared is not None:
+      for k, v in self.shared.items:
+        if k not in self.params:
+          yield k, v
+    for item in self.params.items():
+      yield item
+
+  # Overrides the rendering precision for this element and its subtree.
+  def precision(self, digits):
+    self.digits = digits
+    self.invalidate()
+    return self
+
+  # Determines the precision to render with, given the one inherited from the
+  # enclosing element (or render call).
+  def resolvePrecision(self, precision):
+    if self.digits is not None:
+      return self.digits
+    return PRECISION if precision is None else precision
 
-  def render(self, prefix, is_leaf):
+  def renderParams(self, precision=None):
+    return ["%s=\"%s\"" % (k, formatValue(v, precision))
+      for k, v in self.iterParams()]
+
+  # Renders the opening tag. In compact mode there is no indentation and no
+  # line wrapping, so the line-length bookkeeping is skipped entirely.
+  def render(self, prefix, is_leaf, compact=False, precision=None):
     closing_cap = ("/" if is_leaf else "") + ">"
+    params = self.renderParams(self.resolvePrecision(precision))
+    if compact:
+      if len(params) == 0:
+        return "<" + self.tag + closing_cap
+      return "<" + self.tag + " " + " ".join(params) + closing_cap
     line = prefix + "<%s" % self.tag
     # If the list of params spills over to a new line, this is the length of
     # the prefix.
     new_line_prefix_len = len(line)
-    params = self.renderParams()
     if len(params) == 0:
       return line + closing_cap
     # In the event that we have params, fill lines with them until we go
@@ -47,226 +187,1028 @@ class XmlBase(object):
     return result
 
   def isValidParam(self, key):
-    return False
+    return key in self.ATTRIBUTES
+
+  # Yields the rendered element in chunks (roughly one per tag), without ever
+  # building the string for a whole subtree. Concatenating the chunks gives the
+  # same result as render(). An element that caches its rendering yields it as
+  # a single chunk.
+  def iterRender(self, prefix="", compact=False, precision=None):
+    precision = self.resolvePrecision(precision)
+    if self.render_cache is None:
+      chunks = self.iterTags(prefix, compact, precision)
+    else:
+      key = (prefix, compact, precision)
+      text = self.render_cache.get(key)
+      if text is None:
+        text = "".join(self.iterTags(prefix, compact, precision))
+        self.render_cache[key] = text
+      chunks = iter((text,))
+    if PROFILE is not None:
+      return PROFILE.profile(self, chunks)
+    return chunks
 
   def id(self, id):
     return self.param("id", id)
 
+  # Streams the rendered element into a writable sink (anything with a write()
+  # method: a file, a socket's makefile(), a BytesIO, ...). Nothing larger than
+  # WRITE_BUFFER_SIZE is ever held in memory. Binary sinks under Python 3 want
+  # bytes, in which case an encoding should be supplied.
+  def write(self, sink, prefix="", encoding=None, compact=False,
+      precision=None):
+    buf = []
+    size = 0
+    for chunk in self.iterRender(prefix, compact, precision):
+      buf.append(chunk)
+      size += len(chunk)
+      if size >= WRITE_BUFFER_SIZE:
+        data = "".join(buf)
+        sink.write(data if encoding is None else data.encode(encoding))
+        buf = []
+        size = 0
+    if buf:
+      data = "".join(buf)
+      sink.write(data if encoding is None else data.encode(encoding))
+
 class XmlLeaf(XmlBase):
 
-  def render(self, prefix):
-    return super(XmlLeaf, self).render(prefix, True) + "\n"
+  __slots__ = ()
+
+  def render(self, prefix, compact=False, precision=None):
+    if compact:
+      return super(XmlLeaf, self).render(prefix, True, True, precision)
+    return super(XmlLeaf, self).render(prefix, True, False, precision) + "\n"
+
+  # Leaves are rendered as a single chunk.
+  def iterTags(self, prefix, compact, precision):
+    yield self.render(prefix, compact, precision)
 
 class XmlNode(XmlBase):
 
+  __slots__ = ("children",)
+
   def __init__(self, tag):
     super(XmlNode, self).__init__(tag)
-    self.children = []
+    # Most nodes (e.g. animations) never get children, so the list is only
+    # allocated once they do.
+    self.children = ()
 
   def child(self, *children):
+    if not self.children:
+      self.children = list(children)
+    else:
+      self.children.extend(children)
     for child in children:
-      self.children.append(child)
+      child.parent = self
+    self.invalidate()
     # Return self so that these commands can be chained.
     return self
   
-  def render(self, prefix=""):
-    result = super(XmlNode, self).render(prefix, False) + "\n"
+  # In compact mode, the output has no indentation or line breaks, and nodes
+  # without contents are rendered as self-closing tags.
+  def render(self, prefix="", compact=False, precision=None):
+    return "".join(self.iterRender(prefix, compact, precision))
+
+  def iterTags(self, prefix, compact, precision):
+    if compact:
+      if not self.hasContents():
+        yield super(XmlNode, self).render(prefix, True, True, precision)
+        return
+      yield super(XmlNode, self).render(prefix, False, True, precision)
+      for chunk in self.iterContents(prefix, True, precision):
+        yield chunk
+      yield "</%s>" % self.tag
+      return
+    yield super(XmlNode, self).render(prefix, False, False, precision) + "\n"
+    for chunk in self.iterContents(prefix + "  ", False, precision):
+      yield chunk
+    yield prefix + "</%s>\n" % self.tag
+
+  def hasContents(self):
+    return len(self.children) > 0
+
+  # Yields everything between the opening and closing tags.
+  def iterContents(self, prefix, compact=False, precision=None):
     for child in self.children:
-      result += child.render(prefix + "  ")
-    result += prefix + "</%s>\n" % self.tag
-    return result
+      for chunk in child.iterRender(prefix, compact, precision):
+        yield chunk
+
+# Stands in for the children of a node, building each child only as it's
+# rendered, and dropping it right after. A document far larger than memory can
+# then be rendered from a model of it, one child at a time. The children are
+# built by build(idx), for idx from 0 to count - 1.
+class StreamedChildren(object):
+
+  __slots__ = ("count", "build")
+
+  def __init__(self, count, build):
+    self.count = count
+    self.build = build
+
+  def __len__(self):
+    return self.count
+
+  def __iter__(self):
+    for idx in range(self.count):
+      yield self.build(idx)
 
 class Html(XmlNode):
+
+  __slots__ = ()
   
   def __init__(self):
     super(Html, self).__init__("html")
 
-  def render(self):
-    return "<!DOCTYPE html>\n\n" + super(Html, self).render("")
+  def iterTags(self, prefix, compact, precision):
+    yield "<!DOCTYPE html>" if compact else "<!DOCTYPE html>\n\n"
+    for chunk in super(Html, self).iterTags(prefix, compact, precision):
+      yield chunk
 
 class Body(XmlNode):
 
+  __slots__ = ()
+
   def __init__(self):
     super(Body, self).__init__("body")
 
 class Svg(XmlNode):
 
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["width", "height", "viewBox", "xmlns", "xmlns:xlink"])
+
   def __init__(self):
     super(Svg, self).__init__("svg")
 
   def size(self, width, height):
-    self.param("width", "{}".format(width))
-    self.param("height", "{}".format(height))
+    self.param("width", width)
+    self.param("height", height)
     return self
 
-  def isValidParam(self, key):
-    return key in ["width", "height"]
-
 class Path(XmlNode):
 
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["id", "class", "stroke", "stroke-width", "d", "fill",
+    "visibility"])
+
   def __init__(self):
     super(Path, self).__init__("path")
 
+  # Accepts any mix of PathData fragments and raw path strings.
   def path(self, *args):
-    d = " ".join(args)
-    return self.param("d", d)
+    return self.param("d", PathData().extend(*args))
+
+# The number of coordinates taken by each path command.
+PATH_ARGUMENTS = {
+  "M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "T": 2, "Z": 0,
+}
+
+# Splits path strings into command letters, numbers and separators. Anything
+# else (e.g. arcs) is unsupported.
+PATH_TOKEN = re.compile(
+  r"([MmLlHhVvCcSsQqTtZz])|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|"
+  r"([\s,]+)|(.)")
+
+# Formats a number as briefly as possible. Without a precision, floats are
+# written in their shortest round-tripping form; with one, they are rounded to
+# that many decimal places and trailing zeros are stripped. Whole numbers that
+# are shorter in exponent notation (1e22 has 23 digits written out) are given
+# in it, unless exponent is off, as it must be for e.g. clock values.
+def formatNumber(value, precision=None, exponent=True):
+  if not isinstance(value, float):
+    return str(value)
+  if precision is not None:
+    text = "%.*f" % (precision, value)
+    if "." in text:
+      text = text.rstrip("0").rstrip(".")
+    if text == "-0":
+      return "0"
+  elif value.is_integer():
+    text = "%d" % value
+  else:
+    return repr(value)
+  if exponent and "." not in text and (text.endswith("000") or len(text) > 16):
+    # Past 1e16, repr is in exponent notation with the fewest digits that still
+    # round-trip, where writing the number out gives every digit of the float.
+    shortest = repr(float(text))
+    if "e" in shortest:
+      mantissa, power = shortest.split("e")
+      shortest = "{}e{}".format(mantissa, int(power))
+    else:
+      digits = text.rstrip("0")
+      shortest = "{}e{}".format(digits, len(text) - len(digits))
+    if len(shortest) < len(text):
+      return shortest
+  return text
+
+# Formats an attribute value for rendering. Numbers and path data respect the
+# precision, as do lists of them (e.g. the values of an animation), which are
+# separated by semicolons. Anything else is rendered as-is.
+def formatValue(value, precision=None):
+  if isinstance(value, float):
+    return formatNumber(value, precision)
+  if isinstance(value, PathData):
+    return value.serialize(precision)
+  if isinstance(value, list):
+    return ";".join(str(formatValue(v, precision)) for v in value)
+  return value
+
+# Path data, stored numerically rather than as text. Commands are kept exactly
+# as given (lowercase meaning relative), one byte each, with all of their
+# coordinates in a single flat array. Serializing happens once, when the path
+# is rendered, at which point each segment is written in whichever of its
+# absolute or relative forms is shorter, and repeated command letters are
+# dropped. Paths that are animated between need to keep the same commands for
+# browsers to interpolate them, so they can opt out of choosing the shorter
+# form.
+class PathData(object):
+
+  __slots__ = ("commands", "coords", "shortest")
+
+  def __init__(self, shortest=True):
+    self.commands = array.array("B")
+    self.coords = array.array("d")
+    self.shortest = shortest
+
+  def command(self, letter, *args):
+    assert letter.upper() in PATH_ARGUMENTS, \
+      "{} is not a supported path command".format(letter)
+    assert len(args) == PATH_ARGUMENTS[letter.upper()], \
+      "{} takes {} coordinates".format(letter, PATH_ARGUMENTS[letter.upper()])
+    self.commands.append(ord(letter))
+    self.coords.extend(args)
+    # Return self so that these commands can be chained.
+    return self
 
-  def isValidParam(self, key):
-    return key in ["id", "stroke", "stroke-width", "d", "fill", "visibility"]
+  # Appends other paths, given either as PathData or as path strings.
+  def extend(self, *fragments):
+    for fragment in fragments:
+      if isinstance(fragment, PathData):
+        self.commands.extend(fragment.commands)
+        self.coords.extend(fragment.coords)
+      else:
+        self.parse(fragment)
+    return self
+
+  # Appends the commands of a path string.
+  def parse(self, text):
+    letter = None
+    needs_args = False
+    args = []
+    for match in PATH_TOKEN.finditer(text):
+      command, number, separator, other = match.groups()
+      if separator is not None:
+        continue
+      if other is not None:
+        raise ValueError("Unsupported path data: {!r}".format(text))
+      if command is not None:
+        if needs_args:
+          raise ValueError("Truncated path data: {!r}".format(text))
+        letter = command
+        needs_args = command not in "Zz"
+        if not needs_args:
+          self.command(command)
+        continue
+      if letter is None or letter in "Zz":
+        raise ValueError("Unexpected number in path data: {!r}".format(text))
+      args.append(float(number))
+      if len(args) == PATH_ARGUMENTS[letter.upper()]:
+        self.command(letter, *args)
+        args = []
+        needs_args = False
+        # Coordinates after a move are implicit lines.
+        letter = {"M": "L", "m": "l"}.get(letter, letter)
+    if needs_args or args:
+      raise ValueError("Truncated path data: {!r}".format(text))
+    return self
+
+  def __len__(self):
+    return len(self.commands)
+
+  def copy(self):
+    return PathData(self.shortest).extend(self)
+
+  # Moves every absolute coordinate. Relative coordinates are unaffected by a
+  # translation, so they are left alone, except for a leading m: with no
+  # current point to be relative to, it is taken as absolute.
+  def translate(self, dx, dy):
+    idx = 0
+    for position, code in enumerate(self.commands):
+      letter = chr(code)
+      num = PATH_ARGUMENTS[letter.upper()]
+      if letter == "H":
+        self.coords[idx] += dx
+      elif letter == "V":
+        self.coords[idx] += dy
+      elif letter.isupper() or position == 0 and letter == "m":
+        for j in range(idx, idx + num, 2):
+          self.coords[j] += dx
+          self.coords[j + 1] += dy
+      idx += num
+    return self
+
+  def scale(self, sx, sy=None):
+    sy = sx if sy is None else sy
+    idx = 0
+    for code in self.commands:
+      letter = chr(code).upper()
+      num = PATH_ARGUMENTS[letter]
+      if letter == "H":
+        self.coords[idx] *= sx
+      elif letter == "V":
+        self.coords[idx] *= sy
+      else:
+        for j in range(idx, idx + num, 2):
+          self.coords[j] *= sx
+          self.coords[j + 1] *= sy
+      idx += num
+    return self
+
+  # Returns the same path using only absolute M, L, Q, C and Z commands, with
+  # the control points of smooth curves spelled out, which is simpler to draw.
+  def normalized(self):
+    result = PathData(self.shortest)
+    x = y = start_x = start_y = 0.0
+    # The last control point of the previous segment, if it was a curve, and
+    # the kind of curve ("C" or "Q") it was. Smooth curves reflect it.
+    control = None
+    kind = None
+    idx = 0
+    for code in self.commands:
+      letter = chr(code)
+      upper = letter.upper()
+      num = PATH_ARGUMENTS[upper]
+      args = list(self.coords[idx:idx + num])
+      idx += num
+      if letter != upper:
+        if upper == "H":
+          args[0] += x
+        elif upper == "V":
+          args[0] += y
+        else:
+          for j in range(0, num, 2):
+            args[j] += x
+            args[j + 1] += y
+      if upper == "Z":
+        result.command("Z")
+        x, y = start_x, start_y
+        kind = None
+        continue
+      if upper == "M":
+        result.command("M", *args)
+        x, y = start_x, start_y = args
+        kind = None
+        continue
+      if upper in "LHV":
+        if upper == "H":
+          args = [args[0], y]
+        elif upper == "V":
+          args = [x, args[0]]
+        result.command("L", *args)
+        x, y = args
+        kind = None
+        continue
+      curve = "C" if upper in "CS" else "Q"
+      if upper in "ST":
+        if kind == curve:
+          args = [2 * x - control[0], 2 * y - control[1]] + args
+        else:
+          args = [x, y] + args
+      result.command(curve, *args)
+      control = args[-4], args[-3]
+      kind = curve
+      x, y = args[-2], args[-1]
+    return result
 
-# These fragments are used to generate paths.
+  # Returns the path as polylines, a list of subpaths that are each a list of
+  # points and whether the subpath is closed. Curves are split into the given
+  # number of straight segments.
+  def flatten(self, curve_segments=16):
+    subpaths = []
+    points = None
+    x = y = 0.0
+    path = self.normalized()
+    idx = 0
+    for code in path.commands:
+      letter = chr(code)
+      num = PATH_ARGUMENTS[letter]
+      args = path.coords[idx:idx + num]
+      idx += num
+      if letter == "M":
+        if points is not None and len(points) > 1:
+          subpaths.append((points, False))
+        x, y = args
+        points = [(x, y)]
+        continue
+      if points is None:
+        points = [(x, y)]
+      if letter == "Z":
+        x, y = points[0]
+        subpaths.append((points, True))
+        points = [(x, y)]
+        continue
+      if letter == "L":
+        points.append((args[0], args[1]))
+      else:
+        for step in range(1, curve_segments + 1):
+          s = step / float(curve_segments)
+          r = 1 - s
+          if letter == "Q":
+            px = r * r * x + 2 * r * s * args[0] + s * s * args[2]
+            py = r * r * y + 2 * r * s * args[1] + s * s * args[3]
+          else:
+            px = r * r * r * x + 3 * r * r * s * args[0] + \
+              3 * r * s * s * args[2] + s * s * s * args[4]
+            py = r * r * r * y + 3 * r * r * s * args[1] + \
+              3 * r * s * s * args[3] + s * s * s * args[5]
+          points.append((px, py))
+      x, y = args[-2], args[-1]
+    if points is not None and len(points) > 1:
+      subpaths.append((points, False))
+    return subpaths
+
+  # With a precision, absolute coordinates are rounded, and relative ones are
+  # taken from the rounded position a reader will have reached, so that the
+  # rounding errors don't accumulate along the path.
+  def serialize(self, precision=None):
+    result = []
+    # The current point and the start of the current subpath, both exactly and
+    # as rendered.
+    x = y = start_x = start_y = 0.0
+    rx = ry = start_rx = start_ry = 0.0
+    # The command that a bare list of numbers would continue.
+    implicit = None
+    idx = 0
+    for code in self.commands:
+      letter = chr(code)
+      upper = letter.upper()
+      num = PATH_ARGUMENTS[upper]
+      args = self.coords[idx:idx + num]
+      idx += num
+      if num == 0:
+        result.append(upper)
+        x, y = start_x, start_y
+        rx, ry = start_rx, start_ry
+        implicit = None
+        continue
+      # Work out both forms of the segment. Without a precision, the given
+      # numbers are reused as-is for the form they were given in.
+      if upper == "H":
+        offsets, rendered_offsets = (x,), (rx,)
+      elif upper == "V":
+        offsets, rendered_offsets = (y,), (ry,)
+      else:
+        offsets = (x, y) * (num // 2)
+        rendered_offsets = (rx, ry) * (num // 2)
+      if letter == upper:
+        exact = list(args)
+      else:
+        exact = [a + o for a, o in zip(args, offsets)]
+      if precision is None:
+        absolute = exact
+        if letter == upper:
+          relative = [a - o for a, o in zip(args, offsets)]
+        else:
+          relative = list(args)
+      else:
+        absolute = [round(a, precision) for a in exact]
+        relative = [round(a - o, precision)
+          for a, o in zip(absolute, rendered_offsets)]
+      forms = ((upper, absolute), (upper.lower(), relative))
+      if not self.shortest:
+        forms = forms[:1] if letter == upper else forms[1:]
+      best = None
+      for form, values in forms:
+        text = self.renderSegment(form, values, form == implicit, precision)
+        if best is None or len(text) < len(best[1]):
+          best = (form, text)
+      result.append(best[1])
+      implicit = {"M": "L", "m": "l"}.get(best[0], best[0])
+      if upper == "H":
+        x, rx = exact[0], absolute[0]
+      elif upper == "V":
+        y, ry = exact[0], absolute[0]
+      else:
+        x, y = exact[-2], exact[-1]
+        rx, ry = absolute[-2], absolute[-1]
+      if upper == "M":
+        start_x, start_y = x, y
+        start_rx, start_ry = rx, ry
+    return "".join(result)
+
+  def renderSegment(self, letter, values, implicit, precision=None):
+    numbers = [formatNumber(v, precision) for v in values]
+    text = numbers[0]
+    for number in numbers[1:]:
+      text += number if number[0] == "-" else " " + number
+    if not implicit:
+      return letter + text
+    # Continuing the previous command only needs a separator, if that.
+    return text if text[0] == "-" else " " + text
+
+  def __str__(self):
+    return self.serialize()
+
+# These fragments are used to generate paths. They are thin wrappers which
+# each produce a single segment of PathData.
 def move(x, y):
-  return "M {} {}".format(x, y)
+  return PathData().command("M", x, y)
 
 def delta_move(dx, dy):
-  return "m {} {}".format(dx, dy)
+  return PathData().command("m", dx, dy)
 
 def line(x, y):
-  return "L {} {}".format(x, y)
+  return PathData().command("L", x, y)
 
 def delta_line(dx, dy):
-  return "l {} {}".format(dx, dy)
+  return PathData().command("l", dx, dy)
 
 def horizontal(x):
-  return "H {}".format(x)
+  return PathData().command("H", x)
 
 def delta_horizontal(dx):
-  return "h {}".format(dx)
+  return PathData().command("h", dx)
 
 def vertical(y):
-  return "V {}".format(y)
+  return PathData().command("V", y)
 
 def delta_vertical(dy):
-  return "v {}".format(dy)
+  return PathData().command("v", dy)
 
 def cubic_bezier(x1, y1, x2, y2, x, y):
-  return "C {} {}, {} {}, {} {}".format(x1, y1, x2, y2, x, y)
+  return PathData().command("C", x1, y1, x2, y2, x, y)
 
 def delta_cubic_bezier(dx1, dy1, dx2, dy2, dx, dy):
-  return "c {} {}, {} {}, {} {}".format(dx1, dy1, dx2, dy2, dx, dy)
+  return PathData().command("c", dx1, dy1, dx2, dy2, dx, dy)
 
 def smooth_cubic_bezier(x2, y2, x, y):
-  return "S {} {}, {} {}".format(x2, y2, x, y)
+  return PathData().command("S", x2, y2, x, y)
 
 def delta_smooth_cubic_bezier(dx2, dy2, dx, dy):
-  return "s {} {}, {} {}".format(dx2, dy2, dx, dy)
+  return PathData().command("s", dx2, dy2, dx, dy)
 
 def quadratic_bezier(x1, y1, x2, y2):
-  return "Q {} {}, {} {}".format(x1, y1, x2, y2)
+  return PathData().command("Q", x1, y1, x2, y2)
 
 def delta_quadratic_bezier(dx1, dy1, dx2, dy2):
-  return "q {} {}, {} {}".format(dx1, dy1, dx2, dy2)
+  return PathData().command("q", dx1, dy1, dx2, dy2)
 
 def smooth_quadratic_bezier(x, y):
-  return "T {} {}".format(x, y)
+  return PathData().command("T", x, y)
 
 def delta_smooth_quadratic_bezier(dx, dy):
-  return "t {} {}".format(dx, dy)
+  return PathData().command("t", dx, dy)
 
 def close():
-  return "Z"
+  return PathData().command("Z")
 
 class Text(XmlNode):
 
+  __slots__ = ("text",)
+  ATTRIBUTES = frozenset(["id", "class", "x", "y", "dx"])
+
   def __init__(self, text):
     super(Text, self).__init__("text")
     self.text = text
 
-  def render(self, prefix):
-    # Small modification of the XmlNode render function, which adds
-    # rendering the element's text.
-    result = super(XmlNode, self).render(prefix, False) + "\n"
-    result += prefix + "  " + self.text + "\n"
-    for child in self.children:
-      result += child.render(prefix + "  ")
-    result += prefix + "</%s>\n" % self.tag
-    return result
+  def hasContents(self):
+    return True
 
-  def isValidParam(self, key):
-    return key in ["x", "y", "dx"]
+  def iterContents(self, prefix, compact=False, precision=None):
+    # Small modification of the XmlNode contents, which adds rendering the
+    # element's text.
+    yield self.text if compact else prefix + self.text + "\n"
+    for chunk in super(Text, self).iterContents(prefix, compact, precision):
+      yield chunk
 
   def corner(self, x, y):
-    self.param("x", "{}".format(x))
-    self.param("y", "{}".format(y))
+    self.param("x", x)
+    self.param("y", y)
     return self
 
 class Circle(XmlNode):
 
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["id", "class", "cx", "cy", "r", "stroke",
+    "stroke-width", "fill"])
+
   def __init__(self):
     super(Circle, self).__init__("circle")
 
-  def isValidParam(self, key):
-    return key in ["id", "cx", "cy", "r", "stroke", "stroke-width", "fill"]
-
   def center(self, cx, cy):
-    self.param("cx", "{}".format(cx))
-    self.param("cy", "{}".format(cy))
+    self.param("cx", cx)
+    self.param("cy", cy)
     return self
 
   def radius(self, r):
-    return self.param("r", "{}".format(r))
+    return self.param("r", r)
 
 class Line(XmlNode):
 
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["x1", "x2", "y1", "y2", "stroke", "stroke-width",
+    "id", "class"])
+
   def __init__(self):
     super(Line, self).__init__("line")
 
-  def isValidParam(self, key):
-    return key in ["x1", "x2", "y1", "y2", "stroke", "stroke-width", "id"]
-
   def start(self, x, y):
-    self.param("x1", "{}".format(x))
-    self.param("y1", "{}".format(y))
+    self.param("x1", x)
+    self.param("y1", y)
     return self
 
   def end(self, x, y):
-    self.param("x2", "{}".format(x))
-    self.param("y2", "{}".format(y))
+    self.param("x2", x)
+    self.param("y2", y)
     return self
 
 class G(XmlNode):
 
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["id", "class", "font-size", "font-family", "fill",
+    "stroke", "text-anchor", "stroke-width", "visibility"])
+
   def __init__(self):
     super(G, self).__init__("g")
 
-  def isValidParam(self, key):
-    return key in ["font-size", "font-family", "fill", "stroke",
-      "text-anchor", "stroke-width"]
-
 class AnimateMotion(XmlNode):
 
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["id", "path", "begin", "dur", "fill", "repeatCount"])
+
   def __init__(self):
     super(AnimateMotion, self).__init__("animateMotion")
 
   def path(self, *args):
-    d = " ".join(args)
-    return self.param("path", d)
-
-  def isValidParam(self, key):
-    return key in ["id", "path", "begin", "dur", "fill", "repeatCount"]
+    return self.param("path", PathData().extend(*args))
 
 class MPath(XmlLeaf):
 
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["xlink:href"])
+
   def __init__(self):
     super(MPath, self).__init__("mpath")
 
-  def isValidParam(self, key):
-    return key in ["xlink:href"]
-
   def link(self, id):
     self.param("xlink:href", "#{}".format(id))
     return self
 
 class Animate(XmlNode):
 
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["attributeName", "attributeType", "begin", "dur",
+    "from", "to", "fill", "id", "values", "keyTimes", "calcMode",
+    "repeatCount"])
+
   def __init__(self):
     super(Animate, self).__init__("animate")
 
-  def isValidParam(self, key):
-    return key in ["attributeName", "attributeType", "begin", "dur", "from",
-        "to", "fill", "id"]
-
   def do(self, a, b):
     self.param("from", a)
     self.param("to", b)
     return self
+
+  # Animates through a list of values, each reached at the matching key time (a
+  # fraction of the duration). Key times are rendered with a precision of their
+  # own, as that of the values is usually too coarse for them.
+  def keyframes(self, values, key_times, precision=None):
+    self.param("values", list(values))
+    self.param("keyTimes", ";".join(formatNumber(float(key_time), precision)
+      for key_time in key_times))
+    return self
+
+# Holds elements that aren't drawn where they are, but can be referenced (e.g.
+# by <use>) from elsewhere.
+class Defs(XmlNode):
+
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["id"])
+
+  def __init__(self):
+    super(Defs, self).__init__("defs")
+
+# A template of graphics, only drawn where referenced by <use>.
+class Symbol(XmlNode):
+
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["id", "viewBox", "x", "y", "width", "height",
+    "preserveAspectRatio"])
+
+  def __init__(self):
+    super(Symbol, self).__init__("symbol")
+
+# Draws a copy of the element with the given id, moved by x and y. The copy
+# inherits presentation params (fill, stroke, ...) from the <use>.
+class Use(XmlLeaf):
+
+  __slots__ = ()
+  ATTRIBUTES = frozenset(["id", "class", "xlink:href", "x", "y", "width",
+    "height", "transform", "fill", "stroke", "stroke-width"])
+
+  def __init__(self):
+    super(Use, self).__init__("use")
+
+  def link(self, id):
+    self.param("xlink:href", "#{}".format(id))
+    return self
+
+  def position(self, x, y):
+    self.param("x", x)
+    self.param("y", y)
+    return self
+
+# A style sheet, made of CSS rules such as ".node{fill:red}".
+class Style(XmlNode):
+
+  __slots__ = ("rules",)
+  ATTRIBUTES = frozenset(["type"])
+
+  def __init__(self):
+    super(Style, self).__init__("style")
+    self.rules = []
+
+  def rule(self, selector, declarations):
+    self.rules.append("{}{{{}}}".format(selector, ";".join(
+      "{}:{}".format(k, v) for k, v in declarations)))
+    self.invalidate()
+    return self
+
+  def hasContents(self):
+    return len(self.rules) > 0 or len(self.children) > 0
+
+  def iterContents(self, prefix, compact=False, precision=None):
+    for rule in self.rules:
+      yield rule if compact else prefix + rule + "\n"
+    for chunk in super(Style, self).iterContents(prefix, compact, precision):
+      yield chunk
+
+# Opens a file for writing such that it only appears, complete, once writing has
+# finished. Until then the output goes to a temporary file alongside it, which
+# is removed if writing fails.
+@contextlib.contextmanager
+def atomicOpen(filename, mode="w"):
+  directory, name = os.path.split(filename)
+  handle, temp_name = tempfile.mkstemp(
+    prefix=".{}.".format(name), suffix=".tmp", dir=directory or ".")
+  try:
+    with os.fdopen(handle, mode) as f:
+      yield f
+    os.chmod(temp_name, 0o644)
+    os.rename(temp_name, filename)
+  except BaseException:
+    os.remove(temp_name)
+    raise
+
+# Opens several files at once with atomicOpen, yielding the list of them.
+@contextlib.contextmanager
+def atomicOpenAll(filenames, mode="w"):
+  if not filenames:
+    yield []
+    return
+  with atomicOpen(filenames[0], mode) as f:
+    with atomicOpenAll(filenames[1:], mode) as rest:
+      yield [f] + rest
+
+# A sink that passes everything written to it on to several others, so that
+# one render can feed them all.
+class TeeSink(object):
+
+  def __init__(self, *sinks):
+    self.sinks = sinks
+
+  def write(self, data):
+    for sink in self.sinks:
+      sink.write(data)
+
+# The formats a document can be written in, by extension: whether the SVG is
+# put in an HTML skeleton, and whether the file is gzip-compressed.
+OUTPUT_FORMATS = {
+  "svg": (False, False),
+  "svgz": (False, True),
+  "html": (True, False),
+  "html.gz": (True, True),
+}
+# The HTML skeleton around the SVG, before and after it, by compactness.
+HTML_SKELETON = {
+  False: ("<!DOCTYPE html>\n\n<html>\n  <body>\n", "  </body>\n</html>\n"),
+  True: ("<!DOCTYPE html><html><body>", "</body></html>"),
+}
+
+# Writes an SVG to basename.<format> in every one of the given formats, from a
+# single render streamed into all of the files at once. Returns the names of
+# the files. The SVG is only indented to fit in the HTML skeleton when every
+# format puts it in one.
+def writeFormats(svg, basename, formats, compact=False, precision=None):
+  for format in formats:
+    assert format in OUTPUT_FORMATS, "{} is not a valid output format" \
+      .format(format)
+  filenames = ["{}.{}".format(basename, format) for format in formats]
+  wrapped = all(OUTPUT_FORMATS[format][0] for format in formats)
+  prefix = "    " if wrapped and not compact else ""
+  header, footer = HTML_SKELETON[compact]
+  with atomicOpenAll(filenames, "wb") as files:
+    sinks = []
+    html_sinks = []
+    for f, format in zip(files, formats):
+      html, compressed = OUTPUT_FORMATS[format]
+      if compressed:
+        # Leave out the name and time, so that identical renders compress to
+        # identical files.
+        f = gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0)
+      sinks.append(f)
+      if html:
+        html_sinks.append(f)
+    for sink in html_sinks:
+      sink.write(header.encode("utf-8"))
+    svg.write(TeeSink(*sinks), prefix, "utf-8", compact, precision)
+    for sink in html_sinks:
+      sink.write(footer.encode("utf-8"))
+    # Compressed files are only complete once closed.
+    for sink, f in zip(sinks, files):
+      if sink is not f:
+        sink.close()
+  return filenames
+
+# Every element class, by tag. Together with their ATTRIBUTES, this is the
+# schema of the documents that can be built (or read back in).
+ELEMENTS = {
+  "html": Html,
+  "body": Body,
+  "svg": Svg,
+  "path": Path,
+  "text": Text,
+  "circle": Circle,
+  "line": Line,
+  "g": G,
+  "animateMotion": AnimateMotion,
+  "mpath": MPath,
+  "animate": Animate,
+  "defs": Defs,
+  "symbol": Symbol,
+  "use": Use,
+  "style": Style,
+}
+
+# Returns the params accepted by elements with the given tag.
+def schemaFor(tag):
+  return ELEMENTS[tag].ATTRIBUTES
+
+# Measures the memory held by a tree: elements, their params, child lists, path
+# data and attribute values. Anything shared (interned params, repeated values)
+# is only counted once.
+class MemoryReport(object):
+
+  def __init__(self, root):
+    self.elements = 0
+    self.bytes = 0
+    self.seen = set()
+    stack = [root]
+    while stack:
+      element = stack.pop()
+      self.elements += 1
+      self.count(element)
+      self.count(element.params)
+      for k, v in element.params.items():
+        self.count(k)
+        self.countValue(v)
+      if element.shared is not None:
+        self.count(element.shared)
+        self.count(element.shared.items)
+        for item in element.shared.items:
+          self.count(item)
+          self.count(item[0])
+          self.countValue(item[1])
+      if element.render_cache is not None:
+        self.count(element.render_cache)
+        for text in element.render_cache.values():
+          self.count(text)
+      if isinstance(element, Text):
+        self.count(element.text)
+      if isinstance(element, XmlNode):
+        self.count(element.children)
+        stack.extend(element.children)
+    self.seen = None
+
+  def count(self, obj):
+    if id(obj) not in self.seen:
+      self.seen.add(id(obj))
+      self.bytes += sys.getsizeof(obj)
+
+  def countValue(self, value):
+    self.count(value)
+    if isinstance(value, PathData):
+      self.count(value.commands)
+      self.count(value.coords)
+
+  def bytesPerElement(self):
+    return self.bytes / float(max(self.elements, 1))
+
+  def __str__(self):
+    return "{} elements, {} bytes ({:.1f} bytes per element)".format(
+      self.elements, self.bytes, self.bytesPerElement())
+
+# Totals of some part of a render.
+class RenderStats(object):
+
+  __slots__ = ("elements", "attributes", "bytes", "seconds")
+
+  def __init__(self):
+    self.elements = 0
+    self.attributes = 0
+    self.bytes = 0
+    self.seconds = 0.0
+
+  def add(self, elements, attributes, size, seconds):
+    self.elements += elements
+    self.attributes += attributes
+    self.bytes += size
+    self.seconds += seconds
+
+  def __str__(self):
+    return "{} elements, {} attributes, {} bytes, {:.4f}s".format(
+      self.elements, self.attributes, self.bytes, self.seconds)
+
+# Where the time and bytes of renders go. Every element rendered while the
+# profile is active (see profileRender) is added to the stats of its tag, just
+# for itself (not its children), so that the tags add up to the total. The
+# subtrees of elements with ids are also tallied whole, by id. Elements whose
+# rendering is cached (see cacheRender) count as a single element once cached.
+#
+# The hook, if any, is called as each element finishes rendering, with the
+# element and the bytes and seconds its whole subtree took.
+class RenderProfile(object):
+
+  def __init__(self, hook=None):
+    self.hook = hook
+    self.total = RenderStats()
+    self.tags = {}
+    self.subtrees = {}
+    # Totals of the children of each element being rendered, from the root
+    # down to the one currently rendering.
+    self.stack = []
+
+  # Passes an element's rendered chunks through, recording how much there was
+  # of them and how long they took to render.
+  def profile(self, element, chunks):
+    attributes = sum(1 for _ in element.iterParams())
+    children = RenderStats()
+    self.stack.append(children)
+    size = 0
+    seconds = 0.0
+    timer = timeit.default_timer
+    try:
+      while True:
+        start = timer()
+        try:
+          chunk = next(chunks)
+        except StopIteration:
+          seconds += timer() - start
+          break
+        seconds += timer() - start
+        size += len(chunk)
+        yield chunk
+    finally:
+      self.stack.pop()
+    stats = self.tags.get(element.tag)
+    if stats is None:
+      stats = self.tags[element.tag] = RenderStats()
+    stats.add(1, attributes, size - children.bytes, seconds - children.seconds)
+    elements = 1 + children.elements
+    attributes += children.attributes
+    element_id = element.getParam("id")
+    if element_id is not None:
+      stats = self.subtrees.get(element_id)
+      if stats is None:
+        stats = self.subtrees[element_id] = RenderStats()
+      stats.add(elements, attributes, size, seconds)
+    if self.stack:
+      self.stack[-1].add(elements, attributes, size, seconds)
+    else:
+      self.total.add(elements, attributes, size, seconds)
+    if self.hook is not None:
+      self.hook(element, size, seconds)
+
+  def __str__(self):
+    lines = ["Total: {}".format(self.total)]
+    for tag, stats in sorted(self.tags.items(),
+        key=lambda item: -item[1].seconds):
+      lines.append("  <{}>: {}".format(tag, stats))
+    for element_id, stats in sorted(self.subtrees.items(),
+        key=lambda item: -item[1].seconds):
+      lines.append("  #{}: {}".format(element_id, stats))
+    return "\n".join(lines)
+
+# Records every render in the block into a RenderProfile, e.g.
+#   with profileRender() as profile:
+#     svg.write(f)
+#   print(profile)
+@contextlib.contextmanager
+def profileRender(hook=None):
+  global PROFILE
+  previous = PROFILE
+  PROFILE = RenderProfile(hook)
+  try:
+    yield PROFILE
+  finally:
+    PROFILE = previous
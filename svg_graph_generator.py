@@ -1,20 +1,82 @@
 from svg_code import *
+import svg_optimize
+import array
 import math
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+
+# NumPy is optional. Without it, geometry is computed in pure Python.
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 # Whether to print the contents of the SVG to the terminal when saving to file.
 LOG_SVG = False
 # Whether, when rendering the graph, to put the SVG in an HTML skeleton or not.
 RENDER_HTML = False
+# The formats (see OUTPUT_FORMATS) to render graphs in, all from the one render.
+# None renders just the format chosen by RENDER_HTML.
+RENDER_FORMATS = None
 # Distance, in pixels, from the center of the SVG to its edge.
 CENTER = 20
 SECONDS_PER_MOVE = 0.5
+# Number of decimal places that coordinates are rendered with. Digits beyond a
+# hundredth of a pixel are invisible, but would make up most of the file.
+COORDINATE_PRECISION = 2
 NODE_RADIUS = 5
 MAX_STROKE_WIDTH = 6
+# How edges are drawn. "line" edges are lines with a pair of animations per
+# endpoint for every move of its node, duplicating the node's own. "path" edges
+# are paths with a single animation of their whole shape per move, which takes
+# its timing from the node's animation instead of chaining its own.
+EDGE_STYLE = "line"
+# Whether to animate each attribute of a node or edge with a single animation
+# through all of its positions (keyframes), timed from the start of the
+# document, instead of one animation per move, each beginning when the move
+# before it ends. Keyframes take a constant number of elements per node, and
+# don't depend on any chain of animations.
+KEYFRAMES = False
+# Minimum number of decimal places that key times (fractions of a node's whole
+# animation) are rendered with. Longer animations get more (see
+# getKeyTimePrecision).
+KEY_TIME_PRECISION = 6
+# Whether the SVG of each node and edge keeps its rendering, so that rendering
+# the graph again after a few changes only re-renders what they touched. Costs
+# about as much memory again as the rendered graph.
+CACHE_RENDERS = False
+# Whether to hoist the styling params that nodes and edges share when rendering,
+# onto "groups" around them or into "classes" of a style sheet. None leaves
+# every element with its own.
+HOIST_STYLES = None
+# Whether to render graphs straight from the graph, building the SVG of one node
+# or edge at a time as it's written, rather than building the whole SVG first.
+# Either way, the output is the same. Optimizing, hoisting styles and caching
+# renders all need the whole SVG, so they turn this off.
+STREAM_RENDERS = True
+# Number of processes that render each graph (when it's streamed), each taking
+# shards of its nodes and edges, which are then put together in order. None
+# uses one per core. 1 renders it all in this process.
+SHARD_PROCESSES = 1
+# Number of shards per process. More, smaller shards even out the work between
+# the processes.
+SHARDS_PER_PROCESS = 4
+# Size of the chunks rendered shards are copied into the output in.
+SHARD_BUFFER_SIZE = 64 * 1024
+# The optimization passes (see svg_optimize.PASSES) to run over the SVG before
+# rendering it. None renders it as built.
+OPTIMIZE_PASSES = None
+# Whether to print what the optimization passes did when rendering. Either way,
+# it's kept as the graph's optimize_report.
+LOG_OPTIMIZE = False
 # When nodes get small, we don't want their stroke width overpowering them.
-STROKE_WIDTH = min(MAX_STROKE_WIDTH, NODE_RADIUS / 2)
+STROKE_WIDTH = min(MAX_STROKE_WIDTH, NODE_RADIUS // 2)
 # When the SVG gets really small, we don't want the nodes getting clipped by its
 # edges.
-RADIUS = min(CENTER * 2 / 3, CENTER - NODE_RADIUS - STROKE_WIDTH)
+RADIUS = min(CENTER * 2 // 3, CENTER - NODE_RADIUS - STROKE_WIDTH)
 
 def polar2cartesian(r, tau):
   t = tau - 0.25  # Factor to rotate shape so 0 is up.
@@ -23,225 +85,1007 @@ def polar2cartesian(r, tau):
   y = CENTER + r * math.sin(factor * t)
   return x, y
 
+# The inverse of polar2cartesian, for placing nodes in cartesian coordinates.
+def cartesian2polar(x, y):
+  r = math.hypot(x - CENTER, y - CENTER)
+  tau = (math.atan2(y - CENTER, x - CENTER) / (2 * math.pi) + 0.25) % 1.0
+  return r, tau
+
+# Converts whole sequences of polar coordinates at once (in one vectorized pass,
+# if NumPy is available), returning lists of the x and y coordinates.
+def polar2cartesianBatch(radii, taus):
+  factor = 2 * math.pi
+  if numpy is not None:
+    r = numpy.asarray(radii, dtype=float)
+    t = factor * (numpy.asarray(taus, dtype=float) - 0.25)
+    return (CENTER + r * numpy.cos(t)).tolist(), \
+      (CENTER + r * numpy.sin(t)).tolist()
+  cos = math.cos
+  sin = math.sin
+  xs = [CENTER + r * cos(factor * (tau - 0.25)) for r, tau in zip(radii, taus)]
+  ys = [CENTER + r * sin(factor * (tau - 0.25)) for r, tau in zip(radii, taus)]
+  return xs, ys
+
+# Nodes, edges and moves are all held by their graph, in flat arrays (see
+# Graph). Node, Edge and Move are views of one of them, by index, and hold
+# nothing else, so are created as needed and thrown away.
 class Move(object):
 
-  def __init__(self, name, prev_move=None):
-    self.name = name
-    self.prev_move = prev_move
+  __slots__ = ("graph", "idx")
+
+  def __init__(self, graph, idx):
+    self.graph = graph
+    self.idx = idx
+
+  # Moves are named after their node, and the position they move it to.
+  @property
+  def name(self):
+    graph = self.graph
+    return "{}_move_{}".format(graph.names[graph.move_nodes[self.idx]],
+      graph.move_numbers[self.idx])
+
+  @property
+  def prev_move(self):
+    prev = self.graph.move_prevs[self.idx]
+    return None if prev < 0 else Move(self.graph, prev)
+
+  # Position of the move in the graph's overall sequence of moves, once it's
+  # been scheduled.
+  @property
+  def step(self):
+    step = self.graph.move_steps[self.idx]
+    return None if step < 0 else step
 
 class Node(object):
 
-  def __init__(self, name, r, tau):
-    self.name = name
-    self.positions = [(r, tau)]
-    self.moves = []
-    self.edges = []
-    self.svg = None
+  __slots__ = ("graph", "idx")
+
+  def __init__(self, graph, idx):
+    self.graph = graph
+    self.idx = idx
+
+  @property
+  def name(self):
+    return self.graph.names[self.idx]
+
+  # The node's moves, in order. The graph is indexed first if it needs to be
+  # (see Graph.index).
+  @property
+  def moves(self):
+    graph = self.graph
+    graph.index()
+    return [Move(graph, move) for move in graph.node_moves[
+      graph.move_offsets[self.idx]:graph.move_offsets[self.idx + 1]]]
+
+  # The node's edges, each with whether the node is its first endpoint.
+  @property
+  def edges(self):
+    graph = self.graph
+    graph.index()
+    return [(Edge(graph, edge), graph.edge_nodes1[edge] == self.idx)
+      for edge in graph.node_edges[
+        graph.edge_offsets[self.idx]:graph.edge_offsets[self.idx + 1]]]
+
+  # The node's history of positions, in polar coordinates.
+  @property
+  def positions(self):
+    graph = self.graph
+    return [(graph.start_radii[self.idx], graph.start_taus[self.idx])] + \
+      [(graph.move_radii[move.idx], graph.move_taus[move.idx])
+        for move in self.moves]
+
+  # The SVG of the node, once built.
+  @property
+  def svg(self):
+    return self.graph.node_svgs[self.idx]
+
+  @svg.setter
+  def svg(self, svg):
+    self.graph.node_svgs[self.idx] = svg
 
   # Deprecated. Remove after edges are corrected.
   def getStartPosition(self):
-    return polar2cartesian(*self.positions[0])
+    graph = self.graph
+    graph.computeGeometry()
+    position = graph.move_offsets[self.idx] + self.idx
+    return graph.xs[position], graph.ys[position]
 
+  # Returns the node's latest position, in polar coordinates, without needing
+  # the graph to be indexed.
+  def getLastPosition(self):
+    graph = self.graph
+    move = graph.last_moves[self.idx]
+    if move < 0:
+      return graph.start_radii[self.idx], graph.start_taus[self.idx]
+    return graph.move_radii[move], graph.move_taus[move]
+
+  # Moves the node to a new position once the previous move (by index, or None
+  # to move from the start) has ended. Returns the index of the move.
   def addPosition(self, r, tau, prev_move):
-    # Create move name before adding a new position.
-    move_name = "{}_move_{}".format(self.name, len(self.positions))
-    self.positions.append((r, tau))
-    self.moves.append(Move(move_name, prev_move))
-    return move_name
+    return self.graph.addMove(self.idx, r, tau, prev_move)
+
+  # Drops the SVG of the node and of its edges, which follow it, so that it's
+  # rebuilt the next time the graph's is.
+  def invalidate(self):
+    # The SVGs may have been built on their own (see getSVG), even if the
+    # graph's hasn't been, so the node is always marked.
+    self.graph.stale.add(self.idx)
+    self.graph.dirty = True
+
+  # Returns the node's history of positions in cartesian coordinates, which are
+  # computed for the whole graph at once (see Graph.computeGeometry).
+  def getCartesian(self):
+    graph = self.graph
+    graph.computeGeometry()
+    start = graph.move_offsets[self.idx] + self.idx
+    end = graph.move_offsets[self.idx + 1] + self.idx + 1
+    return graph.xs[start:end], graph.ys[start:end]
+
+  def getMove(self, idx):
+    graph = self.graph
+    graph.index()
+    return Move(graph, graph.node_moves[graph.move_offsets[self.idx] + idx])
 
   def getPath(self, idx):
-    start_x, start_y = polar2cartesian(*self.positions[idx])
-    end_x, end_y = polar2cartesian(*self.positions[idx + 1])
-    return start_x, start_y, end_x, end_y
+    graph = self.graph
+    graph.computeGeometry()
+    position = graph.move_offsets[self.idx] + self.idx + idx
+    return graph.xs[position], graph.ys[position], graph.xs[position + 1], \
+      graph.ys[position + 1]
+
+  # Returns the steps of the node's moves (see Move.step), which are in order.
+  def getSteps(self):
+    graph = self.graph
+    graph.index()
+    return [graph.move_steps[move] for move in graph.node_moves[
+      graph.move_offsets[self.idx]:graph.move_offsets[self.idx + 1]]]
+
+  # Returns the node's positions over time, as a list of (t, x, y) keyframes
+  # to be moved between in a straight line. Needs the moves to have been
+  # scheduled (see Graph.scheduleMoves). The node holds still between moves,
+  # so each move that doesn't start as the last ends adds a keyframe for the
+  # hold as well.
+  def getKeyframes(self):
+    xs, ys = self.getCartesian()
+    frames = [(0.0, xs[0], ys[0])]
+    for i, move in enumerate(self.moves):
+      assert move.step is not None, "Move {} has not been scheduled" \
+        .format(move.name)
+      begin = move.step * SECONDS_PER_MOVE
+      if begin > frames[-1][0]:
+        frames.append((begin, xs[i], ys[i]))
+      frames.append((begin + SECONDS_PER_MOVE, xs[i + 1], ys[i + 1]))
+    return frames
+
+  # Determines when the given move happens.
+  def getBegin(self, idx):
+    prev_move = self.getMove(idx).prev_move
+    if prev_move is None:
+      return "0s"
+    return "{}.end".format(prev_move.name)
 
   def getSVG(self):
-    if self.svg is not None:
-      return self.svg
+    if self.svg is None:
+      self.svg = self.buildSVG().cacheRender(CACHE_RENDERS)
+    return self.svg
+
+  # Builds the SVG of the node afresh, without keeping it.
+  def buildSVG(self):
     # Create the node itself.
-    self.svg = Circle() \
+    svg = Circle() \
       .id(self.name) \
       .param("stroke", "black") \
       .param("stroke-width", STROKE_WIDTH) \
       .param("fill", "red") \
-      .center(*polar2cartesian(*self.positions[0])) \
+      .center(*self.getStartPosition()) \
       .radius(NODE_RADIUS)
 
+    if KEYFRAMES:
+      if self.moves:
+        frames = self.getKeyframes()
+        svg.child(getKeyframeAnimation("cx", frames, 1),
+          getKeyframeAnimation("cy", frames, 2))
+      return svg
+
     # Add the node's various moves.
     for i in range(len(self.moves)):
-      # Determine when the move happens.
-      prev_move = self.moves[i].prev_move
-      begin = "0s"
-      if prev_move is not None:
-        begin = "{}.end".format(prev_move)
+      begin = self.getBegin(i)
 
       # Get the motion itself.
       start_x, start_y, end_x, end_y = self.getPath(i)
 
-      # Each move is composed for 2 + 2E animations, where E is the number of
-      # edges leading out of the node. It's a damn pity you can't target
-      # multiple attributes, but oh well. They all have the same timing,
-      # differing only in what they target.
+      # Each move is composed for 2 animations, plus those of the edges leading
+      # out of the node. It's a damn pity you can't target multiple attributes,
+      # but oh well.
       anim_cx = getBaseAnimation(begin)
-      anim_cx.id(self.moves[i].name)  # One 'master' animation is given an id.
+      # One 'master' animation is given an id.
+      anim_cx.id(self.getMove(i).name)
       anim_cx.param("attributeName", "cx")
       anim_cx.do(start_x, end_x)
-      self.svg.child(anim_cx)
+      svg.child(anim_cx)
       anim_cy = getBaseAnimation(begin)
       anim_cy.param("attributeName", "cy")
       anim_cy.do(start_y, end_y)
-      self.svg.child(anim_cy)
-      for edge, is_forward in self.edges:
-        num = "1" if is_forward else "2"
-        anim_x = getBaseAnimation(begin)
-        anim_x.param("attributeName", "x{}".format(num))
-        anim_x.do(start_x, end_x)
-        edge.getSVG().child(anim_x)
-        anim_y = getBaseAnimation(begin)
-        anim_y.param("attributeName", "y{}".format(num))
-        anim_y.do(start_y, end_y)
-        edge.getSVG().child(anim_y)
+      svg.child(anim_cy)
 
-    return self.svg
+    return svg
 
 class Edge(object):
 
-  def __init__(self, node1, node2):
-    self.node1 = node1
-    self.node2 = node2
-    node1.edges.append((self, True))  # Bool indicates edge direction.
-    node2.edges.append((self, False))
-    self.svg = None
+  __slots__ = ("graph", "idx")
+
+  def __init__(self, graph, idx):
+    self.graph = graph
+    self.idx = idx
+
+  @property
+  def node1(self):
+    return Node(self.graph, self.graph.edge_nodes1[self.idx])
+
+  @property
+  def node2(self):
+    return Node(self.graph, self.graph.edge_nodes2[self.idx])
+
+  # The SVG of the edge, once built.
+  @property
+  def svg(self):
+    return self.graph.edge_svgs[self.idx]
+
+  @svg.setter
+  def svg(self, svg):
+    self.graph.edge_svgs[self.idx] = svg
 
   def getSVG(self):
-    if self.svg is not None:
-      return self.svg
-    self.svg = Line() \
+    if self.svg is None:
+      self.svg = self.buildSVG().cacheRender(CACHE_RENDERS)
+    return self.svg
+
+  # Builds the SVG of the edge afresh, without keeping it.
+  def buildSVG(self):
+    if EDGE_STYLE == "path":
+      return self.getPathSVG()
+    svg = Line() \
       .param("stroke", "black") \
       .param("stroke-width", STROKE_WIDTH) \
       .start(*self.node1.getStartPosition()) \
       .end(*self.node2.getStartPosition())
-    return self.svg
+    if KEYFRAMES:
+      for node, num in ((self.node1, "1"), (self.node2, "2")):
+        if node.moves:
+          frames = node.getKeyframes()
+          svg.child(
+            getKeyframeAnimation("x{}".format(num), frames, 1),
+            getKeyframeAnimation("y{}".format(num), frames, 2))
+      return svg
+    # Each endpoint follows its node with animations of the same timing,
+    # differing only in what they target.
+    for node, num in ((self.node1, "1"), (self.node2, "2")):
+      for i in range(len(node.moves)):
+        begin = node.getBegin(i)
+        start_x, start_y, end_x, end_y = node.getPath(i)
+        anim_x = getBaseAnimation(begin)
+        anim_x.param("attributeName", "x{}".format(num))
+        anim_x.do(start_x, end_x)
+        svg.child(anim_x)
+        anim_y = getBaseAnimation(begin)
+        anim_y.param("attributeName", "y{}".format(num))
+        anim_y.do(start_y, end_y)
+        svg.child(anim_y)
+    return svg
+
+  # Draws the edge as a path, which takes a single animation per move of
+  # either endpoint. That animation starts with the node's 'master' animation,
+  # so the edges add nothing to the chain of moves. Needs the moves to have
+  # been scheduled (see Graph.scheduleMoves), so as to know where the other
+  # endpoint is at the time.
+  def getPathSVG(self):
+    svg = Path() \
+      .param("stroke", "black") \
+      .param("stroke-width", STROKE_WIDTH) \
+      .param("fill", "none") \
+      .param("d", getEdgePath(
+        self.node1.getStartPosition(), self.node2.getStartPosition()))
+    if KEYFRAMES:
+      if self.node1.moves or self.node2.moves:
+        svg.child(self.getPathKeyframeAnimation())
+      return svg
+    node1 = self.node1
+    node2 = self.node2
+    for node, other in ((node1, node2), (node2, node1)):
+      other_xs, other_ys = other.getCartesian()
+      other_steps = other.getSteps()
+      # The node's moves are in order too, so the other endpoint's position as
+      # of each is found by walking through its moves alongside them.
+      position = 0
+      for i in range(len(node.moves)):
+        move = node.getMove(i)
+        step = move.step
+        assert step is not None, "Move {} has not been scheduled" \
+          .format(move.name)
+        while position < len(other_steps) and other_steps[position] < step:
+          position += 1
+        other_x, other_y = other_xs[position], other_ys[position]
+        start_x, start_y, end_x, end_y = node.getPath(i)
+        if node is node1:
+          start = getEdgePath((start_x, start_y), (other_x, other_y))
+          end = getEdgePath((end_x, end_y), (other_x, other_y))
+        else:
+          start = getEdgePath((other_x, other_y), (start_x, start_y))
+          end = getEdgePath((other_x, other_y), (end_x, end_y))
+        anim = getBaseAnimation("{}.begin".format(move.name))
+        anim.param("attributeName", "d")
+        anim.do(start, end)
+        svg.child(anim)
+    return svg
+
+  # Animates the edge's path through every keyframe of either endpoint, with
+  # the other endpoint wherever it is at the time.
+  def getPathKeyframeAnimation(self):
+    frames1 = self.node1.getKeyframes()
+    frames2 = self.node2.getKeyframes()
+    times = sorted(set(frame[0] for frame in frames1 + frames2))
+    paths = [getEdgePath(position1, position2) for position1, position2 in
+      zip(iterKeyframePositions(frames1, times),
+        iterKeyframePositions(frames2, times))]
+    return getKeyframeAnimation("d", list(zip(times, paths)), 1)
 
+# A graph, held in flat arrays rather than as objects: one entry per node,
+# edge and move, in the order they were added. Which moves and edges each node
+# has is indexed in compressed sparse rows (see index), rebuilt once the graph
+# has changed and it's next needed.
 class Graph(object):
 
   def __init__(self, name):
     self.name = name
-    self.nodes = []
-    self.edges = []
+    # Nodes: their names, where they start (in polar coordinates), how many
+    # moves they have, their latest move (-1 if none) and their SVGs.
+    self.names = []
+    self.start_radii = array.array("d")
+    self.start_taus = array.array("d")
+    self.move_counts = array.array("l")
+    self.last_moves = array.array("l")
+    self.node_svgs = []
+    # Moves: the node moved, the move before (-1 if none), which of the node's
+    # positions it moves to, where that is and its step (see scheduleMoves),
+    # -1 until it's been scheduled.
+    self.move_nodes = array.array("l")
+    self.move_prevs = array.array("l")
+    self.move_numbers = array.array("l")
+    self.move_radii = array.array("d")
+    self.move_taus = array.array("d")
+    self.move_steps = array.array("l")
+    # Edges: their endpoints and their SVGs.
+    self.edge_nodes1 = array.array("l")
+    self.edge_nodes2 = array.array("l")
+    self.edge_svgs = []
+    # The moves and edges of each node, as offsets into arrays of their
+    # indices (node i's moves are node_moves[move_offsets[i]:move_offsets[i +
+    # 1]]). None until indexed.
+    self.move_offsets = None
+    self.node_moves = None
+    self.edge_offsets = None
+    self.node_edges = None
+    # Every node's positions in cartesian coordinates, in the order of their
+    # nodes: each node's start, then the end of each of its moves. None until
+    # computed (see computeGeometry).
+    self.xs = None
+    self.ys = None
+    # Nodes that changed since their SVGs were built.
+    self.stale = set()
     self.svg = None
+    # The group holding the SVGs of the edges and nodes, and whether any of them
+    # have changed since it was last filled.
+    self.g = None
+    self.dirty = True
+    # What the optimization passes did the last time the graph was rendered,
+    # if they ran (see svg_optimize.OptimizeReport).
+    self.optimize_report = None
 
-  def addNode(self, node):
-    self.nodes.append(node)
+  @property
+  def nodes(self):
+    return [Node(self, idx) for idx in range(len(self.names))]
 
-  def addEdge(self, edge):
-    self.edges.append(edge)
+  @property
+  def edges(self):
+    return [Edge(self, idx) for idx in range(len(self.edge_nodes1))]
 
-  # Creates the SVG rules for this graph.
+  def addNode(self, name, r, tau):
+    self.names.append(name)
+    self.start_radii.append(r)
+    self.start_taus.append(tau)
+    self.move_counts.append(0)
+    self.last_moves.append(-1)
+    self.node_svgs.append(None)
+    self.move_offsets = self.edge_offsets = None
+    self.xs = self.ys = None
+    self.dirty = True
+    return Node(self, len(self.names) - 1)
+
+  # Adds an edge between two nodes, given as Nodes or by index.
+  def addEdge(self, node1, node2):
+    self.edge_nodes1.append(getattr(node1, "idx", node1))
+    self.edge_nodes2.append(getattr(node2, "idx", node2))
+    self.edge_svgs.append(None)
+    self.edge_offsets = None
+    self.dirty = True
+    return Edge(self, len(self.edge_nodes1) - 1)
+
+  # Moves a node (by index) to a new position, once the previous move (by
+  # index, or None to move from the start) has ended. Returns the index of the
+  # move.
+  def addMove(self, node, r, tau, prev_move=None):
+    move = len(self.move_nodes)
+    prev_move = -1 if prev_move is None else prev_move
+    assert prev_move < move, "Move {} does not exist yet".format(prev_move)
+    self.move_counts[node] += 1
+    self.move_nodes.append(node)
+    self.move_prevs.append(prev_move)
+    self.move_numbers.append(self.move_counts[node])
+    self.move_radii.append(r)
+    self.move_taus.append(tau)
+    self.move_steps.append(-1)
+    self.last_moves[node] = move
+    self.move_offsets = None
+    self.xs = self.ys = None
+    Node(self, node).invalidate()
+    return move
+
+  # Drops the SVG of the graph and of everything in it.
+  def invalidate(self):
+    self.node_svgs = [None] * len(self.names)
+    self.edge_svgs = [None] * len(self.edge_nodes1)
+    self.stale.clear()
+    self.svg = None
+    self.g = None
+    self.dirty = True
+
+  # Indexes the moves and edges of every node, by counting sort of the moves
+  # and edges by node.
+  def index(self):
+    num_nodes = len(self.names)
+    if self.move_offsets is None:
+      self.move_offsets = getOffsets(self.move_counts)
+      self.node_moves = sortByNode(self.move_offsets, self.move_nodes)
+    if self.edge_offsets is None:
+      degrees = array.array("l", [0]) * num_nodes
+      for node in self.edge_nodes1:
+        degrees[node] += 1
+      for node in self.edge_nodes2:
+        degrees[node] += 1
+      self.edge_offsets = getOffsets(degrees)
+      self.node_edges = sortByNode(self.edge_offsets, self.edge_nodes1,
+        self.edge_nodes2)
+
+  # Works out the order of all of the nodes' moves, by following the chain
+  # of previous moves. Each move comes after the one before it, so this takes
+  # a single pass.
+  def scheduleMoves(self):
+    steps = self.move_steps
+    prevs = self.move_prevs
+    for move in range(len(steps)):
+      if steps[move] < 0:
+        prev = prevs[move]
+        steps[move] = 0 if prev < 0 else steps[prev] + 1
+
+  # Converts the position history of every node to cartesian coordinates, in
+  # a single batch, if it has changed since it last was.
+  def computeGeometry(self):
+    if self.xs is not None:
+      return
+    self.index()
+    radii = array.array("d")
+    taus = array.array("d")
+    for node in range(len(self.names)):
+      radii.append(self.start_radii[node])
+      taus.append(self.start_taus[node])
+      moves = self.node_moves[
+        self.move_offsets[node]:self.move_offsets[node + 1]]
+      radii.extend(self.move_radii[move] for move in moves)
+      taus.extend(self.move_taus[move] for move in moves)
+    xs, ys = polar2cartesianBatch(radii, taus)
+    self.xs = array.array("d", xs)
+    self.ys = array.array("d", ys)
+
+  # Gets everything ready for building SVGs: indexes, schedules and places
+  # the moves, and drops the SVGs of whatever changed.
+  def prepare(self):
+    self.index()
+    self.scheduleMoves()
+    self.computeGeometry()
+    # Nodes that changed take the edges that follow them along.
+    for node in self.stale:
+      self.node_svgs[node] = None
+      for edge in self.node_edges[
+          self.edge_offsets[node]:self.edge_offsets[node + 1]]:
+        self.edge_svgs[edge] = None
+    self.stale.clear()
+
+  # Creates the SVG rules for this graph. After changes to the graph, only the
+  # SVGs of the nodes and edges they touched are rebuilt.
   def getSVG(self):
+    if self.svg is not None and not self.dirty:
+      return self.svg
+    self.prepare()
+    children = [edge.getSVG() for edge in self.edges]
+    children.extend(node.getSVG() for node in self.nodes)
+    self.dirty = False
     if self.svg is not None:
+      self.g.children = ()
+      self.g.child(*children)
       return self.svg
-    g = G()
-    for edge in self.edges:
-      g.child(edge.getSVG())
-    for node in self.nodes:
-      g.child(node.getSVG())
-    if RENDER_HTML:
-      self.svg = Html().child(
-        Body().child(
-          Svg()
-            .param("width", CENTER * 2)
-            .param("height", CENTER * 2)
-            .child(g)))
-    else:
-      self.svg = Svg() \
-        .param("width", CENTER * 2) \
-        .param("height", CENTER * 2) \
-        .child(g)
+    self.g = G().child(*children)
+    self.svg = getGraphSVG(self.g)
     return self.svg
 
-  # Renders the rules to a file.
-  def render(self):
-    result = self.getSVG().render()
+  # Builds the SVG of one of the graph's children: the edges, then the nodes.
+  # Ones that are already built are reused, but others aren't kept.
+  def buildChildSVG(self, idx):
+    num_edges = len(self.edge_nodes1)
+    if idx < num_edges:
+      svg = self.edge_svgs[idx]
+      return Edge(self, idx).buildSVG() if svg is None else svg
+    svg = self.node_svgs[idx - num_edges]
+    return Node(self, idx - num_edges).buildSVG() if svg is None else svg
+
+  # Creates an SVG of the graph that renders the same as getSVG's, but only
+  # builds the SVG of each node and edge as it's rendered, so that at most one
+  # of them is ever held at a time. Rendering it again builds them all again.
+  def getStreamedSVG(self):
+    self.prepare()
+    g = G()
+    g.children = StreamedChildren(len(self.edge_nodes1) + len(self.names),
+      self.buildChildSVG)
+    return getGraphSVG(g)
+
+  # Splits the graph's children (see buildChildSVG) into ranges of about the
+  # same amount of work: one for every child, plus one for every move it
+  # follows. Returns the (start, end) of each range.
+  def getShardRanges(self, shards):
+    self.index()
+    weights = [1 + self.move_counts[self.edge_nodes1[edge]] +
+      self.move_counts[self.edge_nodes2[edge]]
+      for edge in range(len(self.edge_nodes1))]
+    weights.extend(1 + count for count in self.move_counts)
+    total = float(sum(weights))
+    ranges = []
+    start = 0
+    done = 0
+    for idx, weight in enumerate(weights):
+      done += weight
+      if done >= total * (len(ranges) + 1) / shards or idx == len(weights) - 1:
+        ranges.append((start, idx + 1))
+        start = idx + 1
+    return ranges
+
+  # Creates an SVG of the graph that renders the same as getSVG's, but whose
+  # nodes and edges are rendered in shards by a pool of processes, into
+  # temporary files in the given directory.
+  def getShardedSVG(self, processes=None, directory=""):
+    self.prepare()
+    if processes is None:
+      processes = multiprocessing.cpu_count()
+    g = G()
+    g.children = GraphShards(self, processes, directory)
+    return getGraphSVG(g)
+
+  # Renders the rules to files in the given directory, one per format (see
+  # getFormats), returning the name of the first. Compact output drops all
+  # indentation and line wrapping.
+  def render(self, compact=False, directory="", formats=None):
+    streamed = STREAM_RENDERS and not CACHE_RENDERS and \
+      OPTIMIZE_PASSES is None and HOIST_STYLES is None
+    # Pool workers (such as svg_batch's) can't start pools of their own.
+    if streamed and SHARD_PROCESSES != 1 and \
+        not multiprocessing.current_process().daemon:
+      svg = self.getShardedSVG(SHARD_PROCESSES, directory)
+    elif streamed:
+      svg = self.getStreamedSVG()
+    else:
+      svg = self.getSVG()
+    if OPTIMIZE_PASSES is not None:
+      self.optimize_report = svg_optimize.optimize(svg, OPTIMIZE_PASSES)
+      if LOG_OPTIMIZE:
+        print(str(self.optimize_report))
+    if HOIST_STYLES is not None:
+      svg_optimize.hoistStyles(svg, HOIST_STYLES == "classes")
+    if OPTIMIZE_PASSES is not None or HOIST_STYLES is not None:
+      # Optimizing rewrites the SVGs of the nodes and edges, so they need
+      # rebuilding for the next render.
+      self.invalidate()
     if LOG_SVG:
-      print "Rendering result:"
-      print result
-    extension = "html" if RENDER_HTML else "svg"
-    filename = "{}.{}".format(self.name, extension)
-    with open(filename, "w") as f:
-      f.write(result)
-      print "Wrote to {}".format(filename)
+      print("Rendering result:")
+      print(svg.render(compact=compact))
+    # The document is rendered once, and streamed into every file as it goes
+    # rather than built as one string.
+    filenames = writeFormats(svg, os.path.join(directory, self.name),
+      formats or getFormats(), compact)
+    for filename in filenames:
+      print("Wrote to {}".format(filename))
+    return filenames[0]
+
+# The graph that a pool's workers render shards of. They inherit it when forked,
+# rather than having it sent to each of them.
+worker_graph = None
+
+def initShardWorker(graph):
+  global worker_graph
+  worker_graph = graph
+
+# Renders the graph's children from start to end into a file in the given
+# directory, returning its name.
+def renderShardArgs(args):
+  start, end, directory, prefix, compact, precision = args
+  handle, filename = tempfile.mkstemp(prefix="shard_{}.".format(start),
+    dir=directory)
+  with os.fdopen(handle, "w") as f:
+    for idx in range(start, end):
+      worker_graph.buildChildSVG(idx).write(f, prefix, None, compact,
+        precision)
+  return filename
+
+# Stands in for the children of a graph's group, as a shard each (see
+# GraphShards). The shards are rendered by a pool of processes, all at once,
+# once the first of them is rendered (and so the indentation is known), and
+# the pool is shut down once the last one has been.
+class GraphShards(object):
+
+  def __init__(self, graph, processes, directory=""):
+    self.graph = graph
+    self.processes = processes
+    self.directory = directory
+    self.ranges = graph.getShardRanges(processes * SHARDS_PER_PROCESS)
+    self.pool = None
+    self.fragments = None
+    self.temp_directory = None
+    # The shard to be rendered next.
+    self.next_shard = 0
+
+  def __len__(self):
+    return len(self.ranges)
+
+  def __iter__(self):
+    try:
+      for idx in range(len(self.ranges)):
+        yield Shard(self, idx)
+    finally:
+      self.stop()
+
+  # Returns the name of the file the next shard has been rendered into, once
+  # it has, starting the pool on all of the shards for the first one.
+  def getFragment(self, idx, prefix, compact, precision):
+    assert idx == self.next_shard, "Shard {} was rendered out of order" \
+      .format(idx)
+    self.next_shard += 1
+    if self.pool is None:
+      self.temp_directory = tempfile.mkdtemp(prefix=".shards.",
+        dir=self.directory or ".")
+      self.pool = multiprocessing.Pool(self.processes, initShardWorker,
+        (self.graph,))
+      self.fragments = self.pool.imap(renderShardArgs,
+        [(start, end, self.temp_directory, prefix, compact, precision)
+          for start, end in self.ranges])
+    return next(self.fragments)
+
+  # Shuts down the pool, and removes whatever fragments are left.
+  def stop(self):
+    if self.pool is not None:
+      self.pool.terminate()
+      self.pool.join()
+      shutil.rmtree(self.temp_directory, ignore_errors=True)
+    self.pool = None
+    self.fragments = None
+    self.temp_directory = None
+    self.next_shard = 0
+
+# A shard of a graph's children, which renders as the file a worker process
+# rendered it into.
+class Shard(object):
 
+  __slots__ = ("shards", "idx")
+
+  def __init__(self, shards, idx):
+    self.shards = shards
+    self.idx = idx
+
+  def iterRender(self, prefix="", compact=False, precision=None):
+    filename = self.shards.getFragment(self.idx, prefix, compact, precision)
+    try:
+      with open(filename) as f:
+        while True:
+          chunk = f.read(SHARD_BUFFER_SIZE)
+          if not chunk:
+            break
+          yield chunk
+    finally:
+      os.remove(filename)
+
+# Puts the group holding the SVGs of a graph's nodes and edges into an SVG.
+def getGraphSVG(g):
+  return Svg() \
+    .param("width", CENTER * 2) \
+    .param("height", CENTER * 2) \
+    .precision(COORDINATE_PRECISION) \
+    .child(g)
+
+# Returns the offsets of each node's entries in an array sorted by node, given
+# the number of entries of each node.
+def getOffsets(counts):
+  offsets = array.array("l", [0]) * (len(counts) + 1)
+  total = 0
+  for node, count in enumerate(counts):
+    total += count
+    offsets[node + 1] = total
+  return offsets
+
+# Sorts the indices of entries (moves, edges) by the nodes they belong to, in
+# the order they were added, given the offsets of each node's entries and the
+# node of each entry (entries with two nodes, such as edges, are sorted under
+# both of them).
+def sortByNode(offsets, *entry_nodes):
+  ends = array.array("l", offsets)
+  result = array.array("l", [0]) * offsets[-1]
+  for entry in range(len(entry_nodes[0])):
+    for nodes in entry_nodes:
+      node = nodes[entry]
+      result[ends[node]] = entry
+      ends[node] += 1
+  return result
+
+# The formats that graphs are rendered in by default.
+def getFormats():
+  if RENDER_FORMATS is not None:
+    return RENDER_FORMATS
+  return ["html" if RENDER_HTML else "svg"]
+
+# The path of an edge between two points. Every one uses the same commands,
+# so that they can be animated between.
+def getEdgePath(start, end):
+  return PathData(shortest=False).command("M", *start).command("L", *end)
+
+# All animations of a move share one interned set of timing params.
 def getBaseAnimation(begin):
+  return Animate().shareParams(internParams(
+    ("dur", "{}s".format(SECONDS_PER_MOVE)),
+    ("begin", begin),
+    ("fill", "freeze"),
+    ("attributeType", "XML")))
+
+# Returns the number of decimal places for the key times of an animation
+# lasting dur seconds. Key times a move apart differ by SECONDS_PER_MOVE / dur,
+# so one more place than that takes keeps each within a tenth of a move of its
+# time, and distinct from the others.
+def getKeyTimePrecision(dur):
+  places = int(math.ceil(math.log10(dur / SECONDS_PER_MOVE))) + 1
+  return max(KEY_TIME_PRECISION, places)
+
+# Animates an attribute through the value at the given index of each (t, ...)
+# keyframe, from the start of the document to the last keyframe.
+def getKeyframeAnimation(name, frames, idx):
+  dur = frames[-1][0]
   return Animate() \
-    .param("dur", "{}s".format(SECONDS_PER_MOVE)) \
-    .param("begin", begin) \
+    .param("attributeName", name) \
+    .param("attributeType", "XML") \
+    .param("begin", "0s") \
+    .param("dur", "{}s".format(formatNumber(dur, exponent=False))) \
     .param("fill", "freeze") \
-    .param("attributeType", "XML")
+    .keyframes([frame[idx] for frame in frames],
+      [frame[0] / dur for frame in frames], getKeyTimePrecision(dur))
+
+# Yields where a node with the given (t, x, y) keyframes is at each of the
+# given times, which are in order, so the keyframes are walked through once.
+def iterKeyframePositions(frames, times):
+  idx = 0
+  for t in times:
+    while idx < len(frames) and frames[idx][0] <= t:
+      idx += 1
+    if idx == len(frames):
+      yield frames[-1][1:]
+      continue
+    start_t, start_x, start_y = frames[idx - 1]
+    end_t, end_x, end_y = frames[idx]
+    s = (t - start_t) / (end_t - start_t)
+    yield start_x + (end_x - start_x) * s, start_y + (end_y - start_y) * s
 
 def addMove(graph, vertices, coprime, n, prev_move):
-  curr_idx = graph.nodes[n].positions[-1][1] * vertices
+  node = Node(graph, n)
+  curr_idx = node.getLastPosition()[1] * vertices
   next_idx = (curr_idx - coprime) % vertices
-  move_name = graph.nodes[n].addPosition(
-    RADIUS, next_idx / float(vertices), prev_move)
-  return move_name
+  return node.addPosition(RADIUS, next_idx / float(vertices), prev_move)
 
+def gcd(a, b):
+  while b:
+    a, b = b, a % b
+  return a
+
+# Stepping by coprime from coprime - 1, the sequence reaches vertices - 1 (where
+# it stops) after vertices / gcd(vertices, coprime) steps.
 def generateMoveSequence(vertices, coprime):
-  seq = []
-  idx = -1 + coprime
-  while idx != vertices - 1:
-    seq.append(idx)
-    idx = (idx + coprime) % vertices
-  return seq
+  length = vertices // gcd(vertices, coprime) - 1
+  return [(coprime - 1 + k * coprime) % vertices for k in range(length)]
 
+# Likewise, multiples of coprime first come back around to 0 after
+# vertices / gcd(vertices, coprime) steps.
 def numMoveRepetitions(vertices, coprime):
-  num = 1
-  idx = coprime
-  while idx != 0:
-    num += 1
-    idx = (idx + coprime) % vertices
-  return num
+  return vertices // gcd(vertices, coprime)
+
+# The full order in which the nodes of a displacing ring graph move: the move
+# sequence, repeated numMoveRepetitions times. Each entry is computed in closed
+# form when needed, so this acts as a lazy sequence of node indices, which can
+# be indexed, iterated over and sliced (into another lazy MoveSchedule).
+class MoveSchedule(object):
+
+  def __init__(self, vertices, coprime, start=0, step=1, length=None):
+    assert vertices > 1, "A ring needs at least 2 vertices, not {}" \
+      .format(vertices)
+    assert 0 < coprime < vertices and gcd(vertices, coprime) == 1, \
+      "{} is not co-prime to {}".format(coprime, vertices)
+    self.vertices = vertices
+    self.coprime = coprime
+    # Every repetition is the same sequence of vertices - 1 moves.
+    self.period = vertices - 1
+    self.start = start
+    self.step = step
+    if length is None:
+      length = numMoveRepetitions(vertices, coprime) * self.period
+    self.length = length
+
+  def __len__(self):
+    return self.length
+
+  # Returns the node that makes the idx-th move of the full schedule.
+  def getNode(self, idx):
+    return (self.coprime - 1 + (idx % self.period) * self.coprime) \
+      % self.vertices
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      start, stop, step = key.indices(self.length)
+      if step > 0:
+        length = max(0, (stop - start + step - 1) // step)
+      else:
+        length = max(0, (start - stop - step - 1) // -step)
+      return MoveSchedule(self.vertices, self.coprime,
+        self.start + start * self.step, self.step * step, length)
+    if key < 0:
+      key += self.length
+    if not 0 <= key < self.length:
+      raise IndexError("Move {} is out of range".format(key))
+    return self.getNode(self.start + key * self.step)
+
+  def __iter__(self):
+    idx = self.start
+    for _ in range(self.length):
+      yield self.getNode(idx)
+      idx += self.step
 
 # Code for generating displacing ring graphs. They have an equilateral with
 # some number of vertices, except one has been removed. The nodes then serially
 # move into the displaced spot (thereby changing the location of the
 # displacement) continuously. To determine which node moves first, a second
-# number, co-prime to the number of vertices, is supplied.
-def generateDisplacingRingGraph(name, vertices, coprime):
+# number, co-prime to the number of vertices, is supplied. Large graphs can be
+# limited to their first max_moves moves.
+def generateDisplacingRingGraph(name, vertices, coprime, max_moves=None):
+  # Checks the arguments before doing any work.
+  schedule = MoveSchedule(vertices, coprime)
+  if max_moves is not None:
+    schedule = schedule[:max_moves]
   graph = Graph(name)
   for i in range(vertices - 1):
-    graph.addNode(Node("n{}".format(i), RADIUS, i / float(vertices)))
+    graph.addNode("n{}".format(i), RADIUS, i / float(vertices))
   for i in range(vertices - 1):
-    n1 = graph.nodes[i]
-    n2 = graph.nodes[(i + 1) % (vertices - 1)]
-    graph.addEdge(Edge(n1, n2))
+    graph.addEdge(i, (i + 1) % (vertices - 1))
 
-  # Number of times each node needs to move to get back to where it started.
-  # (Minus 1 because it loops.)
+  # The schedule repeats the order of rotations as many times as each node
+  # needs to move to get back to where it started.
   prev_move = None
-  for j in range(numMoveRepetitions(vertices, coprime)):
-    # Order of rotations.
-    for i in generateMoveSequence(vertices, coprime):
-      prev_move = addMove(graph, vertices, coprime, i, prev_move)
+  for i in schedule:
+    prev_move = addMove(graph, vertices, coprime, i, prev_move)
   # Lastly, let's tie the last motion to the first, so that the entire thing
   # cycles indefinitely. It still needs to start with 0s (to get the entire
   # animation moving).
   # graph.nodes[-1 + coprime].moves[0].prev_move = "0s;{}".format(prev_move)
   return graph
 
-VERTICES = 5
-COPRIME = 2
+# Returns the cells of a rows by columns grid, as (row, column), in the order
+# of a cycle through all of them, each next to the one before (and the last
+# next to the first). That takes an even number of rows or columns.
+def getGridCycle(rows, columns):
+  if rows % 2:
+    return [(row, column) for column, row in getGridCycle(columns, rows)]
+  # Down the first column, then back up through the others, snaking across
+  # each row in turn. With an even number of rows, the last row snakes back
+  # to the second column, next to the start.
+  cycle = [(row, 0) for row in range(rows)]
+  for row in reversed(range(rows)):
+    columns_in_row = range(1, columns)
+    if (rows - 1 - row) % 2:
+      columns_in_row = reversed(columns_in_row)
+    cycle.extend((row, column) for column in columns_in_row)
+  return cycle
+
+# Code for generating displacing grid graphs, the sliding puzzles of graphs.
+# The nodes fill a grid of rows by columns cells, except one cell which is
+# empty, and have an edge to each of their neighbours in the grid. Moves then
+# slide a neighbour of the empty cell into it (thereby moving the empty cell),
+# the empty cell going round a cycle of every cell, so that every node moves
+# once per lap. Graphs are limited to their first max_moves moves, one lap by
+# default.
+def generateDisplacingGridGraph(name, rows, columns, max_moves=None):
+  assert rows > 1 and columns > 1 and (rows * columns) % 2 == 0, \
+    "A {} by {} grid has no cycle through every cell".format(rows, columns)
+  cycle = getGridCycle(rows, columns)
+  spacing = 2.0 * RADIUS / (max(rows, columns) - 1)
+  def getCell(row, column):
+    return cartesian2polar(CENTER + (column - (columns - 1) / 2.0) * spacing,
+      CENTER + (row - (rows - 1) / 2.0) * spacing)
+  graph = Graph(name)
+  # Nodes start in the cells of the cycle but the last, which is empty.
+  nodes = {}
+  for idx, (row, column) in enumerate(cycle[:-1]):
+    graph.addNode("n{}".format(idx), *getCell(row, column))
+    nodes[(row, column)] = idx
+  for (row, column), node in sorted(nodes.items()):
+    for neighbour in [(row, column + 1), (row + 1, column)]:
+      if neighbour in nodes:
+        graph.addEdge(node, nodes[neighbour])
+
+  if max_moves is None:
+    max_moves = len(cycle) - 1
+  # Which node is in each cell of the cycle (None for the empty one).
+  occupants = list(range(len(cycle) - 1)) + [None]
+  empty = len(cycle) - 1
+  prev_move = None
+  for _ in range(max_moves):
+    source = (empty - 1) % len(cycle)
+    node = occupants[source]
+    prev_move = graph.addMove(node, *getCell(*cycle[empty]),
+      prev_move=prev_move)
+    occupants[empty], occupants[source] = node, None
+    empty = source
+  return graph
+
+# Code for generating random graphs: vertices nodes, placed at random in the
+# circle, with num_edges edges between random pairs of them. Then moves random
+# nodes to random places, one after another, num_moves times. The same seed
+# always generates the same graph.
+def generateRandomGraph(name, vertices, num_edges, num_moves, seed=None):
+  assert num_edges <= vertices * (vertices - 1) // 2, \
+    "{} nodes can't have {} edges".format(vertices, num_edges)
+  rng = random.Random(seed)
+  # Uniformly spread over the circle's area, rather than bunched at its center.
+  def getPlace():
+    return RADIUS * math.sqrt(rng.random()), rng.random()
+  graph = Graph(name)
+  for i in range(vertices):
+    graph.addNode("n{}".format(i), *getPlace())
+  pairs = set()
+  while len(pairs) < num_edges:
+    node1, node2 = rng.randrange(vertices), rng.randrange(vertices)
+    if node1 != node2 and (node2, node1) not in pairs:
+      pairs.add((node1, node2))
+  for node1, node2 in sorted(pairs):
+    graph.addEdge(node1, node2)
+  prev_move = None
+  for _ in range(num_moves):
+    prev_move = graph.addMove(rng.randrange(vertices), *getPlace(),
+      prev_move=prev_move)
+  return graph
+
+if __name__ == "__main__":
+  VERTICES = 5
+  COPRIME = 2
 
-graph = generateDisplacingRingGraph("pentagon", VERTICES, COPRIME)
-graph.render()
+  graph = generateDisplacingRingGraph("pentagon", VERTICES, COPRIME)
+  graph.render()
 
-VERTICES = 4
-COPRIME = 1
+  VERTICES = 4
+  COPRIME = 1
 
-graph = generateDisplacingRingGraph("square", VERTICES, COPRIME)
-graph.render()
+  graph = generateDisplacingRingGraph("square", VERTICES, COPRIME)
+  graph.render()
 
-VERTICES = 3
-COPRIME = 1
+  VERTICES = 3
+  COPRIME = 1
 
-graph = generateDisplacingRingGraph("triangle", VERTICES, COPRIME)
-graph.render()
+  graph = generateDisplacingRingGraph("triangle", VERTICES, COPRIME)
+  graph.render()
@@ -0,0 +1,228 @@
+# Loads SVG (and HTML around SVG) files back into trees of svg_code elements,
+# so that existing documents can be post-processed, optimized and re-rendered.
+#
+# Files are parsed as a stream, a chunk at a time, and elements are built as
+# their tags go by. Tags map onto the classes in ELEMENTS, and params onto what
+# each class accepts (see isValidParam): anything else is dropped and counted,
+# or rejected outright in strict mode. Whole subtrees can be handed to a
+# callback as soon as they are complete, instead of being kept in the tree, so
+# that files larger than memory can still be processed.
+#
+# Usage: python svg_load.py INPUT [--output FILE] [--compact]
+#                                 [--precision N] [--strict]
+
+import argparse
+import gzip
+import re
+import sys
+import xml.parsers.expat
+
+from svg_code import *
+
+# Size of the chunks files are read and parsed in.
+READ_BUFFER_SIZE = 64 * 1024
+# Extensions of files that are gzip-compressed (see OUTPUT_FORMATS).
+COMPRESSED_EXTENSIONS = (".svgz", ".gz")
+# Params holding path data, which are loaded as PathData so that they render
+# with the precision of the tree they're in.
+PATH_PARAMS = frozenset(["d", "path"])
+# Params holding lists separated by semicolons, which are loaded as lists of
+# values so that their numbers (and path data) render with the precision of the
+# tree they're in, like those given to Animate.keyframes.
+LIST_PARAMS = frozenset(["values", "keyTimes"])
+# The start of path data, as opposed to any other text, in a list of values.
+PATH_START = re.compile(r"^\s*[Mm]")
+INTEGER = re.compile(r"^[-+]?\d+$")
+FLOAT = re.compile(r"^[-+]?(?:\d+\.\d*|\.?\d+)(?:[eE][-+]?\d+)?$")
+
+# Converts a param's value from the text in the file to what the element would
+# have been given in code: numbers, path data and lists of them, or else the
+# text itself.
+def parseValue(key, value):
+  if key in LIST_PARAMS:
+    return [parseValue("d" if PATH_START.match(part) else None, part.strip())
+      for part in value.split(";") if part.strip()]
+  if key in PATH_PARAMS:
+    try:
+      # Keeping the commands as given round-trips the path as written.
+      return PathData(shortest=False).parse(value)
+    except ValueError:
+      return value
+  if INTEGER.match(value):
+    return int(value)
+  if FLOAT.match(value):
+    return float(value)
+  return value
+
+# Splits the contents of a style sheet into its rules.
+def parseRules(text):
+  return [rule.strip() + "}" for rule in text.split("}") if rule.strip()]
+
+class SvgLoader(object):
+
+  def __init__(self, strict=False):
+    # Whether anything outside the schema is an error, rather than dropped.
+    self.strict = strict
+    # Statistics, over everything loaded so far.
+    self.elements = 0
+    self.dropped_elements = {}
+    self.dropped_params = {}
+
+  # Opens a file to load, given its name or as a file object already.
+  def open(self, source):
+    if hasattr(source, "read"):
+      return source
+    if source.endswith(COMPRESSED_EXTENSIONS):
+      return gzip.open(source, "rb")
+    return open(source, "rb")
+
+  # Parses a file, yielding ("start", element) as each element's opening tag is
+  # read, and ("end", element) once it is complete, like iterparse. Elements
+  # have their params on start, and their text on end. Their parent is set to
+  # the element enclosing them, but they aren't added to its children: that's
+  # up to the caller (see load).
+  def iterParse(self, source):
+    events = []
+    # The elements enclosing the current one, whether each has had a child yet,
+    # and how many levels of dropped elements deep the parser is.
+    stack = []
+    has_children = []
+    skipping = [0]
+    # The text read so far of the current element. Only text before the first
+    # child is kept (Text and Style have their text, then any children).
+    text = []
+
+    def start(tag, attributes):
+      parent = stack[-1] if stack else None
+      if skipping[0] or tag not in ELEMENTS or isinstance(parent, XmlLeaf):
+        assert not self.strict, \
+          "{} is not a valid element{}".format(tag,
+            "" if parent is None else " in " + parent.tag)
+        if not skipping[0]:
+          self.dropped_elements[tag] = self.dropped_elements.get(tag, 0) + 1
+        skipping[0] += 1
+        return
+      cls = ELEMENTS[tag]
+      element = Text("") if cls is Text else cls()
+      element.parent = parent
+      # Attributes come as a flat list of names and values, in the order they
+      # were written.
+      for idx in range(0, len(attributes), 2):
+        key = attributes[idx]
+        if element.isValidParam(key):
+          element.params[key] = parseValue(key, attributes[idx + 1])
+          continue
+        assert not self.strict, "{} is not a valid param in class {}" \
+          .format(key, cls.__name__)
+        self.dropped_params[(tag, key)] = \
+          self.dropped_params.get((tag, key), 0) + 1
+      if stack:
+        setText(parent)
+        has_children[-1] = True
+      stack.append(element)
+      has_children.append(False)
+      self.elements += 1
+      events.append(("start", element))
+
+    def end(tag):
+      if skipping[0]:
+        skipping[0] -= 1
+        return
+      element = stack.pop()
+      if not has_children.pop():
+        setText(element)
+      events.append(("end", element))
+
+    def characters(data):
+      if not skipping[0] and stack and not has_children[-1] and \
+          isinstance(stack[-1], (Text, Style)):
+        text.append(data)
+
+    def setText(element):
+      if text and isinstance(element, Text):
+        element.text = "".join(text).strip()
+      elif text and isinstance(element, Style):
+        element.rules = parseRules("".join(text))
+      del text[:]
+
+    # Namespaces aren't processed, so that prefixed params (xlink:href) keep
+    # their prefix, whether or not the file declares it.
+    parser = xml.parsers.expat.ParserCreate()
+    parser.ordered_attributes = True
+    if hasattr(parser, "returns_unicode"):
+      parser.returns_unicode = False
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = characters
+    f = self.open(source)
+    try:
+      while True:
+        data = f.read(READ_BUFFER_SIZE)
+        parser.Parse(data, not data)
+        for event in events:
+          yield event
+        del events[:]
+        if not data:
+          break
+    finally:
+      if f is not source:
+        f.close()
+
+  # Loads a file into a tree, returning its root element. With a callback, the
+  # subtrees at the given depth (the root's children, by default) are passed to
+  # it as each is completed, and left out of the tree.
+  def load(self, source, callback=None, depth=1):
+    root = None
+    level = -1
+    for event, element in self.iterParse(source):
+      if event == "start":
+        level += 1
+        if root is None:
+          root = element
+        continue
+      if callback is not None and level == depth:
+        callback(element)
+      elif element.parent is not None:
+        element.parent.child(element)
+      level -= 1
+    assert root is not None, "{} has no elements to load".format(source)
+    return root
+
+  def __str__(self):
+    lines = ["Loaded {} elements".format(self.elements)]
+    for tag, count in sorted(self.dropped_elements.items()):
+      lines.append("Dropped {} <{}> elements".format(count, tag))
+    for (tag, key), count in sorted(self.dropped_params.items()):
+      lines.append("Dropped {} {} params of <{}>".format(count, key, tag))
+    return "\n".join(lines)
+
+# Loads a file into a tree, dropping whatever isn't in the schema. See
+# SvgLoader.load.
+def loadSvg(source, callback=None, depth=1, strict=False):
+  return SvgLoader(strict).load(source, callback, depth)
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description="Loads an SVG, reporting anything outside the schema.")
+  parser.add_argument("input", help="SVG or HTML file to load.")
+  parser.add_argument("--output", default=None,
+    help="File to render the loaded document back into.")
+  parser.add_argument("--compact", action="store_true",
+    help="Render without indentation or line wrapping.")
+  parser.add_argument("--precision", type=int, default=None,
+    help="Number of decimal places to render numbers with.")
+  parser.add_argument("--strict", action="store_true",
+    help="Fail on anything outside the schema, instead of dropping it.")
+  args = parser.parse_args(argv)
+
+  loader = SvgLoader(args.strict)
+  root = loader.load(args.input)
+  print(str(loader))
+  if args.output is not None:
+    with atomicOpen(args.output, "wb") as f:
+      root.write(f, "", "utf-8", args.compact, args.precision)
+    print("Wrote to {}".format(args.output))
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,603 @@
+# Optimization passes over trees of svg_code elements, which shrink the
+# rendered output without changing what it draws. Passes rewrite the tree they
+# are given in place.
+
+import re
+import timeit
+
+from svg_code import *
+from svg_timeline import *
+
+# Params that place an element, by tag. Repeats of an element that only differ
+# in these are still deduplicated, with each <use> supplying them as its x and
+# y. This is only done for elements without children, whose children (e.g.
+# animations of the position) could depend on them.
+POSITION_PARAMS = {
+  "circle": ("cx", "cy"),
+  "text": ("x", "y"),
+}
+# Elements that are never moved into <defs>, nor are their subtrees. Neither are
+# elements that can't be given an id. Animations (and the <mpath>s in them)
+# act on the element they're in, so they stay with it, and what they animate
+# stays in place.
+UNMOVABLE_TAGS = frozenset(["html", "body", "svg", "defs", "symbol", "animate",
+  "animateMotion", "mpath"])
+# Prefix of the ids given to the definitions of deduplicated subtrees.
+DEF_ID_PREFIX = "d"
+# Presentation params, which are inherited by an element's children, and so can
+# be set once on a group of elements instead of on each of them.
+PRESENTATION_PARAMS = frozenset(["fill", "stroke", "stroke-width", "font-size",
+  "font-family", "text-anchor", "visibility"])
+# Elements whose presentation params are hoisted. Others (e.g. animations,
+# where fill means something else entirely) are left alone.
+STYLED_TAGS = frozenset(["g", "path", "text", "circle", "line", "use"])
+# Prefix of the names of classes generated for hoisted styles.
+CLASS_PREFIX = "s"
+# Number of decimal places that the offsets of rewired begin params are
+# rendered with.
+TIME_PRECISION = 6
+# A reference to another element, in a begin param of any kind.
+REFERENCE = re.compile(r"([A-Za-z_][\w:-]*)\.")
+
+# Where a subtree appears in the tree.
+class Occurrence(object):
+
+  __slots__ = ("element", "parent", "index", "size", "position", "digits")
+
+  def __init__(self, element, parent, index, size, position, digits):
+    self.element = element
+    self.parent = parent
+    self.index = index
+    # The number of elements in the subtree.
+    self.size = size
+    # The values of the element's position params, if it can be placed by a
+    # <use>.
+    self.position = position
+    # The precision the subtree is rendered with where it is.
+    self.digits = digits
+
+# Compares PathData and lists (e.g. of keyframe values) by their contents, and
+# anything else as is.
+def getValueKey(value):
+  if isinstance(value, PathData):
+    return ("PathData", value.shortest, tuple(value.commands),
+      tuple(value.coords))
+  if isinstance(value, list):
+    return ("list", tuple(getValueKey(v) for v in value))
+  return value
+
+# Walks a subtree, recording where every movable subtree in it occurs, keyed by
+# a description of its structure that's the same for structurally identical
+# subtrees (same classes, params, text and children, in the same order, and
+# rendered at the same precision). Returns the subtree's own key, which is None
+# if it can't be moved, and its size. Also collects every id in use.
+def indexSubtree(element, parent, index, digits, occurrences, ids):
+  if element.digits is not None:
+    digits = element.digits
+  element_id = element.getParam("id")
+  if element_id is not None:
+    ids.add(element_id)
+  # Moving an element with an id would duplicate its id, or break references
+  # to it.
+  movable = element_id is None and element.tag not in UNMOVABLE_TAGS and \
+    element.isValidParam("id")
+  child_keys = []
+  size = 1
+  if isinstance(element, XmlNode):
+    for i, child in enumerate(element.children):
+      key, child_size = indexSubtree(child, element, i, digits, occurrences,
+        ids)
+      size += child_size
+      movable = movable and key is not None
+      child_keys.append(key)
+  if not movable:
+    return None, size
+  params = dict((k, getValueKey(v)) for k, v in element.iterParams())
+  position = None
+  names = POSITION_PARAMS.get(element.tag)
+  if names is not None and not child_keys and \
+      all(name in element.params for name in names):
+    position = tuple(element.params[name] for name in names)
+    for name in names:
+      del params[name]
+  key = (type(element).__name__, element.tag, digits,
+    tuple(sorted(params.items())), getattr(element, "text", None),
+    tuple(child_keys))
+  if parent is not None and not isinstance(element, Use):
+    occurrences.setdefault(key, []).append(
+      Occurrence(element, parent, index, size, position, digits))
+  return (key, position), size
+
+def getRenderedSize(element, digits):
+  return sum(len(chunk) for chunk in element.iterRender("", True, digits))
+
+def addSubtreeIds(element, ids):
+  stack = [element]
+  while stack:
+    element = stack.pop()
+    ids.add(id(element))
+    if isinstance(element, XmlNode):
+      stack.extend(element.children)
+
+# Moves subtrees that appear more than once into a <defs> at the start of the
+# document, replacing every appearance with a <use> of it. Larger subtrees are
+# deduplicated first, and subtrees are only moved where that shrinks the
+# (compact) output. Returns the number of <use>s created.
+def deduplicate(root):
+  assert isinstance(root, Svg), "Subtrees can only be deduplicated in an <svg>"
+  occurrences = {}
+  ids = set()
+  indexSubtree(root, None, 0, root.digits, occurrences, ids)
+  # Ancestors are larger than their descendants, so are deduplicated first.
+  # The elements of the repeats they replace (by id()) are then left out of
+  # further deduplication.
+  candidates = sorted(occurrences.values(),
+    key=lambda found: -found[0].size)
+  replaced = set()
+  defs = Defs()
+  uses = 0
+  for found in candidates:
+    found = [o for o in found if id(o.element) not in replaced]
+    if len(found) < 2:
+      continue
+    first = found[0]
+    def_id = "{}{}".format(DEF_ID_PREFIX, len(defs.children))
+    while def_id in ids:
+      def_id += "_"
+    replacements = []
+    for o in found:
+      use = Use().link(def_id)
+      if o.position is not None:
+        use.position(*o.position)
+      replacements.append(use)
+    # The definition is about the size of one of the repeats.
+    size = getRenderedSize(first.element, first.digits)
+    use_size = max(getRenderedSize(use, first.digits) for use in replacements)
+    if (len(found) - 1) * size <= len(found) * use_size + len(def_id) + 6:
+      continue
+    for o, use in zip(found, replacements):
+      addSubtreeIds(o.element, replaced)
+      o.parent.children[o.index] = use
+      use.parent = o.parent
+      o.parent.invalidate()
+    # The first repeat becomes the definition, at the origin.
+    element = first.element
+    if first.position is not None:
+      for name in POSITION_PARAMS[element.tag]:
+        del element.params[name]
+    element.id(def_id)
+    if element.digits is None:
+      element.precision(first.digits)
+    defs.child(element)
+    # Its subtree is still in the document (just in <defs>), so the repeats
+    # within it can be deduplicated too.
+    stack = list(element.children) if isinstance(element, XmlNode) else []
+    while stack:
+      descendant = stack.pop()
+      replaced.discard(id(descendant))
+      if isinstance(descendant, XmlNode):
+        stack.extend(descendant.children)
+    uses += len(replacements)
+  if defs.children:
+    root.children = [defs] + list(root.children)
+    defs.parent = root
+    root.invalidate()
+  return uses
+
+# Returns the presentation params set on an element itself, if it has any that
+# can be hoisted.
+def getStyle(element):
+  if element.tag not in STYLED_TAGS:
+    return None
+  return set((k, v) for k, v in element.params.items()
+    if k in PRESENTATION_PARAMS)
+
+# The length of a param once rendered, give or take its precision.
+def getParamSize(param):
+  return len(param[0]) + len(str(param[1])) + 4
+
+# Hoists the presentation params shared by runs of sibling elements onto a
+# group around them: the enclosing G, when the run is all of its children, or
+# else a new one. Works bottom up, so that the params hoisted into a group can
+# be hoisted further still. Returns the number of params removed.
+def hoistToGroups(element):
+  if not isinstance(element, XmlNode):
+    return 0
+  removed = 0
+  for child in element.children:
+    removed += hoistToGroups(child)
+  # Each round hoists at least one param from every run it groups, so this
+  # ends once the runs have nothing left in common.
+  changed = True
+  while changed:
+    changed = False
+    children = list(element.children)
+    idx = 0
+    while idx < len(children):
+      common = getStyle(children[idx])
+      end = idx + 1
+      while common and end < len(children):
+        style = getStyle(children[end])
+        if not style or not common & style:
+          break
+        common &= style
+        end += 1
+      run = children[idx:end]
+      whole = isinstance(element, G) and len(run) == len(children)
+      saving = sum(getParamSize(param) for param in common or ()) * \
+        (len(run) - (0 if whole else 1))
+      if len(run) < 2 or saving <= len("<g></g>"):
+        idx = end
+        continue
+      group = element if whole else G()
+      for k, v in common:
+        group.param(k, v)
+        for child in run:
+          del child.params[k]
+          child.invalidate()
+      if not whole:
+        group.child(*run)
+        children[idx:end] = [group]
+      removed += len(common) * len(run)
+      changed = True
+      idx += 1 if not whole else len(run)
+    element.children = children
+    for child in children:
+      child.parent = element
+    element.invalidate()
+  return removed
+
+# Replaces the presentation params of elements with classes, one per set of
+# params (and precision) that appears often enough to be worth it, defined in a
+# <style> at the start of the document. Elements that already have a class are
+# left alone. Returns the number of params removed.
+def hoistToClasses(root):
+  styled = {}
+  stack = [(root, root.digits)]
+  while stack:
+    element, digits = stack.pop()
+    if element.digits is not None:
+      digits = element.digits
+    style = getStyle(element)
+    if style and element.getParam("class") is None:
+      key = (tuple(sorted(style)), digits)
+      styled.setdefault(key, []).append(element)
+    if isinstance(element, XmlNode):
+      stack.extend((child, digits) for child in reversed(element.children))
+  sheet = Style()
+  removed = 0
+  for (style, digits), elements in sorted(styled.items(),
+      key=lambda item: -len(item[1])):
+    name = "{}{}".format(CLASS_PREFIX, len(sheet.rules))
+    declarations = [(k, str(formatValue(v, digits))) for k, v in style]
+    rule_size = len(name) + sum(len(k) + len(v) + 2 for k, v in declarations)
+    saving = len(elements) * (sum(getParamSize(param) for param in style) -
+      len(name) - 9)
+    if len(elements) < 2 or saving <= rule_size:
+      continue
+    sheet.rule("." + name, declarations)
+    for element in elements:
+      for k, _ in style:
+        del element.params[k]
+      element.param("class", name)
+    removed += len(style) * len(elements)
+  if sheet.rules:
+    root.children = [sheet] + list(root.children)
+    sheet.parent = root
+    root.invalidate()
+  return removed
+
+# Hoists presentation params shared between elements, either onto groups
+# around them (see hoistToGroups) or, with classes, into a style sheet (see
+# hoistToClasses). Returns the number of params removed.
+def hoistStyles(root, classes=False):
+  if classes:
+    return hoistToClasses(root)
+  return hoistToGroups(root)
+
+# Returns how a value renders at the given precision, treating numbers given as
+# text (e.g. in loaded files) like numbers.
+def getRenderedValue(value, digits):
+  if isinstance(value, str):
+    try:
+      value = float(value)
+    except ValueError:
+      pass
+  return str(formatValue(value, digits))
+
+# Yields every element under root, with the element it's in and the precision
+# it's rendered with.
+def iterElements(root):
+  stack = [(root, None, root.resolvePrecision(None))]
+  while stack:
+    element, parent, digits = stack.pop()
+    yield element, parent, digits
+    if isinstance(element, XmlNode):
+      stack.extend((child, element, child.resolvePrecision(digits))
+        for child in reversed(element.children))
+
+# Returns the values an animation goes through, or None if they aren't all
+# given (an animation without a from starts from wherever the attribute is).
+def getAnimationValues(animation):
+  values = animation.getParam("values")
+  if values is not None:
+    return parseList(values)
+  start = animation.getParam("from")
+  end = animation.getParam("to")
+  if start is None or end is None:
+    return None
+  return [start, end]
+
+# Splits a begin param into (reference, event, offset) parts, the reference
+# being None for clock values. Returns None if any part is of another kind
+# (e.g. an event).
+def getBeginParts(begin):
+  parts = []
+  for part in str(begin).split(";"):
+    match = BEGIN_VALUE.match(part)
+    if match is None or match.group(4) is None and match.group(1) is None:
+      return None
+    ref, event, sign, offset = match.groups()
+    offset = 0.0 if offset is None else parseClock(offset)
+    parts.append((ref, event, -offset if sign == "-" else offset))
+  return parts
+
+def formatBeginPart(ref, event, offset):
+  clock = "{}s".format(formatNumber(float(abs(offset)), TIME_PRECISION,
+    exponent=False))
+  if ref is None:
+    return ("-" if offset < 0 else "") + clock
+  if offset == 0:
+    return "{}.{}".format(ref, event)
+  return "{}.{}{}{}".format(ref, event, "-" if offset < 0 else "+", clock)
+
+# Returns the ids referred to by begin params that can't be rewired (see
+# getBeginParts), such as events. Animations with those ids are never removed,
+# since nothing could take the place of their references.
+def getUnwirableRefs(root):
+  refs = set()
+  for element, _, _ in iterElements(root):
+    if isinstance(element, (Animate, AnimateMotion)):
+      begin = element.getParam("begin", "0s")
+      if getBeginParts(begin) is None:
+        refs.update(REFERENCE.findall(str(begin)))
+  return refs
+
+# Replaces the parts of a begin param that reference removed animations with
+# what those began relative to. Removed animations are given by id, as the
+# parts of their begin and of their end.
+def rewireParts(parts, removed):
+  rewired = []
+  for ref, event, offset in parts:
+    if ref not in removed:
+      rewired.append((ref, event, offset))
+      continue
+    for target_ref, target_event, target_offset in removed[ref][event]:
+      rewired.append((target_ref, target_event, target_offset + offset))
+  return rewired
+
+# Removes animations that don't change anything: ones that hold their attribute
+# at the value it already has, from an animation that has finished (and
+# frozen), or from the element itself. Animations that begin relative to a
+# removed one are rewired to begin relative to what it began relative to.
+# Returns the number of animations removed.
+def removeNoopAnimations(root):
+  timeline = Timeline(root)
+  unwirable = getUnwirableRefs(root)
+  # Removed animations, by id(), and the begin and end of those with an id
+  # param, by id param, in the order they begin.
+  removed = set()
+  removed_ids = []
+  for element, parent, digits in iterElements(root):
+    if not isinstance(element, Animate) or parent is None:
+      continue
+    interval = timeline.intervals.get(id(element))
+    values = getAnimationValues(element)
+    if interval is None or interval.end is None or not values:
+      continue
+    rendered = set(getRenderedValue(value, digits) for value in values)
+    if len(rendered) != 1:
+      continue
+    # Find what the attribute would be when the animation begins, without it.
+    attribute = element.getParam("attributeName")
+    track = timeline.tracks[id(parent)][attribute]
+    idx = track.intervals.index(interval)
+    prior = None
+    while idx > 0:
+      idx -= 1
+      other = track.intervals[idx]
+      prior = other.getValue(interval.begin)
+      if prior is None:
+        continue
+      # One that's still running keeps changing the attribute.
+      if other.end is None or other.end > interval.begin:
+        prior = None
+      break
+    else:
+      prior = parent.getParam(attribute)
+    if prior is None or getRenderedValue(prior, digits) not in rendered:
+      continue
+    element_id = element.getParam("id")
+    if element_id in unwirable:
+      continue
+    if element_id is not None:
+      parts = getBeginParts(element.getParam("begin", "0s"))
+      if parts is None:
+        continue
+      # A repeated animation ends after its last repeat.
+      runs = interval.end - interval.begin
+      removed_ids.append((interval.begin, element_id, {
+        "begin": parts,
+        "end": [(ref, event, offset + runs) for ref, event, offset in parts],
+      }))
+    removed.add(id(element))
+  if not removed:
+    return 0
+  # Removed animations can begin relative to other removed ones, which begin
+  # no later, so are rewired first.
+  removed_ids.sort(key=lambda item: item[0])
+  rewired = {}
+  for _, element_id, times in removed_ids:
+    rewired[element_id] = dict((event, rewireParts(parts, rewired))
+      for event, parts in times.items())
+  for element, parent, _ in iterElements(root):
+    if isinstance(element, XmlNode) and any(id(child) in removed
+        for child in element.children):
+      element.children = [child for child in element.children
+        if id(child) not in removed]
+      element.invalidate()
+    if not rewired or not isinstance(element, (Animate, AnimateMotion)):
+      continue
+    parts = getBeginParts(element.getParam("begin", "0s"))
+    if parts is not None and any(part[0] in rewired for part in parts):
+      element.param("begin", ";".join(formatBeginPart(*part)
+        for part in rewireParts(parts, rewired)))
+  return len(removed)
+
+# Returns the path data of a path that could be merged with others: one with
+# no id (nothing can refer to it), no children (nothing animates it) and no
+# fill (where the subpaths of a single path overlap, their fills can cancel
+# out). Returns None for any other element.
+def getMergeablePath(element):
+  if not isinstance(element, Path) or element.children or \
+      element.getParam("id") is not None or \
+      element.getParam("fill") != "none":
+    return None
+  d = element.getParam("d")
+  if isinstance(d, PathData):
+    return d
+  try:
+    return PathData().parse(str(d))
+  except ValueError:
+    return None
+
+def getMergeKey(element):
+  return (element.digits, element.shared, tuple(sorted(
+    (k, getValueKey(v)) for k, v in element.params.items() if k != "d")))
+
+# Merges runs of sibling paths styled the same into a single path, drawing the
+# subpaths of all of them. Only neighbouring paths are merged, so that nothing
+# is drawn in a different order. Returns the number of paths removed.
+def mergePaths(root):
+  removed = 0
+  for element, _, _ in iterElements(root):
+    if not isinstance(element, XmlNode) or len(element.children) < 2:
+      continue
+    children = []
+    # The path the current run is merged into, and its merged path data (once
+    # there's anything to merge into it).
+    merged = merged_d = None
+    for child in element.children:
+      d = getMergeablePath(child)
+      if d is None:
+        children.append(child)
+        merged = merged_d = None
+        continue
+      if merged is not None and getMergeKey(merged) == getMergeKey(child):
+        if merged_d is None:
+          merged_d = getMergeablePath(merged).copy()
+          merged.param("d", merged_d)
+        start = len(merged_d.commands)
+        merged_d.extend(d)
+        # A path starts at the origin, so its first move is absolute, even if
+        # it's written as relative. After another path, it wouldn't be.
+        if len(merged_d.commands) > start and \
+            merged_d.commands[start] == ord("m"):
+          merged_d.commands[start] = ord("M")
+        merged.invalidate()
+        removed += 1
+        continue
+      children.append(child)
+      merged = child
+      merged_d = None
+    if len(children) != len(element.children):
+      element.children = children
+      element.invalidate()
+  return removed
+
+# Removes groups that add nothing: ones without children, and ones without
+# params, whose children take their place. Groups with an id are kept, in case
+# something refers to them. Returns the number of groups removed.
+def collapseGroups(element):
+  if not isinstance(element, XmlNode):
+    return 0
+  removed = 0
+  for child in element.children:
+    removed += collapseGroups(child)
+  children = []
+  for child in element.children:
+    if not isinstance(child, G) or child.getParam("id") is not None:
+      children.append(child)
+      continue
+    if child.children and (child.params or child.shared or
+        child.digits is not None):
+      children.append(child)
+      continue
+    for grandchild in child.children:
+      grandchild.parent = element
+    children.extend(child.children)
+    removed += 1
+  if removed:
+    element.children = children
+    element.invalidate()
+  return removed
+
+# Optimization passes, by name: the function that rewrites a tree, and what the
+# number it returns counts.
+PASSES = {
+  "noop_animations": (removeNoopAnimations, "animations removed"),
+  "merge_paths": (mergePaths, "paths merged away"),
+  "collapse_groups": (collapseGroups, "groups removed"),
+  "deduplicate": (deduplicate, "subtrees replaced by uses"),
+  "hoist_groups": (hoistToGroups, "params hoisted onto groups"),
+  "hoist_classes": (hoistToClasses, "params hoisted into classes"),
+}
+# The passes run by default, in order.
+DEFAULT_PASSES = ["noop_animations", "merge_paths", "collapse_groups"]
+
+def countElements(root):
+  return sum(1 for _ in iterElements(root))
+
+# What each pass of an optimization did: what it counted, the number of
+# elements left in the tree after it, and how long it took.
+class OptimizeReport(object):
+
+  def __init__(self, elements):
+    self.elements = elements
+    self.passes = []
+
+  def add(self, name, count, unit, elements, seconds):
+    self.passes.append((name, count, unit, elements, seconds))
+
+  # The number of elements the passes removed altogether.
+  def removed(self):
+    if not self.passes:
+      return 0
+    return self.elements - self.passes[-1][3]
+
+  def __str__(self):
+    lines = ["Optimized {} elements down to {}".format(self.elements,
+      self.elements - self.removed())]
+    for name, count, unit, elements, seconds in self.passes:
+      lines.append("  {}: {} {}, {} elements left ({:.3f}s)".format(
+        name, count, unit, elements, seconds))
+    return "\n".join(lines)
+
+# Runs optimization passes over a tree, in order, returning an OptimizeReport.
+# Passes are given by name (see PASSES), or as functions that rewrite the tree
+# they're given and return how many things they changed.
+def optimize(root, passes=DEFAULT_PASSES):
+  report = OptimizeReport(countElements(root))
+  for optimization in passes:
+    if callable(optimization):
+      name, function, unit = optimization.__name__, optimization, "changes"
+    else:
+      assert optimization in PASSES, "{} is not a valid optimization pass" \
+        .format(optimization)
+      function, unit = PASSES[optimization]
+      name = optimization
+    start = timeit.default_timer()
+    count = function(root)
+    seconds = timeit.default_timer() - start
+    report.add(name, count, unit, countElements(root), seconds)
+  return report
@@ -0,0 +1,441 @@
+# A rasterizer for the documents that svg_code builds, to preview and make
+# thumbnails of them without a browser.
+#
+# It draws circles, lines, paths (straight, quadratic and cubic segments),
+# groups, <use>s and text (as boxes standing in for the glyphs), as they are at
+# any time into their animations, and writes them out as PNGs. Pixels are worked
+# out in bulk with NumPy when it's available, and one at a time in pure Python
+# otherwise. Frames sampled across a whole animation can be drawn in parallel.
+#
+# Usage: python svg_raster.py VERTICES COPRIME [--frames N] [--time T]
+#                             [--width PIXELS] [--height PIXELS]
+#                             [--output-dir DIR] [--processes N]
+
+import argparse
+import math
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import zlib
+
+# NumPy is optional. Without it, pixels are computed in pure Python.
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+from svg_code import *
+from svg_timeline import *
+import svg_graph_generator
+
+# Color of the canvas under the drawing.
+BACKGROUND = (255, 255, 255)
+# Number of straight segments each curve is drawn with.
+CURVE_SEGMENTS = 16
+# Text is drawn as a box this much of its font size high, and wide per
+# character.
+TEXT_HEIGHT = 0.7
+TEXT_WIDTH = 0.6
+# Presentation params, with their values when nothing sets them.
+DEFAULT_STYLE = {
+  "fill": "black",
+  "stroke": "none",
+  "stroke-width": 1,
+  "font-size": 16,
+  "text-anchor": "start",
+  "visibility": "visible",
+}
+# Size of documents that don't give one, as SVG has it.
+DEFAULT_SIZE = (300, 150)
+COLORS = {
+  "black": (0, 0, 0),
+  "white": (255, 255, 255),
+  "red": (255, 0, 0),
+  "green": (0, 128, 0),
+  "lime": (0, 255, 0),
+  "blue": (0, 0, 255),
+  "yellow": (255, 255, 0),
+  "cyan": (0, 255, 255),
+  "magenta": (255, 0, 255),
+  "gray": (128, 128, 128),
+  "grey": (128, 128, 128),
+  "orange": (255, 165, 0),
+  "purple": (128, 0, 128),
+}
+# A CSS rule of a class, as generated by svg_optimize.hoistToClasses.
+CLASS_RULE = re.compile(r"^\s*\.([\w-]+)\s*\{(.*)\}\s*$")
+
+# Math on single numbers, with the names of NumPy's math on arrays, so that the
+# same drawing code works on both.
+class ScalarOps(object):
+
+  hypot = staticmethod(math.hypot)
+  minimum = staticmethod(min)
+  maximum = staticmethod(max)
+
+  @staticmethod
+  def clip(value, low, high):
+    return min(max(value, low), high)
+
+  @staticmethod
+  def where(condition, a, b):
+    return a if condition else b
+
+ops = ScalarOps if numpy is None else numpy
+
+def parseColor(value):
+  value = str(value).strip()
+  if value == "none":
+    return None
+  if value.startswith("#"):
+    digits = value[1:]
+    if len(digits) == 3:
+      digits = "".join(digit * 2 for digit in digits)
+    assert len(digits) == 6, "{} is not a valid color".format(value)
+    return tuple(int(digits[i:i + 2], 16) for i in range(0, 6, 2))
+  if value.startswith("rgb(") and value.endswith(")"):
+    return tuple(int(part) for part in value[4:-1].split(","))
+  assert value in COLORS, "{} is not a supported color".format(value)
+  return COLORS[value]
+
+# Pixels that shapes are painted onto, covering the document at some scale.
+class Canvas(object):
+
+  def __init__(self, width, height, scale_x, scale_y):
+    self.width = width
+    self.height = height
+    self.scale_x = scale_x
+    self.scale_y = scale_y
+    # Edges are smoothed over about a pixel.
+    self.scale = min(scale_x, scale_y)
+    if numpy is not None:
+      self.pixels = numpy.empty((height, width, 3))
+      self.pixels[:, :] = BACKGROUND
+    else:
+      self.pixels = [[list(BACKGROUND) for _ in range(width)]
+        for _ in range(height)]
+
+  # Blends a color into the pixels whose centers are within the given box (in
+  # the document's units), by how much of each the shape covers. Coverage is a
+  # function of the x and y of pixel centers, given as arrays with NumPy and
+  # one pixel at a time without.
+  def paint(self, box, coverage, color):
+    left, top, right, bottom = box
+    i0 = max(0, int(math.floor(left * self.scale_x)))
+    i1 = min(self.width, int(math.ceil(right * self.scale_x)) + 1)
+    j0 = max(0, int(math.floor(top * self.scale_y)))
+    j1 = min(self.height, int(math.ceil(bottom * self.scale_y)) + 1)
+    if i0 >= i1 or j0 >= j1:
+      return
+    if numpy is not None:
+      xs = (numpy.arange(i0, i1) + 0.5) / self.scale_x
+      ys = (numpy.arange(j0, j1) + 0.5) / self.scale_y
+      xs, ys = numpy.meshgrid(xs, ys)
+      alpha = numpy.clip(coverage(xs, ys), 0, 1)[:, :, numpy.newaxis]
+      region = self.pixels[j0:j1, i0:i1]
+      region += (numpy.array(color, dtype=float) - region) * alpha
+      return
+    for j in range(j0, j1):
+      y = (j + 0.5) / self.scale_y
+      row = self.pixels[j]
+      for i in range(i0, i1):
+        alpha = coverage((i + 0.5) / self.scale_x, y)
+        if alpha > 0:
+          pixel = row[i]
+          for k in range(3):
+            pixel[k] += (color[k] - pixel[k]) * min(alpha, 1)
+
+  # Returns the rows of pixels, each as 8-bit RGB bytes.
+  def getRows(self):
+    if numpy is not None:
+      pixels = numpy.clip(numpy.round(self.pixels), 0, 255).astype(numpy.uint8)
+      return [pixels[j].tobytes() for j in range(self.height)]
+    return [bytes(bytearray(min(255, max(0, int(round(value))))
+      for pixel in row for value in pixel)) for row in self.pixels]
+
+  def toPng(self):
+    raw = b"".join(b"\x00" + row for row in self.getRows())
+    return b"".join([
+      b"\x89PNG\r\n\x1a\n",
+      getPngChunk(b"IHDR",
+        struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)),
+      getPngChunk(b"IDAT", zlib.compress(raw, 9)),
+      getPngChunk(b"IEND", b""),
+    ])
+
+  def writePng(self, filename):
+    with atomicOpen(filename, "wb") as f:
+      f.write(self.toPng())
+
+def getPngChunk(kind, data):
+  return struct.pack(">I", len(data)) + kind + data + \
+    struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+def paintSegment(canvas, x1, y1, x2, y2, width, color):
+  dx = x2 - x1
+  dy = y2 - y1
+  length2 = dx * dx + dy * dy
+  half = width / 2.0
+  scale = canvas.scale
+
+  def coverage(xs, ys):
+    if length2 == 0:
+      distance = ops.hypot(xs - x1, ys - y1)
+    else:
+      t = ops.clip(((xs - x1) * dx + (ys - y1) * dy) / length2, 0, 1)
+      distance = ops.hypot(xs - x1 - t * dx, ys - y1 - t * dy)
+    return (half - distance) * scale + 0.5
+
+  pad = half + 1.0 / scale
+  canvas.paint((min(x1, x2) - pad, min(y1, y2) - pad, max(x1, x2) + pad,
+    max(y1, y2) + pad), coverage, color)
+
+# Fills polygons by the nonzero rule, as SVG does by default.
+def paintPolygons(canvas, polygons, color):
+  edges = []
+  for points in polygons:
+    for k in range(len(points)):
+      edges.append(points[k - 1] + points[k])
+  if not edges:
+    return
+
+  def coverage(xs, ys):
+    winding = 0
+    for x1, y1, x2, y2 in edges:
+      cross = (x2 - x1) * (ys - y1) - (xs - x1) * (y2 - y1)
+      winding = winding + ops.where((y1 <= ys) & (y2 > ys) & (cross > 0), 1, 0)
+      winding = winding - ops.where((y1 > ys) & (y2 <= ys) & (cross < 0), 1, 0)
+    return ops.where(winding != 0, 1.0, 0.0)
+
+  xs = [x for edge in edges for x in (edge[0], edge[2])]
+  ys = [y for edge in edges for y in (edge[1], edge[3])]
+  canvas.paint((min(xs), min(ys), max(xs), max(ys)), coverage, color)
+
+def paintCircle(canvas, cx, cy, r, fill, stroke, width):
+  scale = canvas.scale
+  half = width / 2.0
+  pad = r + half + 1.0 / scale
+  box = (cx - pad, cy - pad, cx + pad, cy + pad)
+  if fill is not None:
+    canvas.paint(box,
+      lambda xs, ys: (r - ops.hypot(xs - cx, ys - cy)) * scale + 0.5, fill)
+  if stroke is not None and width > 0:
+    canvas.paint(box,
+      lambda xs, ys: (half - abs(ops.hypot(xs - cx, ys - cy) - r)) * scale +
+        0.5, stroke)
+
+def paintBox(canvas, left, top, right, bottom, color):
+  scale = canvas.scale
+
+  def coverage(xs, ys):
+    inside = ops.minimum(ops.minimum(xs - left, right - xs),
+      ops.minimum(ys - top, bottom - ys))
+    return inside * scale + 0.5
+
+  canvas.paint((left, top, right, bottom), coverage, color)
+
+# Draws a document (or any part of one) at any point in its animations.
+class Rasterizer(object):
+
+  def __init__(self, root):
+    self.root = root
+    self.timeline = Timeline(root)
+    self.classes = {}
+    svg = None
+    stack = [root]
+    while stack:
+      element = stack.pop()
+      if svg is None and isinstance(element, Svg):
+        svg = element
+      if isinstance(element, Style):
+        for rule in element.rules:
+          match = CLASS_RULE.match(rule)
+          if match is not None:
+            self.classes[match.group(1)] = [tuple(part.split(":", 1))
+              for part in match.group(2).split(";") if ":" in part]
+      if isinstance(element, XmlNode):
+        stack.extend(reversed(element.children))
+    self.svg = svg
+    width, height = DEFAULT_SIZE
+    if svg is not None:
+      width = parseNumber(svg.getParam("width", width))
+      height = parseNumber(svg.getParam("height", height))
+    self.size = (width, height)
+
+  def getDuration(self):
+    return self.timeline.getDuration()
+
+  # Returns the params of an element at time t: its own, overridden by those
+  # of its class, overridden by those its animations are setting.
+  def getParams(self, element, t):
+    params = dict(element.iterParams())
+    for k, v in self.classes.get(params.get("class"), ()):
+      params[k.strip()] = v.strip()
+    params.update(self.timeline.getValues(element, t, params))
+    return params
+
+  # Draws the document at time t onto a new canvas of the given size in pixels.
+  # Without a size, it's drawn a pixel per unit. Given only one dimension, the
+  # other keeps the document's proportions.
+  def frame(self, t=0.0, width=None, height=None):
+    doc_width, doc_height = self.size
+    if width is None and height is None:
+      width, height = doc_width, doc_height
+    elif width is None:
+      width = height * doc_width / float(doc_height)
+    elif height is None:
+      height = width * doc_height / float(doc_width)
+    width = max(1, int(round(width)))
+    height = max(1, int(round(height)))
+    canvas = Canvas(width, height, width / float(doc_width),
+      height / float(doc_height))
+    if self.svg is not None:
+      self.draw(canvas, self.svg, t, DEFAULT_STYLE, 0.0, 0.0)
+    return canvas
+
+  def draw(self, canvas, element, t, style, ox, oy):
+    if isinstance(element, (Defs, Symbol, Style, Animate, AnimateMotion,
+        MPath)):
+      return
+    params = self.getParams(element, t)
+    # animateMotion moves the element, and everything in it, along its path.
+    if MOTION in params:
+      ox += params[MOTION][0]
+      oy += params[MOTION][1]
+    style = dict(style)
+    for k in DEFAULT_STYLE:
+      if k in params:
+        style[k] = params[k]
+    visible = style["visibility"] != "hidden"
+    fill = parseColor(style["fill"])
+    stroke = parseColor(style["stroke"])
+    width = parseNumber(style["stroke-width"])
+    if not visible:
+      pass
+    elif isinstance(element, Circle):
+      paintCircle(canvas, ox + parseNumber(params.get("cx", 0)),
+        oy + parseNumber(params.get("cy", 0)),
+        parseNumber(params.get("r", 0)), fill, stroke, width)
+    elif isinstance(element, Line):
+      if stroke is not None:
+        paintSegment(canvas, ox + parseNumber(params.get("x1", 0)),
+          oy + parseNumber(params.get("y1", 0)),
+          ox + parseNumber(params.get("x2", 0)),
+          oy + parseNumber(params.get("y2", 0)), width, stroke)
+    elif isinstance(element, Path) and "d" in params:
+      path = parsePath(params["d"]).normalized()
+      if ox or oy:
+        path.translate(ox, oy)
+      subpaths = path.flatten(CURVE_SEGMENTS)
+      if fill is not None:
+        paintPolygons(canvas, [points for points, _ in subpaths], fill)
+      if stroke is not None:
+        for points, closed in subpaths:
+          ends = points if closed else points[1:]
+          starts = points[-1:] + points[:-1] if closed else points[:-1]
+          for (x1, y1), (x2, y2) in zip(starts, ends):
+            paintSegment(canvas, x1, y1, x2, y2, width, stroke)
+    elif isinstance(element, Text) and fill is not None:
+      size = parseNumber(style["font-size"])
+      x = ox + parseNumber(params.get("x", 0)) + \
+        parseNumber(params.get("dx", 0))
+      y = oy + parseNumber(params.get("y", 0))
+      text_width = TEXT_WIDTH * size * len(element.text)
+      anchor = style["text-anchor"]
+      if anchor == "middle":
+        x -= text_width / 2.0
+      elif anchor == "end":
+        x -= text_width
+      paintBox(canvas, x, y - TEXT_HEIGHT * size, x + text_width, y, fill)
+    elif isinstance(element, Use):
+      href = params.get("xlink:href", params.get("href", ""))
+      target = self.timeline.by_id.get(str(href).lstrip("#"))
+      x = ox + parseNumber(params.get("x", 0))
+      y = oy + parseNumber(params.get("y", 0))
+      if isinstance(target, Symbol):
+        # Symbols are skipped where they're defined, and only drawn (as their
+        # children) where they're used.
+        for child in target.children:
+          self.draw(canvas, child, t, style, x, y)
+      elif target is not None:
+        self.draw(canvas, target, t, style, x, y)
+    if isinstance(element, XmlNode):
+      for child in element.children:
+        self.draw(canvas, child, t, style, ox, oy)
+
+# Draws a document at time t into a PNG file.
+def renderPng(root, filename, t=0.0, width=None, height=None):
+  Rasterizer(root).frame(t, width, height).writePng(filename)
+  return filename
+
+# The rasterizer that a pool's workers draw frames with. They inherit it when
+# forked, rather than having it sent to each of them.
+worker_rasterizer = None
+
+def initWorker(rasterizer):
+  global worker_rasterizer
+  worker_rasterizer = rasterizer
+
+def renderFrameArgs(args):
+  t, filename, width, height = args
+  worker_rasterizer.frame(t, width, height).writePng(filename)
+  return filename
+
+# Draws frames sampled evenly across the whole animation (from its start to the
+# end of its last animation), in parallel, into frame_<n>.png files in the given
+# directory. Returns the names of the files, in order.
+def renderFrames(root, directory="", frames=10, width=None, height=None,
+    processes=None):
+  assert frames > 0, "At least one frame must be rendered"
+  if directory and not os.path.isdir(directory):
+    os.makedirs(directory)
+  rasterizer = Rasterizer(root)
+  duration = rasterizer.getDuration()
+  jobs = []
+  for i in range(frames):
+    t = duration * i / float(max(frames - 1, 1))
+    filename = os.path.join(directory, "frame_{:04d}.png".format(i))
+    jobs.append((t, filename, width, height))
+  pool = multiprocessing.Pool(processes, initWorker, (rasterizer,))
+  try:
+    return pool.map(renderFrameArgs, jobs)
+  finally:
+    pool.close()
+    pool.join()
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description="Draws frames of a displacing ring graph as PNGs.")
+  parser.add_argument("vertices", type=int)
+  parser.add_argument("coprime", type=int)
+  parser.add_argument("--frames", type=int, default=10,
+    help="Number of frames to sample across the animation.")
+  parser.add_argument("--time", type=float, default=None,
+    help="Draw a single frame at this time, in seconds, instead.")
+  parser.add_argument("--width", type=int, default=None,
+    help="Width of the frames, in pixels.")
+  parser.add_argument("--height", type=int, default=None,
+    help="Height of the frames, in pixels.")
+  parser.add_argument("--output-dir", default="",
+    help="Directory to write the frames to.")
+  parser.add_argument("--processes", type=int, default=None,
+    help="Number of worker processes. Defaults to the number of cores.")
+  args = parser.parse_args(argv)
+
+  graph = svg_graph_generator.generateDisplacingRingGraph(
+    "ring", args.vertices, args.coprime)
+  svg = graph.getSVG()
+  if args.time is not None:
+    filename = os.path.join(args.output_dir, "frame.png")
+    print("Wrote to {}".format(
+      renderPng(svg, filename, args.time, args.width, args.height)))
+    return 0
+  for filename in renderFrames(svg, args.output_dir, args.frames, args.width,
+      args.height, args.processes):
+    print("Wrote to {}".format(filename))
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,345 @@
+# A timeline of a document's animations, for working out what it looks like at
+# any time without a browser: to validate it, draw frames of it, or find out
+# how long it runs.
+#
+# Building the timeline resolves when every <animate> and <animateMotion>
+# begins and ends, following the chains of begin="<id>.end" references, and
+# indexes them by the element and attribute they animate. Values at any time t
+# are then found by binary search, rather than by replaying the animations.
+
+import bisect
+import math
+import re
+
+from svg_code import *
+
+# A reference to the start or end of another animation, or a clock value, or
+# both, as found in begin params.
+BEGIN_VALUE = re.compile(
+  r"^\s*(?:([A-Za-z_][\w:-]*)\.(begin|end))?\s*(?:([-+])?\s*([\d.]+(?:ms|s)?))?"
+  r"\s*$")
+# The attribute that animateMotion animates: the offset of its element.
+MOTION = "motion"
+# Number of straight segments curves in motion paths are measured with.
+MOTION_CURVE_SEGMENTS = 16
+
+# Numeric params can be numbers, or strings of them (possibly in pixels).
+def parseNumber(value):
+  if isinstance(value, (int, float)):
+    return value
+  value = str(value).strip()
+  if value.endswith("px"):
+    value = value[:-2]
+  return float(value)
+
+# Returns a duration in seconds, None if it's indefinite.
+def parseClock(value):
+  value = str(value).strip()
+  if value == "indefinite":
+    return None
+  if value.endswith("ms"):
+    return float(value[:-2]) / 1000
+  if value.endswith("s"):
+    return float(value[:-1])
+  return float(value)
+
+def parsePath(value):
+  if isinstance(value, PathData):
+    return value
+  return PathData().parse(str(value))
+
+# Lists of values (values, keyTimes) can be given as sequences, or as strings
+# separated by semicolons.
+def parseList(value):
+  if isinstance(value, (list, tuple)):
+    return list(value)
+  return [part.strip() for part in str(value).split(";") if part.strip()]
+
+# Returns the value a fraction of the way from start to end.
+def interpolate(start, end, fraction):
+  if isinstance(start, PathData) or isinstance(end, PathData):
+    start = parsePath(start)
+    end = parsePath(end)
+    # Paths can only be interpolated between if they have the same commands.
+    if start.commands != end.commands:
+      return start if fraction < 0.5 else end
+    result = PathData(start.shortest)
+    result.commands.extend(start.commands)
+    result.coords.extend(a + (b - a) * fraction
+      for a, b in zip(start.coords, end.coords))
+    return result
+  try:
+    start = parseNumber(start)
+    end = parseNumber(end)
+  except ValueError:
+    return start if fraction < 0.5 else end
+  return start + (end - start) * fraction
+
+# A polyline measured along its length, for finding points a fraction of the
+# way along it.
+class MotionPath(object):
+
+  def __init__(self, path):
+    self.points = []
+    self.lengths = []
+    length = 0.0
+    for points, closed in parsePath(path).flatten(MOTION_CURVE_SEGMENTS):
+      if closed:
+        points = points + points[:1]
+      for point in points:
+        if self.points:
+          last = self.points[-1]
+          length += math.hypot(point[0] - last[0], point[1] - last[1])
+        self.points.append(point)
+        self.lengths.append(length)
+
+  def getPoint(self, fraction):
+    if not self.points:
+      return (0.0, 0.0)
+    distance = fraction * self.lengths[-1]
+    idx = bisect.bisect_left(self.lengths, distance)
+    if idx == 0:
+      return self.points[0]
+    if idx == len(self.points):
+      return self.points[-1]
+    (x1, y1), (x2, y2) = self.points[idx - 1], self.points[idx]
+    span = self.lengths[idx] - self.lengths[idx - 1]
+    s = 0.0 if span == 0 else (distance - self.lengths[idx - 1]) / span
+    return (x1 + (x2 - x1) * s, y1 + (y2 - y1) * s)
+
+# When an animation runs, and what it sets its attribute to while it does.
+class Interval(object):
+
+  __slots__ = ("animation", "begin", "end", "dur", "freeze", "order",
+    "values", "key_times", "motion")
+
+  def __init__(self, animation, begin, dur, order, motion=None):
+    self.animation = animation
+    self.begin = begin
+    self.dur = dur
+    repeat = animation.getParam("repeatCount")
+    if dur is None or repeat == "indefinite":
+      self.end = None
+    else:
+      self.end = begin + dur * (1 if repeat is None else parseNumber(repeat))
+    self.freeze = animation.getParam("fill") == "freeze"
+    # Position in the document, which breaks ties between animations that
+    # begin together.
+    self.order = order
+    values = animation.getParam("values")
+    self.values = None if values is None else parseList(values)
+    key_times = animation.getParam("keyTimes")
+    self.key_times = None if key_times is None else \
+      [float(key_time) for key_time in parseList(key_times)]
+    self.motion = motion
+
+  # Returns how far through its duration the animation is at time t, or None
+  # if it's not setting its attribute then.
+  def getFraction(self, t):
+    if t < self.begin:
+      return None
+    if self.end is not None and t >= self.end:
+      if not self.freeze:
+        return None
+      if self.dur == 0:
+        return 1.0
+      # Frozen part way through a repeat, or at the very end of the last one.
+      fraction = ((self.end - self.begin) / self.dur) % 1
+      return fraction or 1.0
+    if not self.dur:
+      return 0.0
+    return ((t - self.begin) / self.dur) % 1
+
+  # Returns the value the animation gives its attribute at time t, given the
+  # attribute's value without it, or None if it's not animating it then.
+  def getValue(self, t, base=None):
+    fraction = self.getFraction(t)
+    if fraction is None:
+      return None
+    if self.motion is not None:
+      return self.motion.getPoint(fraction)
+    if self.values:
+      values = self.values
+      if len(values) == 1:
+        return values[0]
+      key_times = self.key_times
+      if key_times is None or len(key_times) != len(values):
+        key_times = [i / float(len(values) - 1) for i in range(len(values))]
+      idx = bisect.bisect_right(key_times, fraction) - 1
+      idx = min(max(idx, 0), len(values) - 2)
+      span = key_times[idx + 1] - key_times[idx]
+      s = 1.0 if span <= 0 else (fraction - key_times[idx]) / span
+      return interpolate(values[idx], values[idx + 1], min(max(s, 0.0), 1.0))
+    start = self.animation.getParam("from", base)
+    end = self.animation.getParam("to")
+    if start is None:
+      return end
+    return interpolate(start, end, fraction)
+
+# The animations of one attribute of one element, in the order they begin.
+class Track(object):
+
+  __slots__ = ("begins", "intervals")
+
+  def __init__(self, intervals):
+    self.intervals = sorted(intervals,
+      key=lambda interval: (interval.begin, interval.order))
+    self.begins = [interval.begin for interval in self.intervals]
+
+  # Of the animations that have begun by time t, the one that began last takes
+  # precedence, unless it has ended without freezing (in which case the one
+  # before it does, and so on).
+  def getValue(self, t, base=None):
+    idx = bisect.bisect_right(self.begins, t) - 1
+    while idx >= 0:
+      value = self.intervals[idx].getValue(t, base)
+      if value is not None:
+        return value
+      idx -= 1
+    return None
+
+class Timeline(object):
+
+  def __init__(self, root):
+    self.by_id = {}
+    self.elements = {}
+    # Every animation, with the element it animates.
+    animations = []
+    stack = [root]
+    while stack:
+      element = stack.pop()
+      element_id = element.getParam("id")
+      if element_id is not None:
+        self.by_id[element_id] = element
+      if isinstance(element, XmlNode):
+        for child in element.children:
+          if isinstance(child, (Animate, AnimateMotion)):
+            animations.append((child, element))
+        stack.extend(reversed(element.children))
+    self.intervals = {}
+    # Animations that never begin: ones waiting on animations that don't
+    # exist, or (in a cycle) on themselves.
+    self.unresolved = []
+    times = self.schedule([animation for animation, _ in animations])
+    tracks = {}
+    for order, (animation, element) in enumerate(animations):
+      begin, dur = times[id(animation)]
+      if begin is None:
+        self.unresolved.append(animation)
+        continue
+      if isinstance(animation, AnimateMotion):
+        attribute = MOTION
+        interval = Interval(animation, begin, dur, order,
+          MotionPath(self.getMotionPath(animation)))
+      else:
+        attribute = animation.getParam("attributeName")
+        interval = Interval(animation, begin, dur, order)
+      self.intervals[id(animation)] = interval
+      self.elements[id(element)] = element
+      tracks.setdefault(id(element), {}).setdefault(attribute, []) \
+        .append(interval)
+    self.tracks = {}
+    for key, attributes in tracks.items():
+      self.tracks[key] = dict((attribute, Track(intervals))
+        for attribute, intervals in attributes.items())
+
+  # Returns the path an animateMotion follows: its own, or that of the <path>
+  # its <mpath> links to.
+  def getMotionPath(self, animation):
+    for child in animation.children:
+      if isinstance(child, MPath):
+        target = self.by_id.get(str(child.getParam("xlink:href", "")) \
+          .lstrip("#"))
+        if target is not None:
+          return target.getParam("d", "")
+    return animation.getParam("path", "")
+
+  # Works out when each animation begins, in seconds, and how long it runs for,
+  # by id() of the animation. Chains can be long, so this isn't recursive:
+  # each animation waits on the stack until the ones it depends on have been
+  # scheduled. Animations that never begin have a begin of None.
+  def schedule(self, animations):
+    times = {}
+    ends = {}
+    for animation in animations:
+      stack = [animation]
+      visiting = set()
+      while stack:
+        current = stack[-1]
+        if id(current) in times:
+          stack.pop()
+          continue
+        waiting = []
+        begins = []
+        for begin_value in str(current.getParam("begin", "0s")).split(";"):
+          match = BEGIN_VALUE.match(begin_value)
+          if match is None:
+            continue
+          ref, event, sign, offset = match.groups()
+          offset = 0.0 if offset is None else parseClock(offset)
+          if sign == "-":
+            offset = -offset
+          if ref is None:
+            begins.append(offset)
+            continue
+          other = self.by_id.get(ref)
+          if other is None or id(other) in visiting:
+            continue
+          if id(other) not in times:
+            waiting.append(other)
+            continue
+          other_begin = times[id(other)][0]
+          other_end = ends[id(other)]
+          if event == "begin" and other_begin is not None:
+            begins.append(other_begin + offset)
+          elif event == "end" and other_end is not None:
+            begins.append(other_end + offset)
+        if waiting:
+          visiting.add(id(current))
+          stack.extend(waiting)
+          continue
+        stack.pop()
+        visiting.discard(id(current))
+        dur = current.getParam("dur")
+        dur = None if dur is None else parseClock(dur)
+        begin = min(begins) if begins else None
+        times[id(current)] = (begin, dur)
+        repeat = current.getParam("repeatCount")
+        if begin is None or dur is None or repeat == "indefinite":
+          ends[id(current)] = None
+        else:
+          ends[id(current)] = begin + dur * \
+            (1 if repeat is None else parseNumber(repeat))
+    return times
+
+  # Returns when an animation begins and ends (None if it never does).
+  def getTimes(self, animation):
+    interval = self.intervals.get(id(animation))
+    if interval is None:
+      return None
+    return interval.begin, interval.end
+
+  # Returns when the last of the animations that end does so.
+  def getDuration(self):
+    ends = [interval.end for interval in self.intervals.values()
+      if interval.end is not None]
+    return max(ends) if ends else 0.0
+
+  # Returns the values that animations give an element's attributes at time t,
+  # by attribute. Attributes without a value of their own take it from the
+  # element's params. An animateMotion's offset is under MOTION.
+  def getValues(self, element, t, params=None):
+    values = {}
+    for attribute, track in self.tracks.get(id(element), {}).items():
+      base = element.getParam(attribute) if params is None else \
+        params.get(attribute)
+      value = track.getValue(t, base)
+      if value is not None:
+        values[attribute] = value
+    return values
+
+  # Yields every animated element, with the values of its animated attributes
+  # at time t.
+  def iterValues(self, t):
+    for key, element in self.elements.items():
+      yield element, self.getValues(element, t)
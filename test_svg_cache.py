@@ -0,0 +1,95 @@
+# Tests for svg_cache. Run with: python -m pytest (or python -m unittest).
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import svg_cache
+import svg_graph_generator
+
+class RenderCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.directory, "cache")
+    self.seconds_per_move = svg_graph_generator.SECONDS_PER_MOVE
+
+  def tearDown(self):
+    svg_graph_generator.SECONDS_PER_MOVE = self.seconds_per_move
+    shutil.rmtree(self.directory)
+
+  # Writes a file of the given size to store in the cache.
+  def writeFile(self, name, size):
+    filename = os.path.join(self.directory, name)
+    with open(filename, "wb") as f:
+      f.write(b"x" * size)
+    return filename
+
+  def render(self, cache, name="ring"):
+    return svg_cache.renderGraphCached(cache, name, 5, 2,
+      directory=self.directory)
+
+  def read(self, filename):
+    with open(filename, "rb") as f:
+      return f.read()
+
+  def testHitAfterStore(self):
+    cache = svg_cache.RenderCache(self.cache_dir)
+    filename, cached = self.render(cache)
+    self.assertFalse(cached)
+    rendered = self.read(filename)
+    os.remove(filename)
+    # Graphs that only differ in name share an entry.
+    filename, cached = self.render(cache, "other")
+    self.assertTrue(cached)
+    self.assertEqual(self.read(filename), rendered)
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+  def testMissWhenSettingsChange(self):
+    cache = svg_cache.RenderCache(self.cache_dir)
+    key = cache.getKey({"vertices": 5})
+    self.assertEqual(cache.getKey({"vertices": 5}), key)
+    self.render(cache)
+    svg_graph_generator.SECONDS_PER_MOVE *= 2
+    self.assertNotEqual(cache.getKey({"vertices": 5}), key)
+    _, cached = self.render(cache)
+    self.assertFalse(cached)
+    self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+  def testEvictsLeastRecentlyUsed(self):
+    cache = svg_cache.RenderCache(self.cache_dir, 250)
+    # Entries are given times in order, so that eviction doesn't depend on how
+    # fine the file system's times are.
+    for i, key in enumerate(["a", "b", "c"]):
+      cache.store(key, "svg", self.writeFile(key, 100))
+      if cache.has(key, "svg"):
+        os.utime(cache.getPath(key, "svg"), (1000 * (i + 1),) * 2)
+    self.assertFalse(cache.has("a", "svg"))
+    self.assertEqual(cache.evictions, 1)
+    # Using an entry makes it the most recent.
+    self.assertTrue(cache.fetch("b", "svg", os.path.join(self.directory, "b")))
+    cache.store("d", "svg", self.writeFile("d", 100))
+    self.assertEqual([cache.has(key, "svg") for key in "bcd"],
+      [True, False, True])
+    self.assertEqual(cache.getStats()["bytes"], 200)
+    # Files larger than the whole cache are never stored.
+    cache.store("e", "svg", self.writeFile("e", 300))
+    self.assertFalse(cache.has("e", "svg"))
+
+  def testFetchLinks(self):
+    cache = svg_cache.RenderCache(self.cache_dir)
+    cache.store("a", "svg", self.writeFile("a", 10))
+    filename = os.path.join(self.directory, "out.svg")
+    for _ in range(2):
+      # Fetching again over the same link leaves nothing behind.
+      self.assertTrue(cache.fetch("a", "svg", filename))
+      self.assertEqual(self.read(filename), b"x" * 10)
+      self.assertEqual(sorted(os.listdir(self.directory)),
+        ["a", "cache", "out.svg"])
+    if hasattr(os, "link"):
+      self.assertTrue(os.path.samefile(filename, cache.getPath("a", "svg")))
+    self.assertFalse(cache.fetch("b", "svg", filename))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,126 @@
+# Tests for svg_code. Run with: python -m pytest (or python -m unittest).
+
+import unittest
+
+from svg_code import *
+
+class FormatNumberTest(unittest.TestCase):
+
+  def testShortest(self):
+    self.assertEqual(formatNumber(1.5), "1.5")
+    self.assertEqual(formatNumber(2.0), "2")
+    self.assertEqual(formatNumber(3), "3")
+    self.assertEqual(formatNumber(1234.0), "1234")
+
+  def testPrecision(self):
+    self.assertEqual(formatNumber(1.23456, 2), "1.23")
+    self.assertEqual(formatNumber(1.5, 0), "2")
+    self.assertEqual(formatNumber(2.001, 2), "2")
+    self.assertEqual(formatNumber(-0.001, 2), "0")
+
+  def testExponent(self):
+    self.assertEqual(formatNumber(1e22), "1e22")
+    self.assertEqual(formatNumber(1e22, 2), "1e22")
+    self.assertEqual(formatNumber(-5000.0), "-5e3")
+    self.assertEqual(formatNumber(1.25e20), "1.25e20")
+    self.assertEqual(formatNumber(100.0), "100")
+    self.assertEqual(formatNumber(1000.0, exponent=False), "1000")
+
+class RenderTest(unittest.TestCase):
+
+  def testHtmlTakesPrefix(self):
+    # Html renders like any other node, given the same arguments.
+    html = Html().child(Body().child(Svg().size(10.25, 10)))
+    self.assertEqual(html.render("", True, 1),
+      '<!DOCTYPE html><html><body><svg width="10.2" height="10"/></body>'
+      '</html>')
+    self.assertEqual(html.render(compact=True), html.render("", True))
+    self.assertTrue(html.render().startswith("<!DOCTYPE html>\n\n<html>\n"))
+
+  def testCachedRenderingsFollowChanges(self):
+    # Changes anywhere below a cached element drop its rendering, even through
+    # elements that don't cache, and caches turned on later.
+    circle = Circle().radius(1)
+    inner = G().child(circle).cacheRender()
+    root = Svg().child(G().child(inner)).cacheRender()
+    root.render("", True)
+    circle.radius(2)
+    self.assertTrue('r="2"' in root.render("", True))
+    leaf = Circle()
+    inner.child(G().child(leaf))
+    root.render("", True)
+    leaf.cacheRender()
+    leaf.radius(3)
+    self.assertTrue('r="3"' in root.render("", True))
+
+class PathDataTest(unittest.TestCase):
+
+  def testParseRoundTrips(self):
+    text = "M10 20 30 40H50V60C1 2 3 4 5 6S7 8 9 10Q1 2 3 4T5 6Z"
+    path = PathData(shortest=False).parse(text)
+    self.assertEqual(len(path), 9)
+    self.assertEqual(str(path), text)
+    self.assertEqual(str(PathData(shortest=False).parse(str(path))), text)
+
+  def testParseImplicitLines(self):
+    path = PathData(shortest=False).parse("m1,2 3,4 -5-6")
+    self.assertEqual([chr(code) for code in path.commands], ["m", "l", "l"])
+    self.assertEqual(list(path.coords), [1, 2, 3, 4, -5, -6])
+
+  def testParseRejectsBadData(self):
+    for text in ["M1", "M1 2 3", "1 2", "M1 2A1 1 0 0 1 2 2", "Z3"]:
+      self.assertRaises(ValueError, PathData().parse, text)
+
+  def testBuildersMatchParse(self):
+    path = PathData().extend(move(1, 2), delta_line(3, 4), close())
+    self.assertEqual(str(path), str(PathData().parse("M1 2l3 4Z")))
+
+  def testShortestForm(self):
+    # Each segment is written in whichever form is shorter, and repeated
+    # command letters (or lines after a move) are dropped.
+    path = PathData().extend(move(100, 100), line(101, 101), line(102, 102))
+    self.assertEqual(str(path), "M100 100l1 1 1 1")
+    self.assertEqual(str(PathData(shortest=False).extend(path)),
+      "M100 100 101 101 102 102")
+
+  def testPrecisionDoesNotAccumulate(self):
+    path = PathData(shortest=False).command("M", 0, 0)
+    for _ in range(10):
+      path.command("l", 0.14, 0)
+    # Each step is taken from where the rounded steps before it have reached,
+    # so the path still ends at 1.4.
+    self.assertEqual(path.serialize(1),
+      "M0 0l0.1 0 0.2 0 0.1 0 0.2 0 0.1 0 0.1 0 0.2 0 0.1 0 0.2 0 0.1 0")
+    self.assertTrue(path.normalized().serialize(1).endswith(" 1.4 0"))
+
+  def testTranslate(self):
+    path = PathData(shortest=False).parse("M1 2h3v4l5 6Z")
+    self.assertEqual(str(path.translate(10, 20)), "M11 22h3v4l5 6Z")
+    path = PathData(shortest=False).parse("M1 2H3V4")
+    self.assertEqual(str(path.translate(10, 20)), "M11 22H13V24")
+
+  def testTranslateLeadingRelativeMove(self):
+    # A leading m is absolute, so it moves; the lines relative to it don't.
+    path = PathData(shortest=False).parse("m1 2 3 4zm5 6")
+    self.assertEqual(str(path.translate(10, 20)), "m11 22 3 4Zm5 6")
+    self.assertEqual(path.normalized().flatten()[0][0][0], (11, 22))
+
+  def testScale(self):
+    path = PathData(shortest=False).parse("M1 2h3v4")
+    self.assertEqual(str(path.scale(2, 3)), "M2 6h6v12")
+
+  def testNormalized(self):
+    path = PathData().parse("m1 1h2v2s1 1 2 2t3 3z")
+    self.assertEqual(str(path.normalized()),
+      "M1 1 3 1 3 3C3 3 4 4 5 5Q5 5 8 8Z")
+
+  def testFlatten(self):
+    path = PathData().parse("M0 0L10 0L10 10ZM20 20Q30 20 30 30")
+    subpaths = path.flatten(2)
+    self.assertEqual(subpaths[0], ([(0, 0), (10, 0), (10, 10)], True))
+    points, closed = subpaths[1]
+    self.assertFalse(closed)
+    self.assertEqual(points, [(20, 20), (27.5, 22.5), (30, 30)])
+
+if __name__ == "__main__":
+  unittest.main()
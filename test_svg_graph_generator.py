@@ -0,0 +1,208 @@
+# Tests for svg_graph_generator. Run with: python -m pytest (or python -m
+# unittest).
+
+import unittest
+
+import svg_graph_generator
+from svg_timeline import Timeline
+
+# Graphs of each family, small enough to render quickly.
+def getGraphs():
+  return [
+    svg_graph_generator.generateDisplacingRingGraph("ring", 8, 3),
+    svg_graph_generator.generateDisplacingGridGraph("grid", 3, 4),
+    svg_graph_generator.generateRandomGraph("random", 12, 20, 30, seed=1),
+  ]
+
+def renderText(svg, compact=False):
+  return "".join(svg.iterRender("", compact))
+
+class StreamedSVGTest(unittest.TestCase):
+
+  SETTINGS = ["EDGE_STYLE", "KEYFRAMES"]
+
+  def setUp(self):
+    self.saved = dict((name, getattr(svg_graph_generator, name))
+      for name in self.SETTINGS)
+
+  def tearDown(self):
+    for name, value in self.saved.items():
+      setattr(svg_graph_generator, name, value)
+
+  def assertStreamedMatches(self):
+    for graph in getGraphs():
+      for compact in [False, True]:
+        self.assertEqual(renderText(graph.getStreamedSVG(), compact),
+          renderText(graph.getSVG(), compact))
+
+  def testLines(self):
+    self.assertStreamedMatches()
+
+  def testPaths(self):
+    svg_graph_generator.EDGE_STYLE = "path"
+    self.assertStreamedMatches()
+
+  def testKeyframes(self):
+    svg_graph_generator.KEYFRAMES = True
+    self.assertStreamedMatches()
+    svg_graph_generator.EDGE_STYLE = "path"
+    self.assertStreamedMatches()
+
+  def testStreamsAgain(self):
+    graph = getGraphs()[0]
+    svg = graph.getStreamedSVG()
+    self.assertEqual(renderText(svg), renderText(svg))
+
+  def testAfterChanges(self):
+    # Moves added after a render are picked up by both.
+    graph = getGraphs()[0]
+    graph.getSVG()
+    node = graph.nodes[0]
+    node.addPosition(1.0, 0.5, graph.last_moves[graph.nodes[1].idx])
+    self.assertEqual(renderText(graph.getStreamedSVG()),
+      renderText(graph.getSVG()))
+
+# Returns when each node of a graph's SVG starts and stops moving, by name, as
+# the timeline plays it.
+def getMoveTimes(graph, svg):
+  timeline = Timeline(svg)
+  times = {}
+  for node in graph.nodes:
+    animations = [child for child in timeline.by_id[node.name].children
+      if child.getParam("attributeName") == "cx"]
+    if not svg_graph_generator.KEYFRAMES:
+      node_times = [0.0]
+      for animation in animations:
+        begin, end = timeline.getTimes(animation)
+        if begin > node_times[-1]:
+          node_times.append(begin)
+        node_times.append(end)
+    elif animations:
+      dur = timeline.getTimes(animations[0])[1]
+      node_times = [float(key_time) * dur
+        for key_time in animations[0].getParam("keyTimes").split(";")]
+    else:
+      node_times = [0.0]
+    times[node.name] = node_times
+  return times
+
+class MoveScheduleTest(unittest.TestCase):
+
+  RINGS = [(2, 1), (5, 2), (8, 3), (9, 7), (12, 5)]
+  SLICES = [slice(None), slice(3), slice(2, 11), slice(-4, None),
+    slice(1, None, 3), slice(None, None, -1), slice(10, 2, -2),
+    slice(5, 5), slice(100, 200), slice(-100, 4)]
+
+  # The schedule as a list, as it was before MoveSchedule.
+  def getExpected(self, vertices, coprime):
+    return svg_graph_generator.generateMoveSequence(vertices, coprime) * \
+      svg_graph_generator.numMoveRepetitions(vertices, coprime)
+
+  def testSteps(self):
+    for vertices, coprime in self.RINGS:
+      schedule = svg_graph_generator.MoveSchedule(vertices, coprime)
+      expected = self.getExpected(vertices, coprime)
+      self.assertEqual(len(schedule), len(expected))
+      self.assertEqual(list(schedule), expected)
+      for idx in range(-len(expected), len(expected)):
+        self.assertEqual(schedule[idx], expected[idx])
+      self.assertRaises(IndexError, schedule.__getitem__, len(expected))
+      self.assertRaises(IndexError, schedule.__getitem__, -len(expected) - 1)
+
+  def testSlices(self):
+    for vertices, coprime in self.RINGS:
+      schedule = svg_graph_generator.MoveSchedule(vertices, coprime)
+      expected = self.getExpected(vertices, coprime)
+      for key in self.SLICES:
+        part = schedule[key]
+        self.assertEqual(len(part), len(expected[key]))
+        self.assertEqual(list(part), expected[key])
+        # Slices of slices index into what they were sliced from.
+        for inner in self.SLICES:
+          self.assertEqual(list(part[inner]), expected[key][inner])
+
+  def testRejectsNonCoprimes(self):
+    self.assertRaises(AssertionError, svg_graph_generator.MoveSchedule, 8, 2)
+    self.assertRaises(AssertionError, svg_graph_generator.MoveSchedule, 1, 1)
+
+class KeyframesTest(unittest.TestCase):
+
+  SETTINGS = ["KEYFRAMES", "KEY_TIME_PRECISION"]
+
+  def setUp(self):
+    self.saved = dict((name, getattr(svg_graph_generator, name))
+      for name in self.SETTINGS)
+
+  def tearDown(self):
+    for name, value in self.saved.items():
+      setattr(svg_graph_generator, name, value)
+
+  def testLargeRingTiming(self):
+    # Key times of a long animation get the places they need to keep moves
+    # apart, however few the minimum is, so nodes move when the chained
+    # animations would have moved them.
+    svg_graph_generator.KEY_TIME_PRECISION = 1
+    graph = svg_graph_generator.generateDisplacingRingGraph("ring", 3000,
+      1499, 2000)
+    chained = getMoveTimes(graph, graph.getSVG())
+    svg_graph_generator.KEYFRAMES = True
+    graph.invalidate()
+    keyframed = getMoveTimes(graph, graph.getSVG())
+    tolerance = svg_graph_generator.SECONDS_PER_MOVE / 10
+    for name, times in chained.items():
+      self.assertEqual(len(keyframed[name]), len(times))
+      for expected, actual in zip(times, keyframed[name]):
+        self.assertAlmostEqual(actual, expected, delta=tolerance)
+
+class NodeTest(unittest.TestCase):
+
+  def testIndexesWhenNeeded(self):
+    # A freshly generated graph, or one that has just changed, isn't indexed
+    # yet, but its nodes' moves, edges and positions can be asked for anyway.
+    for graph in getGraphs():
+      node = graph.nodes[1]
+      moves = [m.idx for m in node.moves]
+      self.assertEqual(len(node.positions), len(moves) + 1)
+      self.assertTrue(len(node.edges) > 0)
+      move = node.addPosition(1.0, 0.5, graph.last_moves[node.idx])
+      self.assertEqual([m.idx for m in node.moves], moves + [move])
+      self.assertEqual(node.positions[-1], (1.0, 0.5))
+
+class InvalidateTest(unittest.TestCase):
+
+  def testNodeSVGBuiltOnItsOwn(self):
+    # A node's SVG is dropped when it moves, even if the graph's was never
+    # built.
+    graph = getGraphs()[0]
+    graph.prepare()
+    node = graph.nodes[0]
+    edge, _ = node.edges[0]
+    before = renderText(node.getSVG())
+    edge.getSVG()
+    node.addPosition(1.0, 0.5, graph.last_moves[node.idx])
+    graph.prepare()
+    self.assertTrue(node.svg is None)
+    self.assertTrue(edge.svg is None)
+    self.assertNotEqual(renderText(node.getSVG()), before)
+    self.assertEqual(renderText(node.getSVG()),
+      renderText(node.buildSVG()))
+
+class ShardedSVGTest(unittest.TestCase):
+
+  def testMatchesStreamed(self):
+    for graph in getGraphs():
+      for processes in [1, 3]:
+        self.assertEqual(renderText(graph.getShardedSVG(processes), True),
+          renderText(graph.getStreamedSVG(), True))
+
+  def testShardRanges(self):
+    graph = getGraphs()[0]
+    ranges = graph.getShardRanges(4)
+    self.assertEqual(len(ranges), 4)
+    self.assertEqual(ranges[0][0], 0)
+    self.assertEqual(ranges[-1][1], len(graph.edges) + len(graph.nodes))
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+      self.assertEqual(end, start)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,106 @@
+# Tests for svg_load. Run with: python -m pytest (or python -m unittest).
+
+import io
+import unittest
+
+from svg_code import *
+from svg_load import *
+
+# Builds a document using most of the elements, as the generators would.
+def buildDocument():
+  circle = Circle().id("node").center(1.25, 2.5).radius(5) \
+    .param("fill", "red")
+  circle.child(Animate().id("move").param("attributeName", "cx")
+    .param("begin", "0s").param("dur", "0.5s").do(1.25, 3.125))
+  circle.child(Animate().param("attributeName", "cy")
+    .param("begin", "move.end").param("dur", "2s")
+    .keyframes([2.5, 4.0, 1.0 / 3], [0, 0.5, 1], 6))
+  path = Path().param("d", PathData().extend(move(0, 0), line(10.5, 1.0 / 3)))
+  motion = AnimateMotion().param("dur", "1s") \
+    .param("path", PathData().extend(move(0, 0), line(5, 5)))
+  symbol = Symbol().id("s").child(Circle().center(0, 0).radius(1))
+  return Svg().size(40, 40).child(
+    Style().rule(".a", [("fill", "blue")]),
+    Defs().child(symbol),
+    G().param("font-size", 12).child(Text("Hello").corner(1, 2)),
+    circle,
+    path,
+    Use().param("xlink:href", "#s").param("x", 3),
+    Circle().center(0, 0).child(motion.child(MPath()
+      .param("xlink:href", "#p"))))
+
+def renderBytes(root, compact=False, precision=None):
+  sink = io.BytesIO()
+  root.write(sink, "", "utf-8", compact, precision)
+  return sink.getvalue()
+
+# Returns everything about a tree that renders, without depending on the order
+# of params.
+def getShape(element, precision=None):
+  params = sorted((k, str(formatValue(v, precision)))
+    for k, v in element.iterParams())
+  text = getattr(element, "text", None)
+  rules = getattr(element, "rules", None)
+  children = [getShape(child, precision)
+    for child in getattr(element, "children", [])]
+  return (element.tag, params, text, rules, children)
+
+class LoadTest(unittest.TestCase):
+
+  def testRoundTrip(self):
+    root = buildDocument()
+    for compact in [False, True]:
+      loader = SvgLoader(strict=True)
+      loaded = loader.load(io.BytesIO(renderBytes(root, compact)))
+      self.assertEqual(getShape(loaded), getShape(root))
+      self.assertEqual(loader.elements, 15)
+
+  def testRoundTripStandalone(self):
+    # Standalone files declare their namespaces and usually a viewBox, which
+    # are kept rather than dropped.
+    root = buildDocument().param("xmlns", "http://www.w3.org/2000/svg") \
+      .param("xmlns:xlink", "http://www.w3.org/1999/xlink") \
+      .param("viewBox", "0 0 40 40")
+    loaded = SvgLoader(strict=True).load(io.BytesIO(renderBytes(root)))
+    self.assertEqual(getShape(loaded), getShape(root))
+    self.assertEqual(loaded.getParam("viewBox"), "0 0 40 40")
+
+  def testRoundTripWithPrecision(self):
+    # Loaded numbers, path data and lists of values all render with the
+    # precision, as they would in the tree they were rendered from.
+    root = buildDocument()
+    loaded = loadSvg(io.BytesIO(renderBytes(root)))
+    self.assertEqual(getShape(loaded, 1), getShape(root, 1))
+    reloaded = loadSvg(io.BytesIO(renderBytes(loaded, True, 1)))
+    self.assertEqual(getShape(reloaded), getShape(loaded, 1))
+
+  def testValues(self):
+    self.assertEqual(parseValue("values", "1;2.5; 3 ;"), [1, 2.5, 3])
+    self.assertEqual(parseValue("keyTimes", "0;0.5;1"), [0, 0.5, 1])
+    self.assertEqual(parseValue("values", "visible;hidden"),
+      ["visible", "hidden"])
+    paths = parseValue("values", "M0 0L1 1;M1 1L2.26 2")
+    self.assertEqual([path.serialize(1) for path in paths],
+      ["M0 0 1 1", "M1 1 2.3 2"])
+
+  def testDropsUnknown(self):
+    text = b'<svg width="10" foo="1"><blink/><circle r="2"><b/></circle></svg>'
+    loader = SvgLoader()
+    root = loader.load(io.BytesIO(text))
+    self.assertEqual(renderBytes(root, True),
+      b'<svg width="10"><circle r="2"/></svg>')
+    self.assertEqual(loader.dropped_elements, {"blink": 1, "b": 1})
+    self.assertEqual(loader.dropped_params, {("svg", "foo"): 1})
+    self.assertRaises(AssertionError, SvgLoader(strict=True).load,
+      io.BytesIO(text))
+
+  def testCallback(self):
+    root = buildDocument()
+    subtrees = []
+    loaded = loadSvg(io.BytesIO(renderBytes(root)), subtrees.append)
+    self.assertEqual(len(loaded.children), 0)
+    self.assertEqual([getShape(subtree) for subtree in subtrees],
+      [getShape(child) for child in root.children])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,181 @@
+# Tests for svg_optimize. Run with: python -m pytest (or python -m unittest).
+
+import unittest
+
+from svg_code import *
+from svg_optimize import *
+from svg_timeline import Timeline
+import svg_graph_generator
+
+def getPath(d, **params):
+  path = Path().param("d", d)
+  for k, v in sorted(params.items()):
+    path.param(k.replace("_", "-"), v)
+  return path
+
+def render(root):
+  return root.render("", True)
+
+# Returns the animated values of a document at a few times, in a form that can
+# be compared across trees.
+def getTimelineShape(root):
+  timeline = Timeline(root)
+  duration = timeline.getDuration()
+  return duration, [sorted((element.tag, sorted((k, str(v))
+    for k, v in values.items())) for element, values in timeline.iterValues(t))
+    for t in [0, 0.3, 1, duration / 2, duration]]
+
+class HoistStylesTest(unittest.TestCase):
+
+  def testHoistToGroups(self):
+    root = Svg().child(*[getPath("M{} 0".format(i), stroke="black",
+      stroke_width=3, fill="none") for i in range(4)])
+    self.assertEqual(hoistToGroups(root), 12)
+    group = root.children[0]
+    self.assertTrue(isinstance(group, G))
+    self.assertEqual(len(group.children), 4)
+    self.assertEqual(group.getParam("stroke"), "black")
+    self.assertEqual(group.children[0].getParam("stroke"), None)
+
+  def testHoistVisibility(self):
+    # Visibility is inherited too, so it is hoisted onto the group like any
+    # other presentation param.
+    root = Svg().child(*[getPath("M{} 0".format(i), stroke="black",
+      visibility="hidden") for i in range(4)])
+    hoistToGroups(root)
+    group = root.children[0]
+    self.assertEqual(group.getParam("visibility"), "hidden")
+    self.assertTrue("visibility" not in render(group.children[0]))
+
+  def testHoistLeavesUniqueParams(self):
+    root = Svg().child(getPath("M0 0", stroke="red"),
+      getPath("M1 0", stroke="blue"))
+    self.assertEqual(hoistToGroups(root), 0)
+    self.assertEqual(len(root.children), 2)
+
+  def testHoistToClasses(self):
+    root = Svg().child(*[getPath("M{} 0".format(i), stroke="black",
+      stroke_width=3, fill="none") for i in range(4)])
+    self.assertEqual(hoistToClasses(root), 12)
+    sheet = root.children[0]
+    self.assertTrue(isinstance(sheet, Style))
+    self.assertEqual(len(sheet.rules), 1)
+    for path in root.children[1:]:
+      self.assertEqual(path.getParam("class"), CLASS_PREFIX + "0")
+      self.assertEqual(path.getParam("stroke"), None)
+
+def getAnimation(attribute, start, end, begin="0s", animation_id=None):
+  animation = Animate().param("attributeName", attribute) \
+    .param("begin", begin).param("dur", "1s").param("fill", "freeze") \
+    .do(start, end)
+  return animation if animation_id is None else animation.id(animation_id)
+
+class RemoveNoopAnimationsTest(unittest.TestCase):
+
+  def testRemovesAndRewires(self):
+    # The middle animation holds cx where the first left it, so it goes, and
+    # the last begins when the first ends instead, a second later.
+    circle = Circle().center(0, 0).child(
+      getAnimation("cx", 0, 5, animation_id="a"),
+      getAnimation("cx", 5, 5, "a.end", "b"),
+      getAnimation("cx", 5, 0, "b.end+0.5s"))
+    root = Svg().child(circle)
+    self.assertEqual(removeNoopAnimations(root), 1)
+    self.assertEqual(len(circle.children), 2)
+    self.assertEqual(circle.children[1].getParam("begin"), "a.end+1.5s")
+
+  def testKeepsAnimationsThatChange(self):
+    circle = Circle().center(0, 0).child(getAnimation("cx", 0, 5),
+      getAnimation("cy", 1, 1))
+    root = Svg().child(circle)
+    self.assertEqual(removeNoopAnimations(root), 0)
+    self.assertEqual(len(circle.children), 2)
+
+  def testRemovesHoldingTheElementsValue(self):
+    circle = Circle().center(3, 0).child(getAnimation("cx", 3, 3.001))
+    root = Svg().precision(2).child(circle)
+    self.assertEqual(removeNoopAnimations(root), 1)
+    self.assertEqual(len(circle.children), 0)
+
+  def testKeepsAnimationsWithUnwirableReferences(self):
+    # A reference to an event can't be rewired, so what it refers to stays.
+    circle = Circle().center(0, 0).child(
+      getAnimation("cx", 0, 0, animation_id="a"),
+      getAnimation("cy", 0, 5, "a.end;a.click"))
+    root = Svg().child(circle)
+    self.assertEqual(removeNoopAnimations(root), 0)
+    self.assertEqual(len(circle.children), 2)
+
+class MergePathsTest(unittest.TestCase):
+
+  def testMergesRuns(self):
+    root = Svg().child(getPath("M0 0L1 1", stroke="black", fill="none"),
+      getPath("m2 2l1 1", stroke="black", fill="none"),
+      getPath("M3 3L4 4", stroke="red", fill="none"),
+      getPath("M5 5L6 6", stroke="red", fill="none").id("p"))
+    self.assertEqual(mergePaths(root), 1)
+    self.assertEqual(len(root.children), 3)
+    self.assertEqual(root.children[0].getParam("d").normalized().serialize(),
+      "M0 0 1 1M2 2 3 3")
+
+  def testKeepsFilledPaths(self):
+    root = Svg().child(getPath("M0 0L1 1", fill="red"),
+      getPath("M2 2L3 3", fill="red"))
+    self.assertEqual(mergePaths(root), 0)
+
+class CollapseGroupsTest(unittest.TestCase):
+
+  def testCollapses(self):
+    circle = Circle()
+    root = Svg().child(G().child(G().child(circle)), G(),
+      G().param("fill", "red").child(Circle()), G().id("g"))
+    self.assertEqual(collapseGroups(root), 3)
+    self.assertEqual([child.tag for child in root.children],
+      ["circle", "g", "g"])
+    self.assertTrue(circle.parent is root)
+
+class DeduplicateTest(unittest.TestCase):
+
+  def testReplacesRepeats(self):
+    def getNode(x):
+      return Circle().center(x, 0).radius(5).param("stroke", "black") \
+        .param("stroke-width", 2).param("fill", "red")
+    root = Svg().child(*[getNode(x) for x in range(4)])
+    before = root.render("", True)
+    self.assertEqual(deduplicate(root), 4)
+    self.assertTrue(isinstance(root.children[0], Defs))
+    self.assertTrue(len(root.render("", True)) < len(before))
+    self.assertEqual([use.getParam("x") for use in root.children[1:]],
+      [0, 1, 2, 3])
+
+  def testKeepsAnimationsInPlace(self):
+    # Repeated animations stay in the elements they animate, and so do the
+    # elements, so the document animates as it did.
+    graph = svg_graph_generator.generateDisplacingGridGraph("grid", 3, 4)
+    root = graph.getSVG()
+    before = getTimelineShape(root)
+    deduplicate(root)
+    self.assertEqual(getTimelineShape(root), before)
+    circle = Circle().child(getAnimation("cx", 0, 5), getAnimation("cx", 0, 5))
+    root = Svg().child(circle)
+    self.assertEqual(deduplicate(root), 0)
+    self.assertEqual(len(circle.children), 2)
+
+class OptimizeTest(unittest.TestCase):
+
+  def testReport(self):
+    circle = Circle().center(0, 0).child(getAnimation("cx", 0, 0))
+    root = Svg().child(G().child(circle))
+    report = optimize(root, DEFAULT_PASSES + [collapseGroups])
+    self.assertEqual(report.elements, 4)
+    self.assertEqual(report.removed(), 2)
+    self.assertEqual([entry[:2] for entry in report.passes],
+      [("noop_animations", 1), ("merge_paths", 0), ("collapse_groups", 1),
+        ("collapseGroups", 0)])
+    self.assertTrue("down to 2" in str(report))
+
+  def testRejectsUnknownPasses(self):
+    self.assertRaises(AssertionError, optimize, Svg(), ["nothing"])
+
+if __name__ == "__main__":
+  unittest.main()
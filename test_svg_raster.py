@@ -0,0 +1,34 @@
+# Tests for svg_raster. Run with: python -m pytest (or python -m unittest).
+
+import unittest
+
+from svg_code import *
+from svg_raster import *
+
+# Returns the color of the pixel at the given column and row.
+def getPixel(canvas, i, j):
+  return tuple(bytearray(canvas.getRows()[j])[3 * i:3 * i + 3])
+
+class DrawTest(unittest.TestCase):
+
+  def testUsesSymbols(self):
+    # A symbol is drawn where it's used, but not where it's defined.
+    symbol = Symbol().id("s").child(Circle().center(0, 0).radius(3)
+      .param("fill", "red"))
+    root = Svg().size(20, 20).child(Defs().child(symbol),
+      Use().link("s").position(10, 10))
+    canvas = Rasterizer(root).frame()
+    self.assertEqual(getPixel(canvas, 10, 10), (255, 0, 0))
+    self.assertEqual(getPixel(canvas, 0, 0), BACKGROUND)
+
+  def testUsesElements(self):
+    root = Svg().size(20, 20).child(
+      Defs().child(Circle().id("c").center(0, 0).radius(3)
+        .param("fill", "red")),
+      Use().link("c").position(10, 10))
+    canvas = Rasterizer(root).frame()
+    self.assertEqual(getPixel(canvas, 10, 10), (255, 0, 0))
+    self.assertEqual(getPixel(canvas, 0, 0), BACKGROUND)
+
+if __name__ == "__main__":
+  unittest.main()